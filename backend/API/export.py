@@ -0,0 +1,142 @@
+# export.py
+#
+# Full conversation export for compliance requests: a room's merged text and
+# file timeline, oldest first, streamed as NDJSON (default) or CSV, and
+# optionally gzipped on the fly. Rows come out of merge_timeline in
+# EXPORT_CHUNK_SIZE database chunks and leave in ~64 KiB response chunks,
+# so memory stays flat however long the conversation is.
+#
+# Under ASGI the response gets an async iterator that pulls each chunk from
+# the synchronous generator in the request's DB thread; handing Django a
+# plain iterator there would make it buffer the whole export first.
+
+import csv
+import io
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from app import codec
+from app.models import Message, UploadedFile
+from app.rooms import room_peer
+from .media import QueryParamJWTAuthentication
+from .pagination import merge_timeline, seek
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+FLUSH_BYTES = 64 * 1024
+
+FIELDS = ['type', 'id', 'timestamp', 'sender', 'receiver', 'message', 'file_name', 'file_type', 'size', 'file_url']
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def export_record(kind, obj):
+    record = {
+        'type': kind,
+        'id': obj.pk,
+        'timestamp': obj.timestamp.isoformat(),
+        'sender': obj.sender.username,
+        'receiver': obj.receiver.username,
+        'message': obj.message,
+        'file_name': None,
+        'file_type': None,
+        'size': None,
+        'file_url': None,
+    }
+    if kind == 'file':
+        record.update(file_name=obj.file_name, file_type=obj.file_type, size=obj.size, file_url=obj.file.url)
+    return record
+
+
+def timeline_rows(room_name):
+    text_messages = seek(Message.objects.filter(room_name=room_name).select_related('sender', 'receiver'), 'text')
+    file_messages = seek(UploadedFile.objects.filter(room_name=room_name).select_related('sender', 'receiver'), 'file')
+    return merge_timeline(text_messages, file_messages, forward=True, chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def ndjson_lines(rows):
+    for kind, obj in rows:
+        yield codec.dumps(export_record(kind, obj)) + '\n'
+
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+    writer.writeheader()
+    for kind, obj in rows:
+        writer.writerow(export_record(kind, obj))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_chunks(lines, compress=False):
+    """Join encoded lines into ~FLUSH_BYTES chunks, gzipping them if asked."""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    pending, size = [], 0
+    for line in lines:
+        data = line.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= FLUSH_BYTES:
+            chunk = b''.join(pending)
+            pending, size = [], 0
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+    chunk = b''.join(pending)
+    if compressor is not None:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+async def aiterate(iterator):
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while True:
+        chunk = await next_chunk(iterator, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+class ConversationExportView(APIView):
+    # ?token= too, so the export can be a plain download link
+    authentication_classes = [QueryParamJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, room_name):
+        if room_peer(room_name, request.user.username) is None:
+            return Response({"error": "Room not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        # Not ?format=, which DRF keeps for renderer selection
+        fmt = request.query_params.get('fmt', 'ndjson')
+        if fmt not in CONTENT_TYPES:
+            return Response({"error": "fmt must be 'ndjson' or 'csv'."}, status=status.HTTP_400_BAD_REQUEST)
+        compress = request.query_params.get('gzip', '0').lower() in ('1', 'true', 'yes')
+
+        lines = (csv_lines if fmt == 'csv' else ndjson_lines)(timeline_rows(room_name))
+        chunks = export_chunks(lines, compress)
+        if isinstance(request._request, ASGIRequest):
+            chunks = aiterate(chunks)
+
+        filename = f"{room_name}.{fmt}" + ('.gz' if compress else '')
+        response = StreamingHttpResponse(
+            chunks, content_type='application/gzip' if compress else CONTENT_TYPES[fmt],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['Cache-Control'] = 'no-store'
+        return response
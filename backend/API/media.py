@@ -0,0 +1,217 @@
+# media.py
+#
+# Serves MEDIA_ROOT for uploaded files and profile photos in place of
+# django.conf.urls.static, which only works with DEBUG on and knows nothing
+# about byte ranges, conditional requests or who may see a file.
+#
+# - Single byte ranges (Range / If-Range) for seeking in audio and video.
+# - ETag / Last-Modified with 304s. Content-addressed blobs are immutable, so
+#   they get a year-long cache lifetime and their hash as the ETag.
+# - Zero-copy where the server supports it: with MEDIA_ACCEL_REDIRECT_PREFIX
+#   set, the file is handed to the front proxy (nginx X-Accel-Redirect);
+#   otherwise FileResponse lets WSGI servers use sendfile via
+#   wsgi.file_wrapper. Under ASGI the file is read a block at a time off
+#   the event loop instead: Django would buffer a sync iterator whole.
+# - Uploaded files are only served to a participant of a room they were
+#   sent in. <img>/<video> tags can't send headers, so the access token may
+#   also come as ?token=.
+
+import mimetypes
+import os
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from app.models import UploadedFile
+from app.storage import blob_sha256
+from app.thumbnails import VARIANTS
+
+ACCEL_REDIRECT_PREFIX = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', None)
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+DEFAULT_MAX_AGE = getattr(settings, 'MEDIA_MAX_AGE', 60 * 60)
+
+STREAM_BLOCK_SIZE = 64 * 1024
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+VARIANT_SUFFIX = re.compile(rf"\.({'|'.join(map(re.escape, VARIANTS))})\.(webp|jpg)$")
+
+media_storage = FileSystemStorage()
+
+
+class QueryParamJWTAuthentication(JWTAuthentication):
+    # Authorization header first, ?token= for media tags that can't set one
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            return result
+        raw_token = request.query_params.get('token')
+        if not raw_token:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return self.get_user(validated_token), validated_token
+
+
+class RangeFile:
+    """Read-only view of ``length`` bytes of ``file`` starting at ``start``."""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        # wsgi.file_wrapper sendfiles from the current offset for
+        # Content-Length bytes
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+async def aread_blocks(file):
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        while True:
+            data = await read(STREAM_BLOCK_SIZE)
+            if not data:
+                return
+            yield data
+    finally:
+        await sync_to_async(file.close, thread_sensitive=False)()
+
+
+def parse_range(header, size):
+    """(start, end) for a single satisfiable range, None to send it all, or
+    False when the range can't be satisfied."""
+    match = RANGE.match(header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        # Multiple or malformed ranges: ignoring them is allowed
+        return None
+    first, last = match.group(1), match.group(2)
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def can_access(user, name):
+    if name.startswith('profile_photos/'):
+        return True
+    if name.startswith('uploaded_files/'):
+        original = VARIANT_SUFFIX.sub('', name)
+        return UploadedFile.objects.filter(file=original).filter(Q(sender=user) | Q(receiver=user)).exists()
+    return False
+
+
+class MediaView(APIView):
+    authentication_classes = [QueryParamJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, path):
+        name = os.path.normpath(path).replace(os.sep, '/')
+        if not can_access(request.user, name):
+            raise Http404
+
+        try:
+            full_path = media_storage.path(name)
+        except SuspiciousFileOperation:
+            raise Http404
+        try:
+            stat = os.stat(full_path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise Http404
+
+        size = stat.st_size
+        immutable = blob_sha256(name) is not None
+        etag = quote_etag(blob_sha256(name) if immutable and not VARIANT_SUFFIX.search(name) else f"{stat.st_mtime_ns:x}-{size:x}")
+        last_modified = http_date(stat.st_mtime)
+
+        headers = {
+            'ETag': etag,
+            'Last-Modified': last_modified,
+            'Accept-Ranges': 'bytes',
+            'Cache-Control': f"private, max-age={IMMUTABLE_MAX_AGE}, immutable" if immutable else f"private, max-age={DEFAULT_MAX_AGE}",
+        }
+
+        if self.not_modified(request, etag, stat.st_mtime):
+            response = HttpResponse(status=304)
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+        byte_range = None
+        range_header = request.headers.get('Range')
+        if range_header and self.if_range_matches(request, etag, stat.st_mtime):
+            byte_range = parse_range(range_header, size)
+            if byte_range is False:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f"bytes */{size}"
+                return response
+
+        start, end = byte_range if byte_range else (0, size - 1)
+        length = end - start + 1 if size else 0
+
+        if ACCEL_REDIRECT_PREFIX:
+            # The proxy re-evaluates Range itself and serves with sendfile
+            response = HttpResponse()
+            response['X-Accel-Redirect'] = f"{ACCEL_REDIRECT_PREFIX.rstrip('/')}/{name}"
+            del response['Content-Type']
+        else:
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            body = RangeFile(open(full_path, 'rb'), start, length)
+            if isinstance(request._request, ASGIRequest):
+                response = StreamingHttpResponse(aread_blocks(body), content_type=content_type)
+                # Also closed if the client goes away before the end
+                response._resource_closers.append(body.close)
+            else:
+                response = FileResponse(body, content_type=content_type)
+            response['Content-Length'] = length
+            if byte_range:
+                response.status_code = 206
+                response['Content-Range'] = f"bytes {start}-{end}/{size}"
+
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    def not_modified(self, request, etag, mtime):
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            client_etags = [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+            return etag in client_etags or '*' in client_etags
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        return if_modified_since is not None and int(mtime) <= if_modified_since
+
+    def if_range_matches(self, request, etag, mtime):
+        if_range = request.headers.get('If-Range')
+        if not if_range:
+            return True
+        if if_range.startswith('"'):
+            return if_range == etag
+        since = parse_http_date_safe(if_range)
+        return since is not None and int(mtime) <= since
@@ -0,0 +1,151 @@
+# pagination.py
+#
+# Keyset (cursor) pagination over a room's merged text + file timeline.
+#
+# Both tables are ordered by (timestamp, kind, id) where text rows sort before
+# file rows on equal timestamps. A cursor is that tuple encoded as an opaque
+# url-safe string, so every page is an index range scan on
+# (room_name, timestamp, id) no matter how large the room is.
+
+import base64
+import hashlib
+import heapq
+import sys
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+DEFAULT_PAGE_SIZE = getattr(settings, 'MESSAGE_PAGE_SIZE', 50)
+MAX_PAGE_SIZE = getattr(settings, 'MESSAGE_PAGE_SIZE_MAX', 200)
+
+# Tie-break order between the two tables on equal timestamps
+KIND_RANK = {'text': 0, 'file': 1}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, kind, pk):
+    raw = f"{timestamp.isoformat()}|{kind}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, kind, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        if kind not in KIND_RANK:
+            raise ValueError(kind)
+        return datetime.fromisoformat(timestamp), kind, int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def parse_since(value):
+    """
+    ``since`` takes either a cursor or an ISO 8601 timestamp. A timestamp is
+    turned into a cursor that sits after every row stamped at that instant.
+    """
+    try:
+        return decode_cursor(value)
+    except InvalidCursor:
+        pass
+    try:
+        timestamp = parse_datetime(value)
+    except ValueError:
+        timestamp = None
+    if timestamp is None:
+        raise InvalidCursor(f"Invalid since: {value}")
+    if timestamp.tzinfo is None:
+        raise InvalidCursor(f"since timestamp needs a UTC offset: {value}")
+    return timestamp, 'file', sys.maxsize
+
+
+def parse_page_size(value):
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        raise InvalidCursor(f"Invalid page_size: {value}")
+    if size < 1:
+        raise InvalidCursor(f"Invalid page_size: {value}")
+    return min(size, MAX_PAGE_SIZE)
+
+
+def sort_key(kind, obj):
+    return (obj.timestamp, KIND_RANK[kind], obj.pk)
+
+
+def row_cursor(kind, obj):
+    return encode_cursor(obj.timestamp, kind, obj.pk)
+
+
+def _seek_q(kind, cursor, forward):
+    """
+    Rows of table ``kind`` strictly after (forward) or before the cursor in
+    (timestamp, kind, id) order.
+    """
+    timestamp, cursor_kind, pk = cursor
+    rank, cursor_rank = KIND_RANK[kind], KIND_RANK[cursor_kind]
+
+    if forward:
+        q = Q(timestamp__gt=timestamp)
+        if rank > cursor_rank:
+            q |= Q(timestamp=timestamp)
+        elif rank == cursor_rank:
+            q |= Q(timestamp=timestamp, id__gt=pk)
+    else:
+        q = Q(timestamp__lt=timestamp)
+        if rank < cursor_rank:
+            q |= Q(timestamp=timestamp)
+        elif rank == cursor_rank:
+            q |= Q(timestamp=timestamp, id__lt=pk)
+    return q
+
+
+def seek(queryset, kind, cursor=None, forward=True):
+    """
+    Order ``queryset`` along the timeline index, starting just past ``cursor``.
+    Backward pages come out newest-first; callers reverse them.
+    """
+    if cursor is not None:
+        queryset = queryset.filter(_seek_q(kind, cursor, forward))
+    if forward:
+        return queryset.order_by('timestamp', 'id')
+    return queryset.order_by('-timestamp', '-id')
+
+
+def merge_timeline(text_messages, file_messages, forward=True, chunk_size=None):
+    """
+    Lazily merge two querysets already ordered by ``seek`` into one stream of
+    (kind, obj) rows. Rows are pulled from the database only as the merge
+    consumes them, ``chunk_size`` at a time, so nothing past the page the
+    caller keeps is materialized or serialized.
+    """
+    return heapq.merge(
+        (('text', m) for m in text_messages.iterator(chunk_size=chunk_size)),
+        (('file', f) for f in file_messages.iterator(chunk_size=chunk_size)),
+        key=lambda row: sort_key(*row),
+        reverse=not forward,
+    )
+
+
+def timeline_etag(room_name, query_params):
+    """
+    Strong ETag for one history response: the newest text and file row in the
+    room plus the query that selected the page. Both lookups are single index
+    seeks, so a 304 costs two tiny queries and no serialization.
+    """
+    from app.models import Message, UploadedFile
+
+    latest_text = seek(Message.objects.filter(room_name=room_name), 'text', forward=False).values_list('id', flat=True).first()
+    latest_file = seek(UploadedFile.objects.filter(room_name=room_name), 'file', forward=False).values_list('id', flat=True).first()
+    query = '&'.join(f"{key}={query_params.get(key)}" for key in sorted(query_params))
+
+    digest = hashlib.sha1(f"{room_name}|{latest_text}|{latest_file}|{query}".encode()).hexdigest()
+    return f'"{digest}"'
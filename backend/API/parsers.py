@@ -0,0 +1,14 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from app.codec import codec
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser backed by app.codec."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return codec.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError(f"JSON parse error - {str(exc)}")
@@ -0,0 +1,28 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from app.codec import codec
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by app.codec, byte for byte the same as DRF's.
+    Types the codec doesn't know natively (lazy strings, Decimals,
+    querysets...) and datetimes, which DRF writes with a "Z" suffix, go
+    through DRF's own encoder. U+2028 / U+2029 are escaped as DRF does, for
+    JSON embedded in <script>. Indented output for ?indent /
+    Accept: ...; indent=N stays with the stdlib renderer.
+    """
+
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = codec.dumpb(data, default=self.encoder.default, passthrough_datetime=True)
+        if b'\xe2\x80' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
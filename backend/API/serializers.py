@@ -1,7 +1,8 @@
-from rest_framework.serializers import ModelSerializer, CharField, ValidationError , ImageField
+from rest_framework.serializers import ModelSerializer, CharField, ValidationError , ImageField, SerializerMethodField
 from django.contrib.auth.models import User
 
 from app.models import *
+from app.thumbnails import variant_urls
 
 
 
@@ -29,10 +30,23 @@ class ContactListSerializer(ModelSerializer):
     login_user = CharField(source='user.username', read_only=True)
     name = CharField(source='contacts.username', read_only=True)
     avatar = ImageField(source='contacts.userprofile.profile_photo', read_only=True)  # get profile photo of contact user
+    avatar_thumbnails = SerializerMethodField()
+    last_message = SerializerMethodField()
+    unread_count = SerializerMethodField()
 
     class Meta:
         model = ContactList
-        fields = ['login_user', 'name', 'avatar']
+        fields = ['login_user', 'name', 'avatar', 'avatar_thumbnails', 'last_message', 'unread_count']
+
+    def get_avatar_thumbnails(self, obj):
+        return variant_urls(obj.contacts.userprofile.profile_photo)
+
+    # Both are attached by app.contacts.get_contacts
+    def get_last_message(self, obj):
+        return getattr(obj, 'last_message', None)
+
+    def get_unread_count(self, obj):
+        return getattr(obj, 'unread_count', 0)
 
 
 
@@ -77,6 +91,7 @@ class MessageSerializer( ModelSerializer) :
 class UploadedFileSerializer(ModelSerializer):
     sender = CharField(source='sender.username', read_only=True)  # Add sender username
     receiver = CharField(source='receiver.username', read_only=True)  # Add receiver username
+    thumbnails = SerializerMethodField()  # small image variants, original until rendered
 
     class Meta:
 
@@ -86,6 +101,9 @@ class UploadedFileSerializer(ModelSerializer):
             'room_name': {'write_only': True},  # Hide room_name from output
         }
 
+    def get_thumbnails(self, obj):
+        return variant_urls(obj.file)
+
 
 
 
@@ -95,6 +113,11 @@ class TextMessageSerializer(ModelSerializer):
         fields = '__all__'
 
 class FileMessageSerializer(ModelSerializer):
+    thumbnails = SerializerMethodField()
+
     class Meta:
         model = UploadedFile
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+    def get_thumbnails(self, obj):
+        return variant_urls(obj.file)
\ No newline at end of file
@@ -0,0 +1,392 @@
+# uploads.py
+#
+# Resumable chunked uploads, for files too large to send as one multipart
+# request through FileUploadView:
+#
+#   POST upload-file/chunked/                 -> start, returns the upload id, or
+#                                                the finished file right away when
+#                                                a known sha256 is sent along
+#   PUT  upload-file/chunked/<id>/            -> one chunk, with
+#                                                Content-Range: bytes <start>-<end>/<total>
+#   GET  upload-file/chunked/<id>/            -> committed offset, to resume
+#   POST upload-file/chunked/<id>/finalize/   -> creates the UploadedFile; a
+#                                                retry returns the same file
+#
+# Each chunk is copied into a part file, and the size and SHA-256 are
+# computed as the bytes go by. Chunks are capped at
+# CHUNKED_UPLOAD_MAX_CHUNK_SIZE. Under ASGI (uvicorn), Django reads the
+# whole request body into a SpooledTemporaryFile before the view runs, and a
+# client that disconnects mid-body aborts the request. So a chunk is
+# committed whole or not at all, and the cap bounds what a failed chunk
+# costs to resend. Only under WSGI is the body read straight off the
+# socket, where a short chunk is committed and resumed mid-chunk.
+#
+# A PUT first leases the upload row with a conditional UPDATE, so two
+# requests can never write the part file at once; a lease outlives a
+# crashed writer by at most CHUNKED_UPLOAD_LEASE_SECONDS. Uploads untouched
+# for CHUNKED_UPLOAD_EXPIRY_SECONDS are treated as gone, and
+# `manage.py cleanup_chunked_uploads` removes them. Every write to the
+# upload row goes through the SQLite writer (run_write, see app/sqlite.py).
+
+import hashlib
+import logging
+import os
+import re
+from collections import OrderedDict
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from app.metrics import CHANNEL_SEND_FAILURES, UPLOAD_BYTES
+from app.models import ChunkedUpload, UploadedFile
+from app.rooms import room_name_for
+from app.sqlite import run_write
+from app.storage import blob_storage, find_blob, lock_blob
+from .serializers import UploadedFileSerializer
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+MAX_UPLOAD_SIZE = getattr(settings, 'CHUNKED_UPLOAD_MAX_SIZE', 2 * 1024 ** 3)
+MAX_CHUNK_SIZE = getattr(settings, 'CHUNKED_UPLOAD_MAX_CHUNK_SIZE', 8 * 1024 ** 2)
+EXPIRY = timedelta(seconds=getattr(settings, 'CHUNKED_UPLOAD_EXPIRY_SECONDS', 24 * 3600))
+LEASE = timedelta(seconds=getattr(settings, 'CHUNKED_UPLOAD_LEASE_SECONDS', 600))
+HASHER_CACHE_SIZE = getattr(settings, 'CHUNKED_UPLOAD_HASHER_CACHE_SIZE', 1000)
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+# upload id -> (offset, sha256) for uploads this process is writing, so the
+# hash never has to re-read bytes that already went through it. An LRU:
+# abandoned uploads fall out instead of piling up.
+_hashers = OrderedDict()
+
+
+def part_dir():
+    return os.path.join(settings.MEDIA_ROOT, 'chunked_uploads')
+
+
+def part_path(upload):
+    return os.path.join(part_dir(), f"{upload.id}.part")
+
+
+def live_uploads():
+    return ChunkedUpload.objects.filter(updated_at__gte=timezone.now() - EXPIRY)
+
+
+def _remember_hasher(upload_id, offset, hasher):
+    _hashers[upload_id] = (offset, hasher)
+    _hashers.move_to_end(upload_id)
+    while len(_hashers) > HASHER_CACHE_SIZE:
+        _hashers.popitem(last=False)
+
+
+def _hasher_at(upload, offset):
+    entry = _hashers.get(upload.id)
+    if entry is not None and entry[0] == offset:
+        # A copy: a writer whose lease ran out must not advance the cached one
+        return entry[1].copy()
+
+    # Earlier chunks went through another worker (or this one restarted):
+    # hash the committed bytes once and carry on from there
+    hasher = hashlib.sha256()
+    remaining = offset
+    with open(part_path(upload), 'rb') as part:
+        while remaining:
+            data = part.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            hasher.update(data)
+            remaining -= len(data)
+    return hasher
+
+
+def _upload_status(upload):
+    return {
+        "upload_id": str(upload.id),
+        "offset": upload.offset,
+        "size": upload.total_size,
+    }
+
+
+def broadcast_file_message(request, uploaded_file, size):
+    # Same event ChatConsumer.receive sends for a client-announced upload
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            f"chat_{uploaded_file.room_name}",
+            {
+                "type": "file_message",
+                "message": uploaded_file.message,
+                "sender": uploaded_file.sender.username,
+                "receiver": uploaded_file.receiver.username,
+                "file_type": uploaded_file.file_type,
+                "file_url": request.build_absolute_uri(uploaded_file.file.url),
+                "timestamp": uploaded_file.timestamp.isoformat(),
+                "file_name": uploaded_file.file_name,
+                "size": size,
+            }
+        )
+    except Exception as e:
+        CHANNEL_SEND_FAILURES.inc('upload')
+        logger.error(f"Failed to broadcast upload {uploaded_file.id} to {uploaded_file.room_name}: {str(e)}")
+
+
+class ChunkedUploadInitView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        receiver_username = request.data.get('receiver')
+        room_name = request.data.get('room_name')
+        file_name = request.data.get('file_name')
+        size = request.data.get('size')
+
+        if not all([receiver_username, room_name, file_name, size]):
+            return Response({"error": "Missing one or more required fields."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            return Response({"error": "Invalid size."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if size <= 0 or size > MAX_UPLOAD_SIZE:
+            return Response({"error": f"Size must be between 1 and {MAX_UPLOAD_SIZE} bytes."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            receiver = User.objects.get(username=receiver_username)
+        except User.DoesNotExist:
+            return Response({"error": "Receiver not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        if room_name != room_name_for(request.user.username, receiver.username):
+            return Response({"error": "room_name is not your room with the receiver."}, status=status.HTTP_403_FORBIDDEN)
+
+        message = request.data.get('message')
+        if message == 'optional message':
+            message = ''
+
+        # Upload by hash: if the sender already has these bytes in one of
+        # their chats there is nothing to transfer, the file message is
+        # created right away. Otherwise this is an ordinary upload, whether
+        # or not someone else stored the same bytes.
+        sha256 = (request.data.get('sha256') or '').lower()
+        existing = find_blob(sha256, request.user) if sha256 else None
+        uploaded_file = None
+        if existing:
+            size = blob_storage.size(existing)
+
+            def create():
+                with transaction.atomic():
+                    if not lock_blob(existing):
+                        return None
+                    return UploadedFile.objects.create(
+                        sender=request.user,
+                        receiver=receiver,
+                        room_name=room_name,
+                        file=existing,
+                        file_type=request.data.get('file_type'),
+                        file_name=file_name,
+                        message=message,
+                        size=size // 1000   #size in kb
+                    )
+
+            uploaded_file = run_write(create)
+        if uploaded_file is not None:
+            broadcast_file_message(request, uploaded_file, size)
+            data = dict(UploadedFileSerializer(uploaded_file).data, sha256=sha256, deduplicated=True)
+            return Response(data, status=status.HTTP_201_CREATED)
+
+        upload = run_write(
+            ChunkedUpload.objects.create,
+            sender=request.user,
+            receiver=receiver,
+            room_name=room_name,
+            file_type=request.data.get('file_type'),
+            file_name=file_name,
+            message=message,
+            total_size=size,
+        )
+
+        os.makedirs(os.path.dirname(part_path(upload)), exist_ok=True)
+        open(part_path(upload), 'wb').close()
+
+        return Response(_upload_status(upload), status=status.HTTP_201_CREATED)
+
+
+class ChunkedUploadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_upload(self, request, upload_id):
+        return live_uploads().filter(id=upload_id, sender=request.user).first()
+
+    def get(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        if upload is None:
+            return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(_upload_status(upload), status=status.HTTP_200_OK)
+
+    def put(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        if upload is None:
+            return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        match = CONTENT_RANGE.match(request.headers.get('Content-Range', ''))
+        if not match:
+            return Response({"error": "Content-Range: bytes <start>-<end>/<total> is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        start, end = int(match.group(1)), int(match.group(2))
+        if end < start or end >= upload.total_size:
+            return Response({"error": "Chunk is outside the file."}, status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        if end - start + 1 > MAX_CHUNK_SIZE:
+            return Response({"error": f"Chunks may be at most {MAX_CHUNK_SIZE} bytes."}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        # Chunks must continue exactly where the committed bytes end
+        if start != upload.offset:
+            return Response(dict(_upload_status(upload), error="Chunk does not start at the committed offset."), status=status.HTTP_409_CONFLICT)
+
+        # Lease the row before touching the part file. A conditional UPDATE
+        # rather than SELECT ... FOR UPDATE: it works on SQLite too, and no
+        # transaction is held open while the chunk streams in.
+        now = timezone.now()
+        lease = now + LEASE
+        claimed = run_write(ChunkedUpload.objects.filter(
+            Q(locked_until__isnull=True) | Q(locked_until__lt=now), id=upload.id, offset=start,
+        ).update, locked_until=lease, updated_at=now)
+        if not claimed:
+            upload.refresh_from_db()
+            return Response(dict(_upload_status(upload), error="Another chunk is being written."), status=status.HTTP_409_CONFLICT)
+
+        committed = False
+        try:
+            hasher = _hasher_at(upload, start)
+            remaining = end - start + 1
+            written = 0
+
+            # request.data is never touched, so the body is not parsed or
+            # copied again. Under ASGI the stream is Django's spooled copy of
+            # the whole chunk; under WSGI it is the socket.
+            with open(part_path(upload), 'r+b') as part:
+                part.seek(start)
+                part.truncate()
+                while remaining:
+                    data = request.stream.read(min(READ_SIZE, remaining)) if request.stream else b''
+                    if not data:
+                        break
+                    part.write(data)
+                    hasher.update(data)
+                    written += len(data)
+                    remaining -= len(data)
+                part.flush()
+                os.fsync(part.fileno())
+
+            # Commit whatever arrived, even a short chunk (WSGI only, see
+            # above), so a retry can resume mid-chunk. Only while the lease
+            # is still ours.
+            new_offset = start + written
+            committed = run_write(
+                ChunkedUpload.objects.filter(id=upload.id, offset=start, locked_until=lease).update,
+                offset=new_offset, locked_until=None, updated_at=timezone.now(),
+            )
+        finally:
+            if not committed:
+                _hashers.pop(upload.id, None)
+                run_write(ChunkedUpload.objects.filter(id=upload.id, locked_until=lease).update, locked_until=None)
+
+        if not committed:
+            upload.refresh_from_db()
+            return Response(dict(_upload_status(upload), error="Upload was modified concurrently."), status=status.HTTP_409_CONFLICT)
+
+        _remember_hasher(upload.id, new_offset, hasher)
+        upload.offset = new_offset
+        UPLOAD_BYTES.inc('chunked', amount=written)
+
+        if remaining:
+            return Response(dict(_upload_status(upload), error="Chunk was cut short."), status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(_upload_status(upload), status=status.HTTP_200_OK)
+
+
+class ChunkedUploadFinalizeView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        upload = live_uploads().filter(id=upload_id, sender=request.user).select_related(
+            'sender', 'receiver', 'uploaded_file'
+        ).first()
+        if upload is None:
+            return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        # Already finalized: a retry after a lost response gets the same file
+        if upload.uploaded_file is not None:
+            return self.finalized(upload, status.HTTP_200_OK)
+
+        if upload.offset != upload.total_size:
+            return Response(dict(_upload_status(upload), error="Upload is incomplete."), status=status.HTTP_409_CONFLICT)
+
+        try:
+            # A retry after the part file already moved into the store has
+            # the hash on the row
+            sha256 = upload.sha256 or _hasher_at(upload, upload.offset).hexdigest()
+        except FileNotFoundError:
+            return Response({"error": "Upload data is gone, start again."}, status=status.HTTP_410_GONE)
+
+        expected = request.data.get('sha256')
+        if expected and expected.lower() != sha256:
+            return Response({"error": "Checksum mismatch.", "sha256": sha256}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The hash is already known, so the part file moves straight into the
+        # content-addressed store (or is dropped if it's a duplicate)
+        def store():
+            with transaction.atomic():
+                try:
+                    name = blob_storage.adopt(part_path(upload), sha256, upload.file_name)
+                except FileNotFoundError:
+                    # Moved by an earlier attempt
+                    name = blob_storage.blob_name(sha256, upload.file_name)
+                    if not blob_storage.exists(name):
+                        raise
+
+                uploaded_file = UploadedFile.objects.create(
+                    sender=upload.sender,
+                    receiver=upload.receiver,
+                    room_name=upload.room_name,
+                    file=name,
+                    file_type=upload.file_type,
+                    file_name=upload.file_name,
+                    message=upload.message,
+                    size=upload.total_size // 1000   #size in kb
+                )
+                # A concurrent finalize may have won; then this one's file goes
+                if not ChunkedUpload.objects.filter(id=upload.id, uploaded_file__isnull=True).update(uploaded_file=uploaded_file):
+                    transaction.set_rollback(True)
+                    return None
+                return uploaded_file
+
+        try:
+            run_write(ChunkedUpload.objects.filter(id=upload.id).update, sha256=sha256, updated_at=timezone.now())
+            uploaded_file = run_write(store)
+        except FileNotFoundError:
+            return Response({"error": "Upload data is gone, start again."}, status=status.HTTP_410_GONE)
+        except Exception as e:
+            logger.error(f"Error finalizing upload {upload.id}: {str(e)}")
+            return Response({"error": "Failed to finalize upload."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        _hashers.pop(upload.id, None)
+        upload.refresh_from_db()
+
+        if uploaded_file is None:
+            return self.finalized(upload, status.HTTP_200_OK)
+
+        broadcast_file_message(request, uploaded_file, upload.total_size)
+        return self.finalized(upload, status.HTTP_201_CREATED)
+
+    def finalized(self, upload, status_code):
+        data = dict(UploadedFileSerializer(upload.uploaded_file).data, sha256=upload.sha256)
+        return Response(data, status=status_code)
@@ -5,6 +5,8 @@ from rest_framework_simplejwt.views import (
 )
 
 from .views import *
+from .export import ConversationExportView
+from .uploads import ChunkedUploadFinalizeView, ChunkedUploadInitView, ChunkedUploadView
 
 urlpatterns = [
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
@@ -16,5 +18,10 @@ urlpatterns = [
     path('user/private-key/', UserPrivateKeyView.as_view(), name='user_private_key'),
     path('get-user/', GetUserView.as_view(), name='get_user'),
     path('messages/<str:contact>/', MessageListView.as_view(), name='message_list'),
+    path('search/', MessageSearchView.as_view(), name='message_search'),
+    path('export/<str:room_name>/', ConversationExportView.as_view(), name='conversation_export'),
     path('upload-file/', FileUploadView.as_view(), name='upload-file'),
+    path('upload-file/chunked/', ChunkedUploadInitView.as_view(), name='chunked_upload_init'),
+    path('upload-file/chunked/<uuid:upload_id>/', ChunkedUploadView.as_view(), name='chunked_upload'),
+    path('upload-file/chunked/<uuid:upload_id>/finalize/', ChunkedUploadFinalizeView.as_view(), name='chunked_upload_finalize'),
 ]
@@ -1,6 +1,7 @@
 # views.py
-from itertools import chain
+from itertools import islice
 from django.utils import timezone
+from django.utils.http import parse_etags
 import json
 from rest_framework import status
 from rest_framework.views import APIView
@@ -8,12 +9,28 @@ from rest_framework.response import Response
 from django.contrib.auth.models import User
 from rest_framework.permissions import AllowAny , IsAuthenticated
 from rest_framework.serializers import ModelSerializer, CharField, ValidationError
-from app.models import OTP, ContactList, UserProfile
+from app.models import OTP, ContactList, Conversation, UserProfile
+from app.contacts import CONTACT_LIST_CACHE_TIMEOUT, contact_list_cache_key, get_contacts, invalidate_contact_lists
+from app.conversations import mark_chat_read
+from app.routers import primary_reads, replica_reads
+from app.search import search_messages
+from app.sqlite import run_write
+from app.storage import blob_storage, discard_adopted
+from app.rooms import room_name_for, room_peer
+from app.logs import log_event
+from app.mail import send_mail_async
+from app.metrics import UPLOAD_BYTES
 from .serializers import *
-from django.core.mail import send_mail
+from .pagination import (
+    InvalidCursor, decode_cursor, merge_timeline, parse_page_size, parse_since, row_cursor, seek, timeline_etag,
+)
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
 import random
 import logging
+import os
 from django.core.exceptions import ObjectDoesNotExist
 from uuid import UUID
 
@@ -29,7 +46,7 @@ class SignupView(APIView):
     def post(self, request):
         serializer = SignupSerializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save()
+            user = run_write(serializer.save)
             return Response({"message": "User created successfully"}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -50,21 +67,20 @@ class SendOtpView(APIView):
         otp_code = generate_otp()
 
         # Update or create OTP entry
-        otp_obj, created = OTP.objects.update_or_create(
+        otp_obj, created = run_write(
+            OTP.objects.update_or_create,
             email=email,
             defaults={'otp_code': otp_code, 'created_at': timezone.now()}
         )
 
-        try:
-            send_mail(
-                'Your OTP Code',
-                f'Your OTP is {otp_code}',
-                settings.EMAIL_HOST_USER,
-                [email],
-                fail_silently=False,
-            )
-        except Exception as e:
-            return Response({"error": f"Failed to send email: {str(e)}"}, status=500)
+        # Delivered in the background (retried on SMTP errors); the OTP row
+        # is all the client needs to wait for
+        send_mail_async(
+            'Your OTP Code',
+            f'Your OTP is {otp_code}',
+            settings.EMAIL_HOST_USER,
+            [email],
+        )
 
         return Response({"message": "OTP sent successfully"}, status=200)
 
@@ -95,19 +111,23 @@ class VerifyOtpView(APIView):
         if otp_obj.otp_code != otp:
             return Response({"error": "Invalid OTP."}, status=400)
 
-        # OTP is valid — you can delete it now or keep for auditing
-        otp_obj.delete()
+        # OTP is valid — delete it and create the user in one write
+        def create_user():
+            otp_obj.delete()
 
-        user = User.objects.create(
-            first_name = first_name , 
-            last_name = last_name , 
-            username = username , 
-            email = email
-        )
+            user = User.objects.create(
+                first_name = first_name , 
+                last_name = last_name , 
+                username = username , 
+                email = email
+            )
+
+            user.set_password( password)
 
-        user.set_password( password)
+            user.save()
+            return user
 
-        user.save()
+        user = run_write(create_user)
 
         
 
@@ -120,11 +140,19 @@ class VerifyOtpView(APIView):
 class ContactListView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @replica_reads
     def get(self, request):
         try:
-            contacts = ContactList.objects.filter(user=request.user)
-            serializer = ContactListSerializer(contacts, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            cache_key = contact_list_cache_key(request.user.id)
+            data = cache.get(cache_key)
+            if data is None:
+                # A lagging replica's list would be served from the cache
+                # long after the lag is over, so misses read the primary
+                with primary_reads():
+                    contacts = get_contacts(request.user)
+                    data = ContactListSerializer(contacts, many=True).data
+                cache.set(cache_key, data, CONTACT_LIST_CACHE_TIMEOUT)
+            return Response(data, status=status.HTTP_200_OK)
         except Exception as e:
             logger.error(f"Error fetching contact list for user {request.user.id}: {str(e)}")
             return Response({"error": "Failed to retrieve contacts."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -160,7 +188,7 @@ class ContactListView(APIView):
             return Response({"error": "This contact already exists."}, status=status.HTTP_409_CONFLICT)
 
         try:
-            ContactList.objects.create(user=request.user, contacts=contact_user)
+            run_write(ContactList.objects.create, user=request.user, contacts=contact_user)
             return Response({"message": "Contact successfully added."}, status=status.HTTP_201_CREATED)
         except Exception as e:
             logger.error(f"Failed to create contact for user {request.user.id}: {str(e)}")
@@ -172,6 +200,7 @@ class ContactListView(APIView):
 class UserPrivateKeyView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @replica_reads
     def get(self, request):
         user = request.user
 
@@ -207,6 +236,7 @@ class GetUserView ( APIView) :
 
     permission_classes = [IsAuthenticated]
 
+    @replica_reads
     def get ( self , request ) : 
 
         user = request.user
@@ -215,7 +245,8 @@ class GetUserView ( APIView) :
             return Response({"error": "User is required."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            user = User.objects.get(username=user.username)
+            # UserSerializer reads the profile twice
+            user = User.objects.select_related('userprofile').get(username=user.username)
         except User.DoesNotExist:
             return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
@@ -230,28 +261,62 @@ class MessageListView(APIView):
 
     permission_classes = [IsAuthenticated]
 
+    @replica_reads
     def get(self, request, contact):
         if not contact:
             return Response({"error": "Contact is required."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        try:
 
-            text_messages = Message.objects.filter(room_name=contact).order_by('timestamp')
-            file_messages = UploadedFile.objects.filter(room_name=contact).order_by('timestamp')
+        # ?before=<cursor> pages back in history (the default, from the newest
+        # message), ?after=<cursor> pages forward. Cursors come back in the
+        # X-Before-Cursor / X-After-Cursor headers. ?since= is the delta-sync
+        # form of ?after= and also takes an ISO timestamp.
+        before = request.query_params.get('before')
+        after = request.query_params.get('after')
+        since = request.query_params.get('since')
 
-            text_serialized = TextMessageSerializer(text_messages, many=True).data
-            for msg in text_serialized:
-                msg['type'] = 'text'
+        if sum(1 for param in (before, after, since) if param) > 1:
+            return Response({"error": "Use only one of 'before', 'after' or 'since'."}, status=status.HTTP_400_BAD_REQUEST)
 
-            file_serialized = FileMessageSerializer(file_messages, many=True).data
-            for msg in file_serialized:
-                msg['type'] = 'file'
+        try:
+            page_size = parse_page_size(request.query_params.get('page_size'))
+            if since:
+                cursor = parse_since(since)
+            else:
+                cursor = decode_cursor(before or after) if (before or after) else None
+        except InvalidCursor as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Merge and sort by timestamp
-            combined = sorted(
-                chain(text_serialized, file_serialized),
-                key=lambda x: x['timestamp']
-            )
+        forward = bool(after or since)
+
+        try:
+
+            # Nothing new in the room since the client's copy: bodyless 304
+            etag = timeline_etag(contact, request.query_params)
+            client_etags = [tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))]
+            if etag in client_etags or '*' in client_etags:
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+                response['ETag'] = etag
+                return response
+
+            text_messages = seek(Message.objects.filter(room_name=contact), 'text', cursor, forward)[:page_size + 1]
+            file_messages = seek(UploadedFile.objects.filter(room_name=contact), 'file', cursor, forward)[:page_size + 1]
+
+            # Both pages are already in timeline order, so a streaming merge
+            # is enough; only the rows that make the page get serialized.
+            rows = list(islice(merge_timeline(text_messages, file_messages, forward), page_size + 1))
+            has_more = len(rows) > page_size
+            rows = rows[:page_size]
+            if not forward:
+                rows.reverse()
+
+            # One serializer per table: building one per row costs more
+            # than the row itself
+            serializers = {'text': TextMessageSerializer(), 'file': FileMessageSerializer()}
+            combined = []
+            for kind, obj in rows:
+                msg = serializers[kind].to_representation(obj)
+                msg['type'] = kind
+                combined.append(msg)
 
         except User.DoesNotExist:
             return Response({"error": "Contact not found."}, status=status.HTTP_404_NOT_FOUND)
@@ -260,20 +325,94 @@ class MessageListView(APIView):
             logger.error(f"Error fetching messages for contact {contact}: {str(e)}")
             return Response({"error": "An unexpected error occurred."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        print(combined)
-
-        return Response(combined, status=status.HTTP_200_OK)
+        # The client now holds the newest messages: mark the chat read
+        if (cursor is None and not forward) or (forward and not has_more):
+            peer = room_peer(contact, request.user.username)
+            if peer and run_write(mark_chat_read, contact, request.user, peer):
+                invalidate_contact_lists(request.user.id)
+
+        log_event(logger, 'history.page', room=contact, count=len(combined), has_more=has_more, payload=combined)
+
+        response = Response(combined, status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        if rows:
+            response['X-Before-Cursor'] = row_cursor(*rows[0])
+            response['X-After-Cursor'] = row_cursor(*rows[-1])
+        response['X-Has-More'] = 'true' if has_more else 'false'
+        return response
     
 
 
 
+class MessageSearchView(APIView):
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        text = request.query_params.get('q', '').strip()
+        room = request.query_params.get('room')
+
+        if not text:
+            return Response({"error": "Search text 'q' is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            page_size = parse_page_size(request.query_params.get('page_size'))
+            page = int(request.query_params.get('page', 1))
+            if page < 1:
+                raise ValueError(page)
+        except (InvalidCursor, ValueError):
+            return Response({"error": "Invalid page or page_size."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One room, or every room the user takes part in
+        if room:
+            if room_peer(room, request.user.username) is None:
+                return Response({"error": "Room not found."}, status=status.HTTP_404_NOT_FOUND)
+            rooms = [room]
+        else:
+            rooms = list(
+                Conversation.objects.filter(Q(participant_one=request.user) | Q(participant_two=request.user))
+                .values_list('room_name', flat=True)
+            )
+
+        try:
+            matches = search_messages(text, rooms, limit=page_size + 1, offset=(page - 1) * page_size)
+            has_more = len(matches) > page_size
+            matches = matches[:page_size]
+
+            text_rows = Message.objects.in_bulk([pk for kind, pk, score in matches if kind == 'text'])
+            file_rows = UploadedFile.objects.in_bulk([pk for kind, pk, score in matches if kind == 'file'])
+
+            results = []
+            for kind, pk, score in matches:
+                obj = text_rows.get(pk) if kind == 'text' else file_rows.get(pk)
+                if obj is None:
+                    continue
+                serializer_class = TextMessageSerializer if kind == 'text' else FileMessageSerializer
+                msg = serializer_class(obj).data
+                msg['type'] = kind
+                msg['score'] = score
+                results.append(msg)
+
+        except Exception as e:
+            logger.error(f"Error searching messages for user {request.user.id}: {str(e)}")
+            return Response({"error": "An unexpected error occurred."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        response = Response(results, status=status.HTTP_200_OK)
+        response['X-Has-More'] = 'true' if has_more else 'false'
+        return response
+
+
+
+
 class FileUploadView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, format=None):
 
         try:
-            sender_username = request.POST.get('sender')
+            # The sender is whoever is logged in; a "sender" field is ignored
+            sender = request.user
             receiver_username = request.POST.get('receiver')
             room_name = request.POST.get('room_name')
             file = request.FILES.get('file')
@@ -286,27 +425,53 @@ class FileUploadView(APIView):
                 message = ''
 
 
-            print(f"Sender: {sender_username}, Receiver: {receiver_username}, Room: {room_name}, File: {file}")
+            log_event(logger, 'upload.received', sender=sender.username, receiver=receiver_username,
+                      room=room_name, file_name=file_name)
 
-            if not all([sender_username, receiver_username, room_name, file]):
+            if not all([receiver_username, room_name, file]):
                 return Response({"error": "Missing one or more required fields."}, status=status.HTTP_400_BAD_REQUEST)
 
             try:
-                sender = User.objects.get(username=sender_username)
                 receiver = User.objects.get(username=receiver_username)
             except User.DoesNotExist:
-                return Response({"error": "Sender or receiver not found."}, status=status.HTTP_404_NOT_FOUND)
+                return Response({"error": "Receiver not found."}, status=status.HTTP_404_NOT_FOUND)
+
+            # Checked before any bytes move into the store
+            if room_name != room_name_for(sender.username, receiver.username):
+                return Response({"error": "room_name is not your room with the receiver."}, status=status.HTTP_403_FORBIDDEN)
 
-            uploaded_file = UploadedFile.objects.create(
+            uploaded_file = UploadedFile(
                 sender=sender,
                 receiver=receiver,
                 room_name=room_name,
-                file=file, 
                 file_type=file_type,
                 file_name=file_name,
                 message= message,
                 size= int(size)/1000   #size in kb
             )
+            # Copy and hash the bytes here; only moving them into the store
+            # and the INSERT go to the writer, in one transaction
+            tmp_path, sha256 = blob_storage.stage(file)
+
+            def store():
+                name = None
+                try:
+                    with transaction.atomic():
+                        name = blob_storage.adopt(tmp_path, sha256, file.name)
+                        uploaded_file.file.name = name
+                        uploaded_file.save()
+                except BaseException:
+                    # The Blob row rolled back; the moved file has to go too
+                    if name is not None:
+                        discard_adopted(name)
+                    raise
+
+            try:
+                run_write(store)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            UPLOAD_BYTES.inc('upload-file', amount=file.size)
 
             serializer = UploadedFileSerializer(uploaded_file)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import OTP, UserProfile, ContactList, Message, UploadedFile
+from .models import OTP, UserProfile, ContactList, Conversation, Message, UploadedFile, Blob, ChunkedUpload
 
 @admin.register(OTP)
 class OTPAdmin(admin.ModelAdmin):
@@ -24,6 +24,13 @@ class ContactListAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'contacts__username')
 
 
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ('room_name', 'participant_one', 'participant_two', 'message_count', 'unread_one', 'unread_two', 'last_message_at')
+    search_fields = ('room_name', 'participant_one__username', 'participant_two__username')
+    list_filter = ('last_message_at',)
+
+
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ('room_name', 'sender', 'receiver', 'timestamp')
@@ -36,3 +43,17 @@ class UploadedFileAdmin(admin.ModelAdmin):
     list_display = ('room_name', 'file_name', 'file_type', 'message', 'file', 'sender', 'receiver', 'size', 'timestamp')
     search_fields = ('file_name', 'room_name', 'sender__username', 'receiver__username')
     list_filter = ('file_type', 'timestamp')
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'sha256', 'size', 'ref_count', 'created_at')
+    search_fields = ('name', 'sha256')
+    readonly_fields = ('created_at',)
+
+
+@admin.register(ChunkedUpload)
+class ChunkedUploadAdmin(admin.ModelAdmin):
+    list_display = ('id', 'file_name', 'sender', 'receiver', 'offset', 'total_size', 'created_at')
+    search_fields = ('file_name', 'room_name', 'sender__username')
+    readonly_fields = ('created_at',)
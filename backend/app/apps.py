@@ -1,6 +1,7 @@
 # In your app (e.g., profiles/apps.py)
 
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 class ProfilesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
@@ -8,3 +9,11 @@ class ProfilesConfig(AppConfig):
 
     def ready(self):
         import app.signals  # import signals so that they get registered
+        post_migrate.connect(create_search_index, sender=self)
+
+
+def create_search_index(sender, using, **kwargs):
+    # The search index isn't a model, so it is (re)installed after every migrate
+    from django.db import connections
+    from .search import install_search_index
+    install_search_index(connections[using])
@@ -0,0 +1,89 @@
+# batching.py
+#
+# Opt-in micro-batching of outbound WebSocket frames. A client that connects
+# with ?batch=1 gets every frame as a JSON array of events instead of one
+# object per frame. The first event after a quiet spell goes out at once;
+# events that follow within MAX_DELAY_MS are collected and sent together,
+# or as soon as MAX_EVENTS are waiting. Sparse traffic sees no added delay,
+# and bursts (bot output, pasted multi-line messages) pay the per-frame cost
+# once per batch. See `manage.py bench_batching` for where that pays off.
+
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BATCHING = getattr(settings, 'WEBSOCKET_BATCH', {})
+MAX_DELAY = BATCHING.get('MAX_DELAY_MS', 5) / 1000
+MAX_EVENTS = BATCHING.get('MAX_EVENTS', 32)
+
+
+def wants_batching(query):
+    """Whether the parsed query string of a socket asks for batched frames."""
+    return query.get('batch', ['0'])[0].lower() in ('1', 'true', 'yes')
+
+
+class FrameBatcher:
+    """
+    Collects outbound events for one socket. ``send`` is a coroutine
+    function taking the list of events to write as one frame.
+    """
+
+    def __init__(self, send, max_delay=MAX_DELAY, max_events=MAX_EVENTS):
+        self.send = send
+        self.max_delay = max_delay
+        self.max_events = max_events
+        self.events = []
+        self.timer = None
+        self.last_flush = 0.0
+        # Timer flushes in progress, kept so they can't be garbage-collected
+        # mid-send and so close() can cancel them
+        self.tasks = set()
+
+    async def add(self, event):
+        self.events.append(event)
+        if len(self.events) >= self.max_events:
+            await self.flush()
+        elif self.timer is None:
+            if time.monotonic() - self.last_flush >= self.max_delay:
+                await self.flush()
+            else:
+                self.timer = asyncio.get_running_loop().call_later(self.max_delay, self._on_timer)
+
+    def _on_timer(self):
+        self.timer = None
+        task = asyncio.ensure_future(self.flush())
+        self.tasks.add(task)
+        task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Scheduled frame flush failed: {task.exception()!r}")
+
+    async def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.events:
+            return
+        events, self.events = self.events, []
+        self.last_flush = time.monotonic()
+        try:
+            await self.send(events)
+        except Exception as e:
+            logger.error(f"Failed to send a batch of {len(events)} frames: {str(e)}")
+
+    async def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.events = []
+        # The socket is gone; a flush still sending has nowhere to send to
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
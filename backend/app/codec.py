@@ -0,0 +1,92 @@
+# codec.py
+#
+# The one JSON codec for WebSocket frames (ChatConsumer) and REST bodies
+# (API/renderers.py, API/parsers.py). settings.JSON_CODEC picks the
+# backend: 'orjson', 'json' (stdlib), or 'auto' to use orjson when it is
+# installed. Both produce compact UTF-8 output, so switching backends
+# changes speed, not wire format. With passthrough_datetime=True, dates and
+# times are handed to ``default`` like any other unknown type; the stdlib
+# backend always does this, and the REST renderer needs DRF's formatting.
+#
+# WebSocket clients may negotiate the "msgpack" subprotocol instead, and get
+# binary MessagePack frames (pack / unpack below) in place of JSON text.
+
+import json
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_SUBPROTOCOL = 'msgpack'
+
+
+class StdlibCodec:
+    name = 'json'
+
+    def dumps(self, obj, default=None, passthrough_datetime=False):
+        return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumpb(self, obj, default=None, passthrough_datetime=False):
+        return self.dumps(obj, default).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    name = 'orjson'
+
+    def __init__(self):
+        # Match the stdlib's tolerance for int / UUID dict keys
+        self.options = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, default=None, passthrough_datetime=False):
+        return self.dumpb(obj, default, passthrough_datetime).decode('utf-8')
+
+    def dumpb(self, obj, default=None, passthrough_datetime=False):
+        options = self.options | orjson.OPT_PASSTHROUGH_DATETIME if passthrough_datetime else self.options
+        return orjson.dumps(obj, default=default, option=options)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+CODECS = {
+    'json': StdlibCodec,
+    'orjson': OrjsonCodec,
+}
+
+
+def get_codec(name=None):
+    name = name or getattr(settings, 'JSON_CODEC', 'auto')
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    if name not in CODECS:
+        raise ImproperlyConfigured(f"Unknown JSON_CODEC {name!r}; use 'auto', 'orjson' or 'json'")
+    if name == 'orjson' and orjson is None:
+        raise ImproperlyConfigured("JSON_CODEC is 'orjson' but orjson is not installed")
+    return CODECS[name]()
+
+
+codec = get_codec()
+
+dumps = codec.dumps
+dumpb = codec.dumpb
+loads = codec.loads
+
+
+def pack(obj):
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def unpack(data):
+    return msgpack.unpackb(data, raw=False)
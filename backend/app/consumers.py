@@ -1,8 +1,22 @@
+import logging
+
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-import json
+from urllib.parse import parse_qs
+
+from . import codec
+from .batching import FrameBatcher, wants_batching
+from .logs import log_event
+from .metrics import (
+    CHANNEL_SEND_FAILURES, FRAMES_IN, FRAMES_OUT, GROUP_SEND_SECONDS, OPEN_SOCKETS, SAVE_MESSAGE_SECONDS,
+)
+from .persistence import get_message_buffer
+from .presence import presence_tracker, typing_tracker
+from .profiling import profile_handler
+from .rooms import room_peer
+from .routers import apin_to_primary
 
+logger = logging.getLogger(__name__)
 
 
 
@@ -10,37 +24,101 @@ import json
 class ChatConsumer ( AsyncWebsocketConsumer)  : 
 
 
+    @profile_handler
     async def connect( self ) :
 
         self.room_name = self.scope['url_route']['kwargs']['room_name']
         self.room_group_name = f'chat_{self.room_name}'
 
+        # ?batch=1 opts in to receiving frames as arrays of events
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.batcher = FrameBatcher(self.send_frames) if wants_batching(query) else None
+
+        # The sender and receiver of every message on this socket, resolved
+        # once; frames cannot name anyone else
+        self.user = self.scope.get('user')
+        self.peer = None
+        self.username = None
+
+        if self.user is not None and self.user.is_authenticated:
+            peer_username = room_peer(self.room_name, self.user.username)
+            if peer_username:
+                self.peer = await get_user_model().objects.filter(username=peer_username).afirst()
+
+        # Only the room's two participants may join it, to post or to listen
+        if self.peer is None:
+            logger.warning(f"Refused socket for {getattr(self.user, 'username', '') or 'anonymous'} in {self.room_name}")
+            await self.close()
+            return
+        self.username = self.user.username
+
         await self.channel_layer.group_add(
             self.room_group_name  ,
             self.channel_name
         )
 
-        await self.accept()
+        # Binary MessagePack frames for clients that offer the subprotocol.
+        # Only one subprotocol can be echoed, so it wins over "bearer"; the
+        # token offered alongside it has already been read by the middleware.
+        self.binary = codec.msgpack is not None and codec.MSGPACK_SUBPROTOCOL in (self.scope.get('subprotocols') or [])
+        if self.binary:
+            await self.accept(subprotocol=codec.MSGPACK_SUBPROTOCOL)
+        else:
+            # Echo the auth subprotocol when the token came in that way
+            await self.accept(subprotocol=self.scope.get('auth_subprotocol'))
+        OPEN_SOCKETS.inc()
+        self.counted = True
+
+        await presence_tracker.connect(self.username, self.channel_name, self.room_group_name)
+        await self.send_frame(await presence_tracker.snapshot(self.peer.username))
 
     
 
-    async def receive( self ,text_data ) : 
+    @profile_handler
+    async def receive( self ,text_data=None, bytes_data=None ) : 
 
-        data = json.loads(text_data)
+        FRAMES_IN.inc()
+        # A bad frame costs the client an error frame, not the socket
+        try:
+            data = codec.unpack(bytes_data) if bytes_data is not None else codec.loads(text_data)
+        except Exception as e:
+            logger.warning(f"Malformed frame from {self.username} in {self.room_name}: {str(e)}")
+            await self.send_frame({"type": "error", "error": "malformed frame"})
+            return
+        if not isinstance(data, dict):
+            logger.warning(f"Non-object frame from {self.username} in {self.room_name}")
+            await self.send_frame({"type": "error", "error": "frame must be an object"})
+            return
 
-        print("data" ,data)
+        log_event(logger, 'ws.frame', room=self.room_name, frame_type=data.get('type'), payload=data)
+
+        # Every frame counts as a heartbeat
+        await presence_tracker.heartbeat(self.username, self.channel_name)
+
+        if data.get('type') == 'heartbeat':
+            return
+
+        if data.get('type') == 'typing':
+            if data.get('typing', True):
+                typing_tracker.touch(self.room_group_name, self.username)
+            else:
+                typing_tracker.stop(self.room_group_name, self.username)
+            return
+
+        if data.get('type') in ('chat_message', 'file_message'):
+            typing_tracker.stop(self.room_group_name, self.username)
+
+        # Sender and receiver always come from the socket, whatever the frame says
+        user = self.username
+        receiver = self.peer.username
 
         if data.get('type') == 'chat_message':
             
 
             message = data.get('message')
-            user = data.get('sender')
-            receiver = data.get('receiver')
-
-            await self.save_message(message, user, receiver)
 
-            await self.channel_layer.group_send(
-                self.room_group_name ,
+            # Broadcast first; the row is written behind by the message buffer
+            await self.group_send(
                 {
                     "type": "chat_message",
                     "message": message,
@@ -48,11 +126,14 @@ class ChatConsumer ( AsyncWebsocketConsumer)  :
                     "receiver": receiver
                 }
             )
+
+            with SAVE_MESSAGE_SECONDS.time():
+                await self.save_message(message)
+            # Their next history fetch must see this message
+            await apin_to_primary(self.user.id)
         elif data.get('type') == 'file_message':
 
             message = data.get('message')
-            user = data.get('sender')
-            receiver = data.get('receiver')
             file_type = data.get('file_type')
             file_url = data.get('file_url')
             timestamp = data.get('timestamp')
@@ -60,8 +141,7 @@ class ChatConsumer ( AsyncWebsocketConsumer)  :
             size = data.get('size')
 
 
-            await self.channel_layer.group_send(
-                self.room_group_name ,
+            await self.group_send(
                 {
                     "type": "file_message",
                     "message": message,
@@ -79,7 +159,7 @@ class ChatConsumer ( AsyncWebsocketConsumer)  :
     async def file_message ( self , event ) :
         
     
-        await self.send( text_data=json.dumps(
+        await self.send_frame(
             {
                 "type": "file",
                 "message" : event['message'] ,
@@ -91,55 +171,90 @@ class ChatConsumer ( AsyncWebsocketConsumer)  :
                 "file_name" : event['file_name'],
                 "size" : event['size']
             }
-        ))
+        )
 
 
     async def chat_message ( self , event ) :
 
-        from .models import Message
-        User = get_user_model()
-
-        print(event)
+        log_event(logger, 'ws.broadcast', room=self.room_name, sender=event['sender'],
+                  receiver=event['receiver'], payload=event['message'])
 
-        # Save the message to the database
-
-        await self.send( text_data=json.dumps(
+        await self.send_frame(
             {
                 "type": "chat",
                 "message" : event['message'] ,
                 "sender" : event['sender'] ,
                 "receiver" : event['receiver']
             }
-        ))
+        )
 
      
 
+    async def presence_update ( self , event ) :
+
+        # Coalesced presence / typing changes for this room
+        for frame in event['frames']:
+            if frame['type'] == 'typing' and frame['user'] == self.username:
+                continue
+            await self.send_frame(frame)
+
+    @profile_handler
     async def disconnect ( self , close_code ) :
-        
+
+        if getattr(self, 'counted', False):
+            OPEN_SOCKETS.dec()
+            self.counted = False
+
         await self.channel_layer.group_discard(
             self.room_group_name ,
             self.channel_name
         )
 
-    async def save_message(self, message, sender, receiver):
+        if getattr(self, 'batcher', None) is not None:
+            await self.batcher.close()
+
+        if getattr(self, 'username', None):
+            typing_tracker.stop(self.room_group_name, self.username)
+            await presence_tracker.disconnect(self.username, self.channel_name)
+
+    async def send_frame(self, frame):
+        if self.batcher is not None:
+            await self.batcher.add(frame)
+        else:
+            await self.send_encoded(frame)
+
+    async def send_frames(self, frames):
+        await self.send_encoded(frames)
+
+    async def group_send(self, event):
+        try:
+            with GROUP_SEND_SECONDS.time():
+                await self.channel_layer.group_send(self.room_group_name, event)
+        except Exception:
+            CHANNEL_SEND_FAILURES.inc('consumer')
+            raise
+
+    async def send_encoded(self, payload):
+        FRAMES_OUT.inc()
+        if self.binary:
+            await self.send(bytes_data=codec.pack(payload))
+        else:
+            await self.send(text_data=codec.dumps(payload))
+
+    async def save_message(self, message):
             
             from .models import Message
-            User = get_user_model()
 
-            print(f"Saving message: {message} from {sender} to {receiver} in room {self.room_name}")
+            log_event(logger, 'message.enqueued', room=self.room_name, sender=self.username,
+                      receiver=self.peer.username, payload=message)
 
             try:
-                sender_user = await database_sync_to_async(User.objects.get)(username=sender)
-                receiver_user = await database_sync_to_async(User.objects.get)(username=receiver)
-
                 message_instance = Message(
                     room_name=self.room_name,
                     message=message,
-                    sender=sender_user,
-                    receiver=receiver_user
+                    sender=self.user,
+                    receiver=self.peer
                 )
-                await database_sync_to_async(message_instance.save)()
-            except User.DoesNotExist:
-                print(f"User {sender} or {receiver} does not exist.")
+                await get_message_buffer().enqueue(message_instance)
             except Exception as e:
-                print(f"Error saving message: {str(e)}")
+                logger.error(f"Error saving message: {str(e)}")
@@ -0,0 +1,56 @@
+# contacts.py
+#
+# Contact list with last-message preview and unread count, built in two
+# queries regardless of how many contacts a user has or how long their
+# chats are (both come from the Conversation rows), and cached
+# per user. Signals in signals.py (and the message write buffer, which uses
+# bulk_create and so skips post_save) invalidate the cache.
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ContactList, Conversation
+from .rooms import room_name_for
+
+CONTACT_LIST_CACHE_TIMEOUT = getattr(settings, 'CONTACT_LIST_CACHE_TIMEOUT', 300)
+
+
+def contact_list_cache_key(user_id):
+    return f"contact_list:{user_id}"
+
+
+def invalidate_contact_lists(*user_ids):
+    cache.delete_many([contact_list_cache_key(user_id) for user_id in set(user_ids)])
+
+
+def get_contacts(user):
+    """
+    ContactList rows for ``user`` with ``last_message`` and ``unread_count``
+    attached. Two queries: contacts (with user and profile joined) and the
+    rooms' Conversation rows, which carry the preview and unread counters.
+    """
+    contacts = list(
+        ContactList.objects.filter(user=user).select_related('user', 'contacts__userprofile')
+    )
+    if not contacts:
+        return contacts
+
+    rooms = {room_name_for(user.username, c.contacts.username): c for c in contacts}
+    conversations = {c.room_name: c for c in Conversation.objects.filter(room_name__in=rooms)}
+
+    for room, contact in rooms.items():
+        contact.last_message = None
+        contact.unread_count = 0
+        conversation = conversations.get(room)
+        if conversation is None:
+            continue
+        if conversation.last_message_kind:
+            contact.last_message = {
+                "type": conversation.last_message_kind,
+                "message": conversation.last_message_text,
+                "sender": user.username if conversation.last_message_sender_id == user.id else contact.contacts.username,
+                "timestamp": conversation.last_message_at,
+            }
+        contact.unread_count = conversation.unread_for(user)
+
+    return contacts
@@ -0,0 +1,195 @@
+# conversations.py
+#
+# Keeps Conversation rows in step with the message tables. Every Message and
+# UploadedFile is linked to its room's Conversation when it is written, and
+# bumps the room's counters with F() expressions in the same step; deleting
+# one walks them back. Single saves go through the signals in signals.py; the
+# message write buffer calls assign_conversations / record_new_messages
+# around its bulk_create.
+#
+# A room's participants come from its name (see rooms.py), never from the
+# row being written, and a row whose sender is not one of them is refused.
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import ContactList, Conversation, Message, UploadedFile
+from .rooms import room_peer
+
+# room_name -> (conversation id, participant_one id, participant_two id), in
+# the shared cache so that a conversation deleted by one process is
+# forgotten by all of them (see drop_cached_conversation in signals.py).
+CONVERSATION_CACHE_TIMEOUT = getattr(settings, 'CONVERSATION_CACHE_TIMEOUT', 3600)
+
+NO_LAST_MESSAGE = {
+    'last_message_at': None,
+    'last_message_kind': '',
+    'last_message_text': '',
+    'last_message_sender_id': None,
+}
+
+
+class InvalidRoom(ValueError):
+    pass
+
+
+def conversation_cache_key(room_name):
+    return f"conversation:{room_name}"
+
+
+def _participants(room_name, user_id):
+    username = User.objects.filter(pk=user_id).values_list('username', flat=True).first()
+    peer = room_peer(room_name, username) if username else None
+    peer_id = User.objects.filter(username=peer).values_list('id', flat=True).first() if peer else None
+    if peer_id is None:
+        raise InvalidRoom(f"User {user_id} is not a participant of room {room_name}")
+    return sorted([user_id, peer_id])
+
+
+def get_conversation_ids(room_name, sender_id):
+    key = conversation_cache_key(room_name)
+    ids = cache.get(key)
+    if ids is None:
+        conversation = Conversation.objects.filter(room_name=room_name).first()
+        if conversation is None:
+            participant_one, participant_two = _participants(room_name, sender_id)
+            conversation, _ = Conversation.objects.get_or_create(
+                room_name=room_name,
+                defaults={'participant_one_id': participant_one, 'participant_two_id': participant_two},
+            )
+        ids = (conversation.id, conversation.participant_one_id, conversation.participant_two_id)
+        cache.set(key, ids, CONVERSATION_CACHE_TIMEOUT)
+    if sender_id not in ids[1:]:
+        raise InvalidRoom(f"User {sender_id} is not a participant of room {room_name}")
+    return ids
+
+
+def assign_conversations(rows):
+    """Link each row to its room's Conversation, refusing senders outside the room."""
+    for row in rows:
+        row.conversation_id = get_conversation_ids(row.room_name, row.sender_id)[0]
+
+
+def message_kind(row):
+    return 'file' if isinstance(row, UploadedFile) else 'text'
+
+
+def last_message_fields(row):
+    """Conversation fields previewing ``row`` as the room's newest message."""
+    kind = message_kind(row)
+    return {
+        'last_message_at': row.timestamp,
+        'last_message_kind': kind,
+        'last_message_text': row.message if kind == 'text' else (row.message or row.file_name),
+        'last_message_sender_id': row.sender_id,
+    }
+
+
+def newest_message(conversation_id):
+    """The newest text or file row in the conversation, or None. Two index seeks."""
+    newest = None
+    for model in (Message, UploadedFile):
+        row = model.objects.filter(conversation_id=conversation_id).order_by('-timestamp', '-id').first()
+        # File rows sort after text rows stamped at the same instant
+        if row and (newest is None or row.timestamp >= newest.timestamp):
+            newest = row
+    return newest
+
+
+def record_new_messages(rows):
+    """
+    Bump message_count, the last message preview and the receiver's unread
+    counter for freshly written rows: one UPDATE per conversation touched.
+    """
+    batches = defaultdict(list)
+    for row in rows:
+        batches[row.room_name].append(row)
+
+    for room_name, room_rows in batches.items():
+        newest = max(room_rows, key=lambda row: (row.timestamp, message_kind(row) == 'file', row.pk))
+        for _ in range(2):
+            conversation_id, participant_one, participant_two = get_conversation_ids(room_name, room_rows[0].sender_id)
+            updated = Conversation.objects.filter(pk=conversation_id).update(
+                message_count=F('message_count') + len(room_rows),
+                **last_message_fields(newest),
+                unread_one=F('unread_one') + sum(1 for row in room_rows if row.receiver_id == participant_one),
+                unread_two=F('unread_two') + sum(1 for row in room_rows if row.receiver_id == participant_two),
+            )
+            if updated:
+                break
+            # Deleted under us; the second pass creates it again
+            forget_conversation(room_name)
+
+        # Rows linked to the deleted id move to the new one before commit
+        stale = [row for row in room_rows if row.conversation_id != conversation_id]
+        for model in {type(row) for row in stale}:
+            model.objects.filter(pk__in=[row.pk for row in stale if type(row) is model]).update(
+                conversation_id=conversation_id
+            )
+        for row in stale:
+            row.conversation_id = conversation_id
+
+
+def record_deleted_message(row):
+    """
+    Walk the room's counters back for a deleted row: message_count, the
+    receiver's unread counter if they hadn't read it yet, and the preview if
+    it was the newest message.
+    """
+    conversation = Conversation.objects.filter(pk=row.conversation_id).first() if row.conversation_id else None
+    if conversation is None:
+        return
+
+    updates = {'message_count': Greatest(F('message_count') - 1, 0)}
+
+    unread_field = {conversation.participant_one_id: 'unread_one', conversation.participant_two_id: 'unread_two'}.get(row.receiver_id)
+    if unread_field and getattr(conversation, unread_field):
+        last_read_at = ContactList.objects.filter(
+            user_id=row.receiver_id, contacts_id=row.sender_id
+        ).values_list('last_read_at', flat=True).first()
+        if last_read_at is None or row.timestamp > last_read_at:
+            updates[unread_field] = Greatest(F(unread_field) - 1, 0)
+
+    if conversation.last_message_at is None or row.timestamp >= conversation.last_message_at:
+        newest = newest_message(conversation.pk)
+        updates.update(last_message_fields(newest) if newest else NO_LAST_MESSAGE)
+
+    Conversation.objects.filter(pk=conversation.pk).update(**updates)
+
+
+def mark_read(room_name, user):
+    """
+    Zero ``user``'s unread counter in the room. Returns False, having written
+    nothing, when there was nothing unread, which is the usual case for a chat
+    that is open.
+    """
+    # From the primary: a lagging replica could still show zero
+    conversation = Conversation.objects.using('default').filter(room_name=room_name).only(
+        'participant_one', 'participant_two', 'unread_one', 'unread_two'
+    ).first()
+    if conversation is None or not conversation.unread_for(user):
+        return False
+    field = 'unread_one' if user.id == conversation.participant_one_id else 'unread_two'
+    Conversation.objects.filter(pk=conversation.pk).update(**{field: 0})
+    return True
+
+
+def mark_chat_read(room_name, user, peer):
+    """
+    mark_read(), and when there was something unread, stamp ``user``'s
+    ContactList entry for ``peer`` with the time. One write for run_write().
+    """
+    if not mark_read(room_name, user):
+        return False
+    ContactList.objects.filter(user=user, contacts__username=peer).update(last_read_at=timezone.now())
+    return True
+
+
+def forget_conversation(room_name):
+    cache.delete(conversation_cache_key(room_name))
@@ -0,0 +1,34 @@
+# lifespan.py
+#
+# ASGI lifespan handler. Servers that speak the lifespan protocol (uvicorn)
+# give us a chance to drain in-process buffers before the worker exits;
+# anything registered with on_shutdown runs then.
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_shutdown_hooks = []
+
+
+def on_shutdown(hook):
+    """Register an async callable to run on lifespan shutdown."""
+    _shutdown_hooks.append(hook)
+    return hook
+
+
+async def lifespan_app(scope, receive, send):
+    while True:
+        event = await receive()
+
+        if event['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+
+        elif event['type'] == 'lifespan.shutdown':
+            for hook in _shutdown_hooks:
+                try:
+                    await hook()
+                except Exception as e:
+                    logger.error(f"Shutdown hook {hook.__name__} failed: {str(e)}")
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -0,0 +1,125 @@
+# logs.py
+#
+# Structured, non-blocking logging for the hot paths.
+#
+# BackgroundHandler is the only handler in LOGGING. Emitting a record puts
+# it on an unbounded SimpleQueue and returns; a QueueListener thread formats
+# it (JSONFormatter, one object per line) and writes it to stderr. Nothing
+# on the event loop waits for I/O, whatever stderr is connected to.
+#
+# log_event() is for per-frame / per-request events. Each event name has a
+# sample rate (LOG_EVENTS['SAMPLE_RATES']) so a busy room logs a fraction of
+# its frames; warnings and errors are never sampled. Message bodies and
+# other payloads are only logged with LOG_EVENTS['PAYLOADS'] on, since they
+# are both large and private.
+#
+# Only plain data from ``extra`` reaches the log. Django's own loggers pass
+# the request object, whose repr includes the query string and with it any
+# ?token= access token, so a request is written as its method and path
+# alone and any other object as just its type name.
+
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from logging.handlers import QueueHandler, QueueListener
+from uuid import UUID
+
+from django.conf import settings
+from django.http import HttpRequest
+
+LOG_EVENTS = getattr(settings, 'LOG_EVENTS', {})
+SAMPLE_RATES = LOG_EVENTS.get('SAMPLE_RATES', {})
+DEFAULT_SAMPLE_RATE = LOG_EVENTS.get('DEFAULT_SAMPLE_RATE', 1.0)
+LOG_PAYLOADS = LOG_EVENTS.get('PAYLOADS', False)
+
+# logging.LogRecord's own attributes; anything else on a record came in
+# through ``extra`` and is written out as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_PLAIN = (str, int, float, bool, type(None))
+# Written with str(); none of these can carry a request or a secret
+_STRINGIFIED = (date, Decimal, UUID)
+
+
+def log_field(value):
+    """``value`` reduced to data that is safe and useful to log."""
+    if isinstance(value, _PLAIN):
+        return value
+    if isinstance(value, _STRINGIFIED):
+        return str(value)
+    if isinstance(value, HttpRequest):
+        return {'method': value.method, 'path': value.path}
+    if isinstance(value, dict):
+        return {str(key): log_field(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [log_field(item) for item in value]
+    return f"<{type(value).__name__}>"
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, tz=dt_timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = log_field(value)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry)
+
+
+class BackgroundHandler(QueueHandler):
+    """QueueHandler with its own listener thread writing to ``stream``."""
+
+    def __init__(self, stream=None):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        # Formatting happens in the listener thread
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # The stock prepare() formats the message here, on the caller's
+        # thread. Only the traceback needs rendering before the frames go
+        # away; the rest is left to the listener.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def close(self):
+        # Called by logging.shutdown() at exit; stop() drains the queue first
+        if self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
+
+
+def log_event(logger, event, level=logging.INFO, payload=None, **fields):
+    """
+    Log ``event`` with ``fields`` as structured data, subject to the
+    event's sample rate. ``payload`` is dropped unless payload logging is on.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    rate = SAMPLE_RATES.get(event, DEFAULT_SAMPLE_RATE)
+    if level < logging.WARNING and rate < 1:
+        if random.random() >= rate:
+            return
+        fields['sample_rate'] = rate
+    if payload is not None and LOG_PAYLOADS:
+        fields['payload'] = payload
+    logger.log(level, event, extra={'event': event, **fields})
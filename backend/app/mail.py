@@ -0,0 +1,151 @@
+# mail.py
+#
+# Background sender for transactional mail (OTP codes and the like), so a
+# request never waits on an SMTP handshake. Messages go onto an in-process
+# queue; one worker thread keeps a single backend connection open, drains
+# the queue in batches and retries failed sends with exponential backoff.
+# Works with any EMAIL_BACKEND, including locmem in tests.
+
+import atexit
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+from .lifespan import on_shutdown
+
+logger = logging.getLogger(__name__)
+
+
+class MailQueue:
+
+    def __init__(self, batch_size=20, max_retries=5, backoff=1.0, idle_timeout=30.0):
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.queue = queue.Queue()
+        self.connection = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # Messages not yet sent or given up on, including ones waiting out a
+        # retry delay
+        self._pending = 0
+        self._idle = threading.Condition()
+
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+    @property
+    def queue_depth(self):
+        return self._pending
+
+    def send(self, message):
+        self._ensure_worker()
+        with self._idle:
+            self._pending += 1
+        self.queue.put((message, 0))
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far has been sent or given up on."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def _done(self):
+        with self._idle:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.notify_all()
+
+    def _ensure_worker(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='mail-queue', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.idle_timeout)]
+            except queue.Empty:
+                self._close()
+                continue
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._send_batch(batch)
+
+    def _send_batch(self, batch):
+        for message, attempt in batch:
+            try:
+                if self.connection is None:
+                    self.connection = get_connection(fail_silently=False)
+                    self.connection.open()
+                # One message at a time over the shared connection, so a
+                # failure never re-sends the ones before it
+                self.connection.send_messages([message])
+                self.sent += 1
+                self._done()
+            except Exception as e:
+                self._close()
+                self._retry(message, attempt, e)
+
+    def _retry(self, message, attempt, error):
+        if attempt + 1 >= self.max_retries:
+            self.failed += 1
+            logger.error(f"Giving up on mail to {message.to} after {attempt + 1} attempts: {str(error)}")
+            self._done()
+            return
+
+        self.retries += 1
+        delay = self.backoff * (2 ** attempt)
+        logger.warning(f"Mail to {message.to} failed ({str(error)}), retrying in {delay:.1f}s")
+        # Wait off the worker thread so other mail keeps flowing meanwhile
+        timer = threading.Timer(delay, self.queue.put, args=((message, attempt + 1),))
+        timer.daemon = True
+        timer.start()
+
+    def _close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+_mail_queue = None
+
+
+def get_mail_queue():
+    global _mail_queue
+    if _mail_queue is None:
+        config = getattr(settings, 'EMAIL_QUEUE', {})
+        _mail_queue = MailQueue(
+            batch_size=config.get('BATCH_SIZE', 20),
+            max_retries=config.get('MAX_RETRIES', 5),
+            backoff=config.get('BACKOFF_SECONDS', 1.0),
+            idle_timeout=config.get('IDLE_TIMEOUT_SECONDS', 30.0),
+        )
+        atexit.register(_mail_queue.flush, 10)
+    return _mail_queue
+
+
+def send_mail_async(subject, message, from_email, recipient_list):
+    """Queue a plain-text mail; same arguments as django.core.mail.send_mail."""
+    get_mail_queue().send(EmailMessage(subject, message, from_email, recipient_list))
+
+
+@on_shutdown
+async def flush_mail_queue():
+    if _mail_queue is not None:
+        from asgiref.sync import sync_to_async
+        await sync_to_async(_mail_queue.flush, thread_sensitive=False)(10)
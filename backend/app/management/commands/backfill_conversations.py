@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from app.contacts import invalidate_contact_lists
+from app.conversations import (
+    NO_LAST_MESSAGE, InvalidRoom, get_conversation_ids, last_message_fields, newest_message,
+)
+from app.models import ContactList, Conversation, Message, UploadedFile
+
+
+class Command(BaseCommand):
+    help = (
+        "Create Conversation rows for every room_name in Message and UploadedFile, "
+        "link the message rows to them and recompute their counters and last message "
+        "preview. Safe to re-run."
+    )
+
+    def handle(self, *args, **options):
+        rooms = {}
+        for model in (Message, UploadedFile):
+            pairs = model.objects.order_by().values_list('room_name', 'sender_id').distinct()
+            for room_name, sender_id in pairs:
+                rooms.setdefault(room_name, sender_id)
+
+        backfilled = 0
+        for room_name, sender_id in rooms.items():
+            try:
+                with transaction.atomic():
+                    conversation_id = get_conversation_ids(room_name, sender_id)[0]
+                    conversation = Conversation.objects.select_for_update().get(pk=conversation_id)
+                    self.backfill(conversation)
+            except InvalidRoom as e:
+                self.stderr.write(f"Skipping {room_name}: {e}")
+                continue
+            backfilled += 1
+
+            invalidate_contact_lists(conversation.participant_one_id, conversation.participant_two_id)
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {backfilled} conversations."))
+
+    def backfill(self, conversation):
+        message_count = 0
+        unread = {conversation.participant_one_id: 0, conversation.participant_two_id: 0}
+
+        # Unread = messages received after the receiver last opened the chat
+        last_read = {
+            user_id: last_read_at
+            for user_id, last_read_at in ContactList.objects.filter(
+                Q(user_id=conversation.participant_one_id, contacts_id=conversation.participant_two_id)
+                | Q(user_id=conversation.participant_two_id, contacts_id=conversation.participant_one_id)
+            ).values_list('user_id', 'last_read_at')
+        }
+
+        for model in (Message, UploadedFile):
+            model.objects.filter(room_name=conversation.room_name).update(conversation=conversation)
+
+            rows = model.objects.filter(conversation=conversation)
+            message_count += rows.count()
+
+            for user_id in unread:
+                received = rows.filter(receiver_id=user_id)
+                if last_read.get(user_id):
+                    received = received.filter(timestamp__gt=last_read[user_id])
+                unread[user_id] += received.count()
+
+        newest = newest_message(conversation.pk)
+        preview = last_message_fields(newest) if newest else NO_LAST_MESSAGE
+        for field, value in preview.items():
+            setattr(conversation, field, value)
+        conversation.message_count = message_count
+        conversation.unread_one = unread[conversation.participant_one_id]
+        conversation.unread_two = unread[conversation.participant_two_id]
+        conversation.save(update_fields=['message_count', 'unread_one', 'unread_two', *preview])
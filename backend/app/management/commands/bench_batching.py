@@ -0,0 +1,109 @@
+import asyncio
+import json
+import statistics
+import time
+
+from channels.layers import DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer, channel_layers
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app.batching import MAX_DELAY, MAX_EVENTS
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark micro-batched outbound frames (?batch=1) against one frame "
+        "per event. Bursts of chat events are pushed through an in-memory "
+        "channel layer to an in-process ChatConsumer, connected as one of two "
+        "throwaway users who are deleted afterwards; reports delivery latency, "
+        "frames and throughput per burst size. In-process numbers leave out the "
+        "network and the browser, so real per-frame costs, and the gain from "
+        "batching, are higher than shown."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bursts', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64, 128],
+                            help='Events per burst.')
+        parser.add_argument('--rounds', type=int, default=50, help='Bursts per measurement.')
+        parser.add_argument('--gap-ms', type=float, default=20, help='Quiet time between bursts.')
+        parser.add_argument('--payload', type=int, default=64, help='Message size in bytes.')
+
+    def handle(self, *args, **options):
+        # Never benchmark against (or flood) a shared Redis layer
+        channel_layers.set(DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer(capacity=100000))
+
+        # Only the room's participants may open a socket in it
+        users = [User.objects.create(username=username) for username in ('bench_a', 'bench_b')]
+        token = str(AccessToken.for_user(users[0]))
+        try:
+            self.run_bursts(token, options)
+        finally:
+            for user in users:
+                user.delete()
+
+    def run_bursts(self, token, options):
+        self.stdout.write(f"batching: up to {MAX_DELAY * 1000:g} ms or {MAX_EVENTS} events per frame")
+        self.stdout.write(
+            f"{'burst':>6} {'mode':>8} {'frames':>7} {'p50 (ms)':>9} {'p99 (ms)':>9} {'events/s':>10}"
+        )
+        for burst in options['bursts']:
+            results = {}
+            for mode in ('single', 'batched'):
+                results[mode] = asyncio.run(self.measure(mode == 'batched', burst, token, options))
+                frames, p50, p99, rate = results[mode]
+                self.stdout.write(f"{burst:>6} {mode:>8} {frames:>7} {p50:>9.3f} {p99:>9.3f} {rate:>10.0f}")
+            self.stdout.write(
+                f"{'':>6} {'gain':>8} {'':>7} {'':>9} {'':>9} "
+                f"{results['batched'][3] / results['single'][3]:>9.2f}x"
+            )
+
+    async def measure(self, batched, burst, token, options):
+        from backend.asgi import application
+
+        path = '/ws/chat/bench_aandbench_b/' + ('?batch=1' if batched else '')
+        communicator = WebsocketCommunicator(application, path, subprotocols=['bearer', token])
+        connected, _ = await communicator.connect()
+        if not connected:
+            raise RuntimeError("Could not connect to ChatConsumer")
+
+        layer = channel_layers[DEFAULT_CHANNEL_LAYER]
+        padding = 'x' * options['payload']
+        latencies = []
+        frames = 0
+        busy = 0.0
+
+        for _ in range(options['rounds']):
+            started = time.perf_counter()
+            for _ in range(burst):
+                await layer.group_send('chat_bench_aandbench_b', {
+                    'type': 'chat_message',
+                    'message': f"{time.perf_counter()} {padding}",
+                    'sender': 'bench_a',
+                    'receiver': 'bench_b',
+                })
+
+            received = 0
+            while received < burst:
+                payload = json.loads(await communicator.receive_from(timeout=5))
+                now = time.perf_counter()
+                # Presence frames for the socket itself are not part of the burst
+                events = [event for event in (payload if isinstance(payload, list) else [payload])
+                          if event.get('type') == 'chat']
+                if not events:
+                    continue
+                frames += 1
+                received += len(events)
+                for event in events:
+                    latencies.append(now - float(event['message'].split(' ', 1)[0]))
+            busy += time.perf_counter() - started
+
+            await asyncio.sleep(options['gap_ms'] / 1000)
+
+        await communicator.disconnect()
+
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        return frames, p50, p99, burst * options['rounds'] / busy
@@ -0,0 +1,133 @@
+import timeit
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from app.codec import CODECS, msgpack, orjson, pack, unpack
+from app.models import Message, UploadedFile
+from app.presence import presence_frame, typing_frame
+from API.pagination import merge_timeline, seek
+from API.renderers import FastJSONRenderer
+from API.serializers import FileMessageSerializer, TextMessageSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark the JSON codecs (app/codec.py) on WebSocket frames and "
+        "on real history pages built the way MessageListView builds them, plus "
+        "DRF's stock JSONRenderer against FastJSONRenderer, and the size of "
+        "each payload as JSON and as MessagePack. Seeds a throwaway "
+        "room inside a transaction that is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-sizes', type=int, nargs='+', default=[50, 200])
+        parser.add_argument('--number', type=int, default=2000, help='Calls per timing run.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timing runs; the best is reported.')
+
+    def handle(self, *args, **options):
+        codecs = {name: cls() for name, cls in CODECS.items() if name != 'orjson' or orjson is not None}
+
+        with transaction.atomic():
+            payloads = self.frames()
+            for page_size in options['page_sizes']:
+                payloads[f"history page ({page_size})"] = self.history_page(page_size)
+            transaction.set_rollback(True)
+
+        header = f"{'payload':<22} {'bytes':>7}"
+        for name in codecs:
+            header += f" {name + ' enc (us)':>16} {name + ' dec (us)':>16}"
+        self.stdout.write(header)
+
+        for label, payload in payloads.items():
+            encoded = next(iter(codecs.values())).dumpb(payload)
+            line = f"{label:<22} {len(encoded):>7}"
+            for codec in codecs.values():
+                data = codec.dumpb(payload)
+                line += f" {self.time(lambda: codec.dumps(payload), options):>16.2f}"
+                line += f" {self.time(lambda: codec.loads(data), options):>16.2f}"
+            self.stdout.write(line)
+
+        self.stdout.write("")
+        self.stdout.write(f"{'renderer':<22} {'payload':<22} {'us':>10}")
+        stock, fast = JSONRenderer(), FastJSONRenderer()
+        for label, payload in payloads.items():
+            if not label.startswith('history'):
+                continue
+            for name, renderer in (('JSONRenderer', stock), ('FastJSONRenderer', fast)):
+                elapsed = self.time(lambda: renderer.render(payload), options)
+                self.stdout.write(f"{name:<22} {label:<22} {elapsed:>10.2f}")
+
+        if msgpack is None:
+            return
+        self.stdout.write("")
+        self.stdout.write(
+            f"{'payload':<22} {'json bytes':>11} {'msgpack bytes':>14} {'saved':>6} "
+            f"{'pack (us)':>10} {'unpack (us)':>12}"
+        )
+        json_codec = next(iter(codecs.values()))
+        for label, payload in payloads.items():
+            json_size = len(json_codec.dumpb(payload))
+            packed = pack(payload)
+            self.stdout.write(
+                f"{label:<22} {json_size:>11} {len(packed):>14} {1 - len(packed) / json_size:>6.0%} "
+                f"{self.time(lambda: pack(payload), options):>10.2f} {self.time(lambda: unpack(packed), options):>12.2f}"
+            )
+
+    def time(self, fn, options):
+        number = options['number']
+        return min(timeit.repeat(fn, number=number, repeat=options['repeat'])) / number * 1e6
+
+    def frames(self):
+        return {
+            'chat frame': {
+                "type": "chat",
+                "message": "On my way, be there in 10 minutes",
+                "sender": "alice",
+                "receiver": "bob",
+            },
+            'file frame': {
+                "type": "file",
+                "message": "Slides from today",
+                "sender": "alice",
+                "receiver": "bob",
+                "file_type": "application/pdf",
+                "file_url": "/media/uploaded_files/3f/a2/3fa2c0ffee" + "0" * 54 + ".pdf",
+                "timestamp": "2025-01-01T12:00:00.000000Z",
+                "file_name": "slides.pdf",
+                "size": 482113,
+            },
+            'presence frame': presence_frame('alice', True, 1735732800.0),
+            'typing frame': typing_frame('alice', True),
+        }
+
+    def history_page(self, page_size):
+        sender = User.objects.create(username=f"bench_codec_sender_{page_size}")
+        receiver = User.objects.create(username=f"bench_codec_receiver_{page_size}")
+        room = f"bench_codec_room_{page_size}"
+        Message.objects.bulk_create(
+            Message(room_name=room, message=f"message number {i} with a little text", sender=sender, receiver=receiver)
+            for i in range(page_size)
+        )
+        UploadedFile.objects.bulk_create(
+            UploadedFile(room_name=room, file='uploaded_files/bench.pdf', file_name=f"file {i}.pdf",
+                         file_type='application/pdf', size=1024 * i, sender=sender, receiver=receiver)
+            for i in range(page_size // 4)
+        )
+
+        # Same steps as MessageListView
+        text_messages = seek(Message.objects.filter(room_name=room), 'text', forward=False)[:page_size + 1]
+        file_messages = seek(UploadedFile.objects.filter(room_name=room), 'file', forward=False)[:page_size + 1]
+        rows = list(islice(merge_timeline(text_messages, file_messages, forward=False), page_size))
+        rows.reverse()
+
+        combined = []
+        for kind, obj in rows:
+            serializer_class = TextMessageSerializer if kind == 'text' else FileMessageSerializer
+            msg = serializer_class(obj).data
+            msg['type'] = kind
+            combined.append(msg)
+        return combined
@@ -0,0 +1,106 @@
+import time
+from itertools import chain, islice
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.models import Message, UploadedFile
+from API.pagination import merge_timeline, seek
+from API.serializers import FileMessageSerializer, TextMessageSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the message history timeline. Builds the whole room's timeline "
+        "with the old serialize-both-then-sort approach and with the streaming "
+        "merge, over the same rows, then reports one paginated page on its own. "
+        "Seeds a throwaway room inside a transaction that is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='Rows per room (split evenly between text and file messages).')
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement; the best is reported.')
+
+    def handle(self, *args, **options):
+        page_size = options['page_size']
+        repeat = options['repeat']
+
+        self.stdout.write(
+            f"{'rows':>8} {'sort-all (ms)':>14} {'merge-all (ms)':>15} {'speedup':>8} {'one page (ms)':>14}"
+        )
+
+        for size in options['sizes']:
+            with transaction.atomic():
+                room = self.seed(size)
+                legacy = self.best_of(repeat, lambda: self.legacy_timeline(room))
+                merged = self.best_of(repeat, lambda: self.merged_timeline(room))
+                page = self.best_of(repeat, lambda: self.merged_page(room, page_size))
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                f"{size:>8} {legacy * 1000:>14.1f} {merged * 1000:>15.1f} {legacy / merged:>7.2f}x {page * 1000:>14.2f}"
+            )
+
+    def seed(self, size):
+        room = f"bench_room_{size}"
+        sender = User.objects.create(username=f"bench_sender_{size}")
+        receiver = User.objects.create(username=f"bench_receiver_{size}")
+
+        Message.objects.bulk_create(
+            (Message(room_name=room, message=f"message {i}", sender=sender, receiver=receiver)
+             for i in range(size // 2)),
+            batch_size=1000,
+        )
+        UploadedFile.objects.bulk_create(
+            (UploadedFile(room_name=room, file='uploaded_files/bench.bin', file_name=f"file {i}",
+                          size=1, sender=sender, receiver=receiver)
+             for i in range(size - size // 2)),
+            batch_size=1000,
+        )
+        return room
+
+    def best_of(self, repeat, fn):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def legacy_timeline(self, room):
+        # What MessageListView did before pagination
+        text_serialized = TextMessageSerializer(Message.objects.filter(room_name=room).order_by('timestamp'), many=True).data
+        for msg in text_serialized:
+            msg['type'] = 'text'
+        file_serialized = FileMessageSerializer(UploadedFile.objects.filter(room_name=room).order_by('timestamp'), many=True).data
+        for msg in file_serialized:
+            msg['type'] = 'file'
+        return sorted(chain(text_serialized, file_serialized), key=lambda x: x['timestamp'])
+
+    def merged_timeline(self, room):
+        # The same full row set, merged from the two ordered querysets
+        text_messages = seek(Message.objects.filter(room_name=room), 'text')
+        file_messages = seek(UploadedFile.objects.filter(room_name=room), 'file')
+        serializers = {'text': TextMessageSerializer(), 'file': FileMessageSerializer()}
+        timeline = []
+        for kind, obj in merge_timeline(text_messages, file_messages):
+            msg = serializers[kind].to_representation(obj)
+            msg['type'] = kind
+            timeline.append(msg)
+        return timeline
+
+    def merged_page(self, room, page_size):
+        # What MessageListView does now: the newest page only
+        text_messages = seek(Message.objects.filter(room_name=room), 'text', forward=False)[:page_size + 1]
+        file_messages = seek(UploadedFile.objects.filter(room_name=room), 'file', forward=False)[:page_size + 1]
+        rows = list(islice(merge_timeline(text_messages, file_messages, forward=False), page_size))
+        serializers = {'text': TextMessageSerializer(), 'file': FileMessageSerializer()}
+        page = []
+        for kind, obj in reversed(rows):
+            msg = serializers[kind].to_representation(obj)
+            msg['type'] = kind
+            page.append(msg)
+        return page
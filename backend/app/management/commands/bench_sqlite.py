@@ -0,0 +1,129 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.test import override_settings
+from django.utils import timezone
+
+from app.models import OTP, Message
+from app.rooms import room_name_for
+from app.sqlite import get_writer, run_write
+from .loadtest import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Concurrency benchmark for SQLite: the stock configuration against "
+        "production mode (WAL and tuned pragmas, IMMEDIATE transactions, one "
+        "writer thread). Writer threads save chat messages and upsert OTP rows "
+        "the way the views do while reader threads fetch history pages. Each "
+        "mode runs against its own throwaway database file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='Writer threads.')
+        parser.add_argument('--readers', type=int, default=8, help='Reader threads.')
+        parser.add_argument('--writes', type=int, default=200, help='Writes per writer thread.')
+        parser.add_argument('--modes', nargs='+', choices=['default', 'production'], default=['default', 'production'])
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'mode':<11} {'writes/s':>9} {'write p50':>10} {'write p99':>10} {'locked':>7} "
+            f"{'reads/s':>9} {'read p50':>9} {'read p99':>9}"
+        )
+        settings_dict = connection.settings_dict
+        saved = settings_dict['NAME'], settings_dict.get('OPTIONS', {})
+        try:
+            for mode in options['modes']:
+                with tempfile.TemporaryDirectory(prefix='bench-sqlite-') as tmp_dir:
+                    # Connections made from here on, in any thread, use these
+                    connections.close_all()
+                    settings_dict['NAME'] = os.path.join(tmp_dir, 'bench.sqlite3')
+                    settings_dict['OPTIONS'] = dict(settings.SQLITE_PRODUCTION_OPTIONS) if mode == 'production' else {}
+                    with override_settings(SQLITE_SERIALIZE_WRITES=mode == 'production'):
+                        call_command('migrate', run_syncdb=True, verbosity=0, interactive=False)
+                        result = self.run(mode, options)
+                        if mode == 'production':
+                            get_writer().submit(connections.close_all).result()
+                    connections.close_all()
+                self.stdout.write(
+                    f"{mode:<11} {result['writes_per_sec']:>9.0f} {result['write_p50_ms']:>8.2f}ms "
+                    f"{result['write_p99_ms']:>8.2f}ms {result['locked']:>7} {result['reads_per_sec']:>9.0f} "
+                    f"{result['read_p50_ms']:>7.2f}ms {result['read_p99_ms']:>7.2f}ms"
+                )
+        finally:
+            connections.close_all()
+            settings_dict['NAME'], settings_dict['OPTIONS'] = saved
+
+    def run(self, mode, options):
+        sender = User.objects.create(username=f"bench_sqlite_{mode}_a")
+        receiver = User.objects.create(username=f"bench_sqlite_{mode}_b")
+        room = room_name_for(sender.username, receiver.username)
+
+        write_times, read_times = [], []
+        locked = [0]
+        writers_done = threading.Event()
+
+        def write(n, i):
+            if i % 4 == 0:
+                # SendOtpView
+                run_write(OTP.objects.update_or_create, email=f"bench{n}@example.com",
+                          defaults={'otp_code': '123456', 'created_at': timezone.now()})
+            else:
+                # Same signals as a message saved through the ORM
+                run_write(Message.objects.create, room_name=room, message=f"writer {n} message {i}",
+                          sender=sender, receiver=receiver)
+
+        def writer(n):
+            try:
+                for i in range(options['writes']):
+                    start = time.perf_counter()
+                    try:
+                        write(n, i)
+                    except OperationalError:
+                        locked[0] += 1
+                        continue
+                    write_times.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+
+        def reader():
+            try:
+                while not writers_done.is_set():
+                    start = time.perf_counter()
+                    try:
+                        list(Message.objects.filter(room_name=room).order_by('-timestamp', '-id')[:50])
+                    except OperationalError:
+                        locked[0] += 1
+                        continue
+                    read_times.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+
+        writers = [threading.Thread(target=writer, args=(n,)) for n in range(options['writers'])]
+        readers = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        started = time.perf_counter()
+        for thread in writers + readers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        writers_done.set()
+        for thread in readers:
+            thread.join()
+
+        return {
+            'writes_per_sec': len(write_times) / elapsed,
+            'write_p50_ms': percentile(write_times, 50) * 1000,
+            'write_p99_ms': percentile(write_times, 99) * 1000,
+            'locked': locked[0],
+            'reads_per_sec': len(read_times) / elapsed,
+            'read_p50_ms': percentile(read_times, 50) * 1000,
+            'read_p99_ms': percentile(read_times, 99) * 1000,
+        }
@@ -0,0 +1,41 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from API.uploads import EXPIRY, part_dir, part_path
+from app.models import ChunkedUpload
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete chunked uploads untouched for CHUNKED_UPLOAD_EXPIRY_SECONDS, "
+        "finished or not, with their part files, and part files that no upload "
+        "row refers to. Meant to run from cron."
+    )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - EXPIRY
+
+        expired = list(ChunkedUpload.objects.filter(updated_at__lt=cutoff))
+        for upload in expired:
+            if os.path.exists(part_path(upload)):
+                os.remove(part_path(upload))
+        ChunkedUpload.objects.filter(id__in=[upload.id for upload in expired]).delete()
+
+        # Part files left behind by rows deleted some other way. Only old
+        # ones: a fresh file may belong to a row still being created.
+        orphans = 0
+        if os.path.isdir(part_dir()):
+            live = {str(upload_id) for upload_id in ChunkedUpload.objects.values_list('id', flat=True)}
+            for entry in os.scandir(part_dir()):
+                upload_id, ext = os.path.splitext(entry.name)
+                if ext != '.part' or upload_id in live:
+                    continue
+                if entry.stat().st_mtime < cutoff.timestamp():
+                    os.remove(entry.path)
+                    orphans += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {len(expired)} expired uploads and {orphans} orphaned part files."
+        ))
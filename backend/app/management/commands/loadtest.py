@@ -0,0 +1,336 @@
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app.contacts import invalidate_contact_lists
+from app.models import ContactList, Message, UploadedFile, UserProfile
+from app.rooms import room_name_for
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(timings):
+    """p50/p95/p99 in ms for a list of durations in seconds."""
+    return {
+        'p50_ms': statistics.median(timings) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the chat and REST paths against a throwaway SQLite database "
+        "and an in-memory channel layer. Drives N concurrent WebSocket clients "
+        "through ChatConsumer in-process (messages/s, delivery latency, DB write "
+        "throughput), then times MessageListView, ContactListView and "
+        "FileUploadView over seeded data sizes. --output saves the results; "
+        "--baseline compares against a saved run and fails on regressions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=20, help='Concurrent WebSocket clients (paired into rooms).')
+        parser.add_argument('--messages', type=int, default=50, help='Messages sent by each client.')
+        parser.add_argument('--rate', type=float, default=0,
+                            help='Messages per second per client; 0 sends as fast as possible.')
+        parser.add_argument('--history-sizes', type=int, nargs='+', default=[1000, 10000])
+        parser.add_argument('--contact-counts', type=int, nargs='+', default=[10, 100])
+        parser.add_argument('--upload-sizes', type=int, nargs='+', default=[16 * 1024, 1024 * 1024],
+                            help='Upload sizes in bytes.')
+        parser.add_argument('--requests', type=int, default=30, help='Requests per REST measurement.')
+        parser.add_argument('--only', choices=['ws', 'rest'], help='Run one half only.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--baseline', help='Results JSON from an earlier run to compare against.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative slowdown before a metric counts as a regression.')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory(prefix='loadtest-') as tmp_dir:
+            old_name = connection.settings_dict['NAME']
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmp_dir, 'loadtest.sqlite3')
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                with override_settings(
+                    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer',
+                                                'CONFIG': {'capacity': 100000}}},
+                    MEDIA_ROOT=os.path.join(tmp_dir, 'media'),
+                    ALLOWED_HOSTS=['*'],
+                    DEBUG=False,
+                ):
+                    results = {}
+                    if options['only'] in (None, 'ws'):
+                        results['websocket'] = asyncio.run(self.websocket_bench(options))
+                    if options['only'] in (None, 'rest'):
+                        results['rest'] = self.rest_bench(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.report(results)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    # WebSocket
+
+    async def websocket_bench(self, options):
+        from channels.testing import WebsocketCommunicator
+        from backend.asgi import application
+        from app.persistence import get_message_buffer
+
+        clients = options['clients'] + options['clients'] % 2
+        messages = options['messages']
+        interval = 1 / options['rate'] if options['rate'] else 0
+
+        tokens = await sync_to_async(self.seed_users)(clients)
+        names = list(tokens)
+        sockets = []
+        for i, name in enumerate(names):
+            peer = names[i + 1] if i % 2 == 0 else names[i - 1]
+            communicator = WebsocketCommunicator(
+                application, f"/ws/chat/{room_name_for(name, peer)}/", subprotocols=['bearer', tokens[name]],
+            )
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise CommandError(f"WebSocket client {name} could not connect")
+            sockets.append((communicator, name, peer))
+
+        # Connect-time presence frames
+        for communicator, _, _ in sockets:
+            while not await communicator.receive_nothing(0.05):
+                await communicator.receive_from()
+
+        latencies = []
+
+        async def writer(communicator, name, peer):
+            for _ in range(messages):
+                await communicator.send_to(text_data=json.dumps({
+                    'type': 'chat_message', 'message': repr(time.perf_counter()), 'sender': name, 'receiver': peer,
+                }))
+                if interval:
+                    await asyncio.sleep(interval)
+
+        async def reader(communicator, name, peer):
+            received = 0
+            while received < messages:
+                frame = json.loads(await communicator.receive_from(timeout=60))
+                if frame.get('type') == 'chat' and frame['sender'] == peer:
+                    latencies.append(time.perf_counter() - float(frame['message']))
+                    received += 1
+
+        # How late a 1 ms timer fires while the clients run: anything that
+        # blocks the event loop (a synchronous write, a slow handler) shows here
+        lags = []
+        done = asyncio.Event()
+
+        async def lag_probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.001)
+                lags.append(time.perf_counter() - start - 0.001)
+
+        buffer = get_message_buffer()
+        written_before = buffer.written
+        probe = asyncio.ensure_future(lag_probe())
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(writer(*socket) for socket in sockets),
+            *(reader(*socket) for socket in sockets),
+        )
+        delivered = time.perf_counter() - started
+        done.set()
+        await probe
+        await buffer.flush()
+        persisted = time.perf_counter() - started
+
+        for communicator, _, _ in sockets:
+            await communicator.disconnect()
+
+        sent = clients * messages
+        written = buffer.written - written_before
+        return {
+            'clients': clients,
+            'messages_sent': sent,
+            'messages_per_sec': sent / delivered,
+            **summarize(latencies),
+            'db_rows_written': written,
+            'db_writes_per_sec': written / persisted,
+            'db_flushes': buffer.flushes,
+            'loop_lag_p99_ms': percentile(lags, 99) * 1000,
+            'loop_lag_max_ms': max(lags, default=0) * 1000,
+        }
+
+    def seed_users(self, count):
+        tokens = {}
+        for i in range(count):
+            user = User.objects.create(username=f"loadtest_{i}")
+            tokens[user.username] = str(AccessToken.for_user(user))
+        return tokens
+
+    # REST
+
+    def rest_bench(self, options):
+        owner = User.objects.create(username='loadtest_owner')
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(owner)}")
+        repeat = options['requests']
+        results = {'history': {}, 'contacts': {}, 'upload': {}}
+
+        for size in options['history_sizes']:
+            peer = User.objects.create(username=f"loadtest_history_{size}")
+            room = room_name_for(owner.username, peer.username)
+            self.seed_history(room, owner, peer, size)
+            url = f"/API/messages/{room}/"
+            newest = self.time_requests(client, 'get', url, repeat)
+            before = client.get(url)['X-Before-Cursor']
+            older = self.time_requests(client, 'get', url, repeat, data={'before': before})
+            results['history'][str(size)] = {
+                'newest_page': newest,
+                'older_page': older,
+            }
+
+        for count in options['contact_counts']:
+            user = self.seed_contacts(count)
+            contacts_client = Client(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+            cold = self.time_requests(contacts_client, 'get', '/API/contacts/', repeat,
+                                      before_each=lambda: invalidate_contact_lists(user.id))
+            warm = self.time_requests(contacts_client, 'get', '/API/contacts/', repeat)
+            results['contacts'][str(count)] = {'cold': cold, 'warm': warm}
+
+        receiver = User.objects.create(username='loadtest_receiver')
+        room = room_name_for(owner.username, receiver.username)
+        for size in options['upload_sizes']:
+            def upload_data():
+                content = os.urandom(size)
+                return {
+                    'sender': owner.username, 'receiver': receiver.username, 'room_name': room,
+                    'file_type': 'application/octet-stream', 'file_name': 'loadtest.bin', 'size': size,
+                    'file': SimpleUploadedFile('loadtest.bin', content, content_type='application/octet-stream'),
+                }
+            timing = self.time_requests(client, 'post', '/API/upload-file/', repeat, data=upload_data, expect=201)
+            timing['mb_per_sec'] = size / (timing['p50_ms'] / 1000) / 1e6
+            results['upload'][str(size)] = timing
+
+        return results
+
+    def seed_history(self, room, owner, peer, size):
+        texts = size - size // 5
+        Message.objects.bulk_create(
+            (Message(room_name=room, message=f"history message {i}", sender=owner if i % 2 else peer,
+                     receiver=peer if i % 2 else owner) for i in range(texts)),
+            batch_size=2000,
+        )
+        UploadedFile.objects.bulk_create(
+            (UploadedFile(room_name=room, file='uploaded_files/loadtest.bin', file_name=f"file {i}",
+                          file_type='application/octet-stream', size=1, sender=owner, receiver=peer)
+             for i in range(size - texts)),
+            batch_size=2000,
+        )
+
+    def seed_contacts(self, count):
+        user = User.objects.create(username=f"loadtest_contacts_{count}")
+        peers = User.objects.bulk_create(User(username=f"loadtest_contact_{count}_{i}") for i in range(count))
+        # bulk_create skips the signal that gives every user a profile
+        UserProfile.objects.bulk_create(UserProfile(user=peer) for peer in peers)
+        ContactList.objects.bulk_create(ContactList(user=user, contacts=peer) for peer in peers)
+        Message.objects.bulk_create(
+            Message(room_name=room_name_for(user.username, peer.username), message="hello",
+                    sender=peer, receiver=user)
+            for peer in peers
+        )
+        return user
+
+    def time_requests(self, client, method, url, repeat, data=None, before_each=None, expect=200):
+        timings = []
+        queries = 0
+        for i in range(repeat):
+            if before_each:
+                before_each()
+            payload = data() if callable(data) else data
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = getattr(client, method)(url, payload) if payload is not None else getattr(client, method)(url)
+                if hasattr(response, 'streaming_content'):
+                    b''.join(response.streaming_content)
+                timings.append(time.perf_counter() - start)
+            if response.status_code != expect:
+                raise CommandError(f"{method.upper()} {url} returned {response.status_code}, expected {expect}")
+            queries = len(captured)
+        return {**summarize(timings), 'queries': queries}
+
+    # Reporting
+
+    def report(self, results):
+        ws = results.get('websocket')
+        if ws:
+            self.stdout.write(
+                f"WebSocket: {ws['clients']} clients, {ws['messages_sent']} messages: "
+                f"{ws['messages_per_sec']:.0f} msg/s, delivery p50 {ws['p50_ms']:.2f} / p95 {ws['p95_ms']:.2f} / "
+                f"p99 {ws['p99_ms']:.2f} ms, {ws['db_rows_written']} rows written at "
+                f"{ws['db_writes_per_sec']:.0f} rows/s in {ws['db_flushes']} flushes; "
+                f"event loop lag p99 {ws['loop_lag_p99_ms']:.2f} / max {ws['loop_lag_max_ms']:.2f} ms"
+            )
+
+        rest = results.get('rest')
+        if rest:
+            self.stdout.write("")
+            self.stdout.write(f"{'endpoint':<28} {'size':>9} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'queries':>8}")
+            rows = []
+            for size, pages in rest['history'].items():
+                for page, timing in pages.items():
+                    rows.append((f"messages ({page})", size, timing))
+            for count, modes in rest['contacts'].items():
+                for mode, timing in modes.items():
+                    rows.append((f"contacts ({mode})", count, timing))
+            for size, timing in rest['upload'].items():
+                rows.append((f"upload ({timing['mb_per_sec']:.1f} MB/s)", size, timing))
+            for label, size, timing in rows:
+                self.stdout.write(
+                    f"{label:<28} {size:>9} {timing['p50_ms']:>9.2f} {timing['p95_ms']:>9.2f} "
+                    f"{timing['p99_ms']:>9.2f} {timing['queries']:>8}"
+                )
+
+    def compare(self, results, baseline_path, tolerance):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+        current, previous = dict(self.flatten(results)), dict(self.flatten(baseline))
+        regressions = []
+        for key, value in current.items():
+            old = previous.get(key)
+            if not old:
+                continue
+            # Latencies and query counts should not grow; throughputs should not drop
+            if key.endswith(('_ms', 'queries')) and value > old * (1 + tolerance):
+                regressions.append(f"{key}: {old:.2f} -> {value:.2f}")
+            elif key.endswith('per_sec') and value < old * (1 - tolerance):
+                regressions.append(f"{key}: {old:.2f} -> {value:.2f}")
+
+        if regressions:
+            raise CommandError("Regressions against the baseline:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {baseline_path}"))
+
+    def flatten(self, results, prefix=''):
+        for key, value in results.items():
+            if isinstance(value, dict):
+                yield from self.flatten(value, f"{prefix}{key}.")
+            elif isinstance(value, (int, float)):
+                yield f"{prefix}{key}", value
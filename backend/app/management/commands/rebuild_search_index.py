@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from app.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text message search index from the Message and UploadedFile tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if not rebuild_search_index(connections[options['database']]):
+            self.stdout.write("No search index on this database; searches scan the tables instead.")
+            return
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
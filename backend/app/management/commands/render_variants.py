@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from app.models import UploadedFile, UserProfile
+from app.thumbnails import get_pool, schedule_variants
+
+
+class Command(BaseCommand):
+    help = (
+        "Render missing image variants for every image upload and profile photo "
+        "not marked ready, and mark the ones already on disk. Safe to re-run."
+    )
+
+    def handle(self, *args, **options):
+        scheduled = 0
+        sources = (
+            (UploadedFile, 'file', {'file_variants_ready': False}),
+            (UserProfile, 'profile_photo', {'profile_photo_variants_ready': False}),
+        )
+        for model, field_name, filters in sources:
+            # One row per stored file: marking it ready marks every row with it
+            seen = set()
+            for row in model.objects.filter(**filters).exclude(**{field_name: ''}).exclude(**{f"{field_name}__isnull": True}):
+                fieldfile = getattr(row, field_name)
+                if fieldfile.name in seen:
+                    continue
+                seen.add(fieldfile.name)
+                schedule_variants(fieldfile)
+                scheduled += 1
+
+        # Wait for the pool, so its results are recorded before exiting
+        get_pool().shutdown(wait=True)
+        self.stdout.write(self.style.SUCCESS(f"Checked variants for {scheduled} files."))
@@ -0,0 +1,34 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database into every replica in "
+        "DATABASE_REPLICAS with SQLite's online backup, standing in for "
+        "replication when trying the read/write router locally. Run it again "
+        "to let the replicas catch up; in between they lag like a real replica."
+    )
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured; set REPLICA_DATABASE_NAMES.")
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError("Only SQLite replicas can be synced here; use the database's own replication.")
+
+        primary = sqlite3.connect(connections['default'].settings_dict['NAME'])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                name = connections[alias].settings_dict['NAME']
+                connections[alias].close()
+                replica = sqlite3.connect(name)
+                try:
+                    primary.backup(replica)
+                finally:
+                    replica.close()
+                self.stdout.write(f"{alias}: copied to {name}")
+        finally:
+            primary.close()
@@ -0,0 +1,237 @@
+# metrics.py
+#
+# Process-local metrics in the Prometheus text format, served at /metrics.
+# No client library: every metric keeps one shard per thread, which only
+# that thread ever writes, so the hot path is a dict update with no lock.
+# A scrape sums the shards. Each worker process exposes its own numbers;
+# Prometheus aggregates across processes and turns the *_total counters
+# into per-second rates.
+#
+# Also here: MetricsMiddleware (REST latency per view) and the write
+# buffer's stats as gauges evaluated at scrape time.
+
+import bisect
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            # Once per thread; the lock only guards the list of shards
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshot(self):
+        with self._shards_lock:
+            return [dict(shard) for shard in self._shards]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    """With ``callback``, the value is read from elsewhere at scrape time."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def totals(self):
+        if self.callback is not None:
+            return {(): self.callback()}
+        # Unlabelled metrics always have a sample, starting at zero
+        totals = {} if self.labelnames else {(): 0}
+        for shard in self._snapshot():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def samples(self):
+        for labels, value in sorted(self.totals().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            # Per-bucket counts (the last one is +Inf), then sum
+            state = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        merged = {}
+        for shard in self._snapshot():
+            for labels, state in shard.items():
+                total = merged.setdefault(labels, [0] * len(state))
+                for i, value in enumerate(state):
+                    total[i] += value
+
+        for labels, state in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), state[:-1]):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, [('le', _format_value(bound))])
+                yield f"{self.name}_bucket{le} {cumulative}"
+            label_text = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(state[-1])}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+
+class _Timer:
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+def _buffer_stat(name):
+    def read():
+        from .persistence import _buffer
+        return _buffer.stats()[name] if _buffer is not None else 0
+    return read
+
+
+# WebSocket path
+OPEN_SOCKETS = Gauge('chat_open_sockets', "WebSocket connections open in this process.")
+FRAMES_IN = Counter('chat_frames_in_total', "WebSocket frames received.")
+FRAMES_OUT = Counter('chat_frames_out_total', "WebSocket frames sent.")
+SAVE_MESSAGE_SECONDS = Histogram('chat_save_message_seconds', "Time to hand a message to the write buffer.")
+GROUP_SEND_SECONDS = Histogram('chat_group_send_seconds', "Channel layer group_send latency.")
+CHANNEL_SEND_FAILURES = Counter('chat_channel_send_failures_total', "Channel layer sends that raised.", ['source'])
+
+# Message write buffer (app/persistence.py)
+BUFFER_FLUSH_SECONDS = Histogram('chat_buffer_flush_seconds', "Time to write one batch of buffered messages.")
+BUFFER_QUEUE_DEPTH = Gauge('chat_buffer_queue_depth', "Messages waiting in the write buffer.",
+                           callback=_buffer_stat('queue_depth'))
+BUFFER_WRITTEN = Counter('chat_buffer_written_messages_total', "Messages written by the buffer.",
+                         callback=_buffer_stat('written'))
+BUFFER_FAILED_FLUSHES = Counter('chat_buffer_failed_flushes_total', "Buffer flushes that failed.",
+                                callback=_buffer_stat('failed_flushes'))
+
+# REST
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', "Time to produce a response, per view.",
+                            ['view', 'method'])
+REQUESTS = Counter('http_requests_total', "Responses, per view and status code.", ['view', 'method', 'status'])
+UPLOAD_BYTES = Counter('upload_bytes_total', "Bytes received by the upload endpoints.", ['endpoint'])
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    # Optional shared secret for the scraper
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        # Name by route, never by raw path, to keep label sets bounded
+        view = (match.url_name or match.route) if match else 'unmatched'
+        REQUEST_SECONDS.observe(elapsed, view, request.method)
+        REQUESTS.inc(view, request.method, response.status_code)
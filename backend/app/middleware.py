@@ -0,0 +1,116 @@
+# middleware.py
+#
+# WebSocket authentication with the same SimpleJWT access tokens the REST API
+# uses. The token is read from the query string (?token=<access>) or from the
+# subprotocol list (["bearer", "<access>"]), since browsers cannot set headers
+# on a WebSocket handshake.
+
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from channels.auth import AuthMiddlewareStack
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+BEARER_SUBPROTOCOL = 'bearer'
+
+
+class TokenCache:
+    """
+    LRU of verified access tokens -> user. Entries expire with the token, so
+    a reconnect storm only pays for signature checks and user lookups once
+    per token.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, raw_token):
+        entry = self.entries.get(raw_token)
+        if entry is None:
+            return None
+        user, expires_at = entry
+        if expires_at <= time.time():
+            del self.entries[raw_token]
+            return None
+        self.entries.move_to_end(raw_token)
+        return user
+
+    def set(self, raw_token, user, expires_at):
+        self.entries[raw_token] = (user, expires_at)
+        self.entries.move_to_end(raw_token)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+token_cache = TokenCache(getattr(settings, 'WEBSOCKET_JWT_CACHE_SIZE', 10000))
+
+
+def get_raw_token(scope):
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if query.get('token'):
+        return query['token'][0], False
+
+    subprotocols = scope.get('subprotocols') or []
+    if BEARER_SUBPROTOCOL in subprotocols:
+        index = subprotocols.index(BEARER_SUBPROTOCOL)
+        if index + 1 < len(subprotocols):
+            return subprotocols[index + 1], True
+
+    return None, False
+
+
+async def get_user_for_token(raw_token):
+    user = token_cache.get(raw_token)
+    if user is not None:
+        return user
+
+    try:
+        token = AccessToken(raw_token)
+    except TokenError:
+        return None
+
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    if user_id is None:
+        return None
+
+    user = await get_user_model().objects.filter(
+        **{api_settings.USER_ID_FIELD: user_id}
+    ).afirst()
+    if user is None or not user.is_active:
+        return None
+
+    token_cache.set(raw_token, user, token['exp'])
+    return user
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        raw_token, from_subprotocol = get_raw_token(scope)
+
+        if raw_token:
+            user = await get_user_for_token(raw_token)
+            scope['user'] = user or AnonymousUser()
+            if from_subprotocol:
+                # The consumer has to echo a subprotocol back or the browser
+                # drops the handshake
+                scope['auth_subprotocol'] = BEARER_SUBPROTOCOL
+
+        return await super().__call__(scope, receive, send)
+
+
+def JWTAuthMiddlewareStack(inner):
+    # Session auth still applies when no token is supplied
+    return AuthMiddlewareStack(JWTAuthMiddleware(inner))
@@ -4,6 +4,8 @@ from datetime import timedelta
 from django.db import models
 from django.contrib.auth.models import User
 
+from .storage import get_blob_storage
+
 class OTP(models.Model):
     email = models.EmailField(unique=True)
     otp_code = models.CharField(max_length=6)
@@ -23,6 +25,7 @@ class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     private_key = models.UUIDField(default=uuid.uuid4, editable=False, unique=True )
     profile_photo = models.ImageField(upload_to='profile_photos/', blank=True, null=True)
+    profile_photo_variants_ready = models.BooleanField(default=False)  # set by app/thumbnails.py
     phone_number = models.CharField(max_length=15, blank=True, null=True)
 
 
@@ -32,19 +35,57 @@ class ContactList(models.Model):
 
     user = models.ForeignKey(User, on_delete=models.CASCADE , related_name='user')
     contacts = models.ForeignKey(User, on_delete=models.CASCADE, related_name='contacts')
+    last_read_at = models.DateTimeField(blank=True, null=True)  # drives the unread count
 
     def __str__(self):
         return f"Contact List for {self.user.username}"
 
 
 
+class Conversation(models.Model):
+    # One row per room. Counters are kept up to date as messages are written
+    # (see app/conversations.py) so nothing has to aggregate the message tables.
+    room_name = models.CharField(max_length=255, unique=True)
+    participant_one = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations_as_one')
+    participant_two = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations_as_two')
+    last_message_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    message_count = models.PositiveIntegerField(default=0)
+    unread_one = models.PositiveIntegerField(default=0)  # unread by participant_one
+    unread_two = models.PositiveIntegerField(default=0)  # unread by participant_two
+    # Preview of the newest message, kept with the counters so the contact
+    # list never has to look in the message tables
+    last_message_kind = models.CharField(max_length=4, blank=True, default='')  # 'text' or 'file'
+    last_message_text = models.TextField(blank=True, default='')
+    last_message_sender = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='+', blank=True, null=True)
+
+    def unread_for(self, user):
+        if user.id == self.participant_one_id:
+            return self.unread_one
+        if user.id == self.participant_two_id:
+            return self.unread_two
+        return 0
+
+    def __str__(self):
+        return f"Conversation {self.room_name}"
+
+
+
 class Message(models.Model):
     room_name = models.CharField(max_length=255)
+    conversation = models.ForeignKey(Conversation, on_delete=models.SET_NULL, related_name='messages', blank=True, null=True, db_index=True)
     message = models.TextField()
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages')
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Keyset pagination in MessageListView walks (room_name, timestamp, id)
+        indexes = [
+            models.Index(fields=['room_name', 'timestamp', 'id'], name='message_room_ts_id_idx'),
+            # Newest row of a conversation (see conversations.newest_message)
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='message_conv_ts_id_idx'),
+        ]
+
     def __str__(self):
         return f"Message from {self.sender} to {self.receiver} in {self.room_name} at {self.timestamp}"
     
@@ -54,7 +95,9 @@ class UploadedFile(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sender_files')
     receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='receiver_files')
     room_name = models.CharField(max_length=255)
-    file = models.FileField(upload_to='uploaded_files/')
+    conversation = models.ForeignKey(Conversation, on_delete=models.SET_NULL, related_name='files', blank=True, null=True, db_index=True)
+    file = models.FileField(upload_to='uploaded_files/', storage=get_blob_storage, db_index=True)  # stored once per content hash
+    file_variants_ready = models.BooleanField(default=False)  # set by app/thumbnails.py
     file_type = models.CharField(max_length=100, blank=True, null=True)  # made optional
     file_name = models.CharField(max_length=300)
     size = models.IntegerField( default=0 , null = True , blank=True)
@@ -62,5 +105,51 @@ class UploadedFile(models.Model):
 
     timestamp = models.DateTimeField(auto_now_add=True)  # renamed to singular (best practice)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['room_name', 'timestamp', 'id'], name='uploadedfile_room_ts_id_idx'),
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='uploadedfile_conv_ts_id_idx'),
+        ]
+
     def __str__(self):
         return f"File from {self.sender} to {self.receiver} in {self.room_name} at {self.timestamp}"
+
+
+
+
+class Blob(models.Model):
+    # One stored file in the content-addressed store (see app/storage.py),
+    # with the number of UploadedFile rows that point at it
+    name = models.CharField(max_length=300, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
+
+
+class ChunkedUpload(models.Model):
+    # A resumable upload (see API/uploads.py). Bytes up to ``offset`` are
+    # committed to ``MEDIA_ROOT/chunked_uploads/<id>.part``. Kept after
+    # finalize, pointing at the file it made, so a retried finalize gets the
+    # same answer; cleanup_chunked_uploads removes it once expired.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chunked_uploads')
+    receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    room_name = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=100, blank=True, null=True)
+    file_name = models.CharField(max_length=300)
+    message = models.CharField(max_length=600, null=True, blank=True)
+    total_size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    locked_until = models.DateTimeField(blank=True, null=True)  # a chunk is being written until then
+    sha256 = models.CharField(max_length=64, blank=True, default='')  # set by finalize
+    uploaded_file = models.OneToOneField(UploadedFile, on_delete=models.SET_NULL, related_name='+', blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # expiry counts from here
+
+    def __str__(self):
+        return f"Upload {self.id} of {self.file_name} ({self.offset}/{self.total_size})"
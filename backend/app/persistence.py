@@ -0,0 +1,216 @@
+# persistence.py
+#
+# Write-behind buffer for chat messages. ChatConsumer broadcasts a frame right
+# away and hands the Message row to this buffer, which writes rows in batches
+# with bulk_create every BATCH_SIZE messages or FLUSH_INTERVAL_MS milliseconds,
+# whichever comes first. One buffer per process.
+#
+# A batch that fails is retried row by row, so one bad row (a vanished user,
+# a constraint violation) costs only itself: it is logged and dropped. A
+# row that fails because the database itself is unavailable (OperationalError)
+# is kept, with everything after it, and retried on the next flush. The
+# buffer holds at most MAX_PENDING rows; past that, enqueue() waits for the
+# database, which slows the sending socket down instead of growing memory.
+
+import asyncio
+import atexit
+import logging
+import time
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+from .lifespan import on_shutdown
+from .metrics import BUFFER_FLUSH_SECONDS
+from .sqlite import arun_write
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriteBuffer:
+
+    def __init__(self, batch_size=100, flush_interval_ms=50, max_pending=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+        self.pending = []
+        # Rows taken by the flush in progress
+        self.in_flight = 0
+        self._timer = None
+        self._lock = None
+        # Scheduled flushes, kept so they can't be collected mid-flight
+        self._tasks = set()
+
+        # Metrics
+        self.enqueued = 0
+        self.written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    @property
+    def queue_depth(self):
+        return len(self.pending)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "dropped": self.dropped,
+            "last_flush_latency_ms": self.last_flush_latency * 1000,
+            "max_flush_latency_ms": self.max_flush_latency * 1000,
+            "avg_flush_latency_ms": (self.total_flush_latency / self.flushes * 1000) if self.flushes else 0.0,
+        }
+
+    async def enqueue(self, message):
+        while len(self.pending) + self.in_flight >= self.max_pending:
+            # Backpressure: the buffer is full because writes are failing
+            await self.flush()
+            if len(self.pending) + self.in_flight >= self.max_pending:
+                await asyncio.sleep(self.flush_interval)
+        self.pending.append(message)
+        self.enqueued += 1
+
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._flush_soon)
+
+    def _flush_soon(self):
+        self._timer = None
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Scheduled message flush failed: {task.exception()!r}")
+
+    def _schedule_retry(self):
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._flush_soon)
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        # One bulk_create at a time keeps rows in arrival order
+        async with self._lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, []
+            self.in_flight = len(batch)
+            try:
+                await self._flush_batch(batch)
+            finally:
+                self.in_flight = 0
+
+    async def _flush_batch(self, batch):
+        start = time.perf_counter()
+        try:
+            await arun_write(self._write, batch)
+        except Exception as e:
+            self.failed_flushes += 1
+            logger.error(f"Failed to flush {len(batch)} messages, retrying one by one: {str(e)}")
+            written, unwritten = await self._write_rows(batch)
+            # Kept rows go back in front of anything that arrived meanwhile
+            self.pending[:0] = unwritten
+            if unwritten:
+                self._schedule_retry()
+            if written:
+                self._record_flush(written, time.perf_counter() - start)
+            return
+        self._record_flush(len(batch), time.perf_counter() - start)
+
+    async def _write_rows(self, batch):
+        """Write ``batch`` a row at a time; returns (rows written, rows to retry)."""
+        for row in batch:
+            # bulk_create may have assigned ids in the rolled-back attempt
+            row.pk = None
+            row._state.adding = True
+
+        written = 0
+        for i, row in enumerate(batch):
+            try:
+                await arun_write(self._write, [row])
+            except OperationalError as e:
+                # The database, not the row: keep it and the rest for later
+                logger.error(f"Database unavailable, keeping {len(batch) - i} messages: {str(e)}")
+                return written, batch[i:]
+            except Exception as e:
+                self.dropped += 1
+                logger.error(
+                    f"Dropping message from {row.sender_id} to {row.receiver_id} in room {row.room_name}: "
+                    f"{str(e)}",
+                    extra={'event': 'message.dropped', 'room': row.room_name, 'sender': row.sender_id,
+                           'receiver': row.receiver_id},
+                )
+                continue
+            written += 1
+        return written, []
+
+    def flush_sync(self):
+        # Last-chance flush from atexit, after the event loop has gone away
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        start = time.perf_counter()
+        try:
+            self._write(batch)
+        except Exception as e:
+            logger.error(f"Failed to flush {len(batch)} messages on shutdown: {str(e)}")
+            return
+        self._record_flush(len(batch), time.perf_counter() - start)
+
+    def _write(self, batch):
+        from .contacts import invalidate_contact_lists
+        from .conversations import assign_conversations, record_new_messages
+        from .models import Message
+        with transaction.atomic():
+            assign_conversations(batch)
+            Message.objects.bulk_create(batch, batch_size=self.batch_size)
+            record_new_messages(batch)
+        # bulk_create skips signals, so do their work here
+        invalidate_contact_lists(*(m.sender_id for m in batch), *(m.receiver_id for m in batch))
+
+    def _record_flush(self, count, latency):
+        self.written += count
+        self.flushes += 1
+        self.last_flush_latency = latency
+        self.total_flush_latency += latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        BUFFER_FLUSH_SECONDS.observe(latency)
+        logger.debug(f"Flushed {count} messages in {latency * 1000:.1f}ms, queue depth {self.queue_depth}")
+
+
+_buffer = None
+
+
+def get_message_buffer():
+    global _buffer
+    if _buffer is None:
+        config = getattr(settings, 'MESSAGE_WRITE_BUFFER', {})
+        _buffer = MessageWriteBuffer(
+            batch_size=config.get('BATCH_SIZE', 100),
+            flush_interval_ms=config.get('FLUSH_INTERVAL_MS', 50),
+            max_pending=config.get('MAX_PENDING', 10000),
+        )
+        atexit.register(_buffer.flush_sync)
+    return _buffer
+
+
+@on_shutdown
+async def flush_message_buffer():
+    if _buffer is not None:
+        await _buffer.flush()
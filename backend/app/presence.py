@@ -0,0 +1,258 @@
+# presence.py
+#
+# Online / last-seen presence and typing indicators for ChatConsumer.
+#
+# Presence is heartbeat based. Each process keeps the time every open socket
+# was last heard from (any frame counts, idle clients send "heartbeat"); a
+# user is online while one of their sockets is fresher than
+# HEARTBEAT_TIMEOUT. The state is also written to the cache as a single
+# [last_seen, online] pair per user, at most once per HEARTBEAT_INTERVAL, so
+# a socket on another process can show the peer's state when it connects.
+#
+# Typing is debounced per user per room: the first "typing" frame publishes
+# typing=true, later ones only push the deadline out, and typing=false is
+# published TYPING_TIMEOUT after the last one or when a message is sent.
+#
+# Nothing is broadcast straight away. Changes are collected per room group
+# for BROADCAST_INTERVAL and only those that differ from what the room last
+# heard go out, together, as one group event. A user who reconnects or
+# starts and stops typing inside the window costs no broadcast at all.
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import CHANNEL_SEND_FAILURES
+
+logger = logging.getLogger(__name__)
+
+PRESENCE = getattr(settings, 'PRESENCE', {})
+HEARTBEAT_INTERVAL = PRESENCE.get('HEARTBEAT_INTERVAL_SECONDS', 25)
+HEARTBEAT_TIMEOUT = PRESENCE.get('HEARTBEAT_TIMEOUT_SECONDS', 60)
+TYPING_TIMEOUT = PRESENCE.get('TYPING_TIMEOUT_SECONDS', 4)
+BROADCAST_INTERVAL = PRESENCE.get('BROADCAST_INTERVAL_MS', 250) / 1000
+LAST_SEEN_TTL = 30 * 24 * 60 * 60
+
+
+def presence_cache_key(username):
+    return f"presence:{username}"
+
+
+def presence_frame(username, online, last_seen):
+    return {
+        "type": "presence",
+        "user": username,
+        "online": online,
+        "last_seen": datetime.fromtimestamp(last_seen, tz=dt_timezone.utc).isoformat() if last_seen else None,
+    }
+
+
+def typing_frame(username, typing):
+    return {"type": "typing", "user": username, "typing": typing}
+
+
+class Coalescer:
+    """
+    Per-group buffer of (kind, username) -> bool state. The resting state
+    (offline, not typing) is False, and is what a room is assumed to know
+    about anyone it hasn't heard of.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.pending = {}
+        self.sent = {}
+        self.scheduled = set()
+        # Flushes started by the timer, kept until they finish so they can't
+        # be garbage-collected mid-broadcast
+        self.tasks = set()
+
+        # Metrics
+        self.published = 0
+        self.broadcasts = 0
+
+    def publish(self, group, key, value, frame):
+        self.published += 1
+        self.pending.setdefault(group, {})[key] = (value, frame)
+        if group not in self.scheduled:
+            self.scheduled.add(group)
+            asyncio.get_running_loop().call_later(self.interval, self._schedule_flush, group)
+
+    def _schedule_flush(self, group):
+        task = asyncio.ensure_future(self.flush(group))
+        self.tasks.add(task)
+        task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Scheduled presence flush failed: {task.exception()!r}")
+
+    async def flush(self, group):
+        self.scheduled.discard(group)
+        pending = self.pending.pop(group, {})
+        sent = self.sent.setdefault(group, {})
+
+        frames = []
+        for key, (value, frame) in pending.items():
+            if sent.get(key, False) == value:
+                continue
+            frames.append(frame)
+            if value:
+                sent[key] = value
+            else:
+                sent.pop(key, None)
+        if not sent:
+            del self.sent[group]
+
+        if not frames:
+            return
+        self.broadcasts += 1
+        try:
+            await get_channel_layer().group_send(group, {"type": "presence_update", "frames": frames})
+        except Exception as e:
+            CHANNEL_SEND_FAILURES.inc('presence')
+            logger.error(f"Failed to broadcast presence to {group}: {str(e)}")
+
+
+class PresenceTracker:
+
+    def __init__(self):
+        # username -> {channel_name: [group, last_heartbeat]}
+        self.sockets = {}
+        # username -> every group told the user is online since they came
+        # online, including those of sockets already closed
+        self.groups = {}
+        # Users this process has announced as online
+        self.online = set()
+        # username -> time of the last cache write
+        self.persisted = {}
+        self._sweeper = None
+
+    def last_heartbeat(self, username):
+        return max(heartbeat for _, heartbeat in self.sockets[username].values())
+
+    async def connect(self, username, channel_name, group):
+        now = time.time()
+        self.sockets.setdefault(username, {})[channel_name] = [group, now]
+        self.groups.setdefault(username, set()).add(group)
+        self.online.add(username)
+        # Rooms that already know are filtered out by the coalescer
+        self._announce(username, True, now)
+        await self._persist(username, now, True)
+        self._ensure_sweeper()
+
+    async def heartbeat(self, username, channel_name):
+        socket = self.sockets.get(username, {}).get(channel_name)
+        if socket is None:
+            return
+        now = time.time()
+        socket[1] = now
+        if username not in self.online:
+            # Back from idle
+            self.online.add(username)
+            self._announce(username, True, now)
+            await self._persist(username, now, True)
+        elif now - self.persisted.get(username, 0) >= HEARTBEAT_INTERVAL:
+            await self._persist(username, now, True)
+
+    async def disconnect(self, username, channel_name):
+        sockets = self.sockets.get(username)
+        if not sockets or channel_name not in sockets:
+            return
+        _, last_seen = sockets.pop(channel_name)
+        if sockets:
+            return
+
+        if username in self.online:
+            self.online.discard(username)
+            self._announce(username, False, last_seen)
+        del self.sockets[username]
+        self.groups.pop(username, None)
+        self.persisted.pop(username, None)
+        await cache.aset(presence_cache_key(username), [last_seen, False], LAST_SEEN_TTL)
+
+    async def snapshot(self, username):
+        """Presence frame for ``username`` as this process or the cache sees it."""
+        if username in self.sockets:
+            return presence_frame(username, username in self.online, self.last_heartbeat(username))
+        state = await cache.aget(presence_cache_key(username))
+        if state is None:
+            return presence_frame(username, False, None)
+        last_seen, online = state
+        return presence_frame(username, online and time.time() - last_seen < HEARTBEAT_TIMEOUT, last_seen)
+
+    def _announce(self, username, online, last_seen):
+        frame = presence_frame(username, online, last_seen)
+        for group in self.groups.get(username, ()):
+            coalescer.publish(group, ('presence', username), online, frame)
+
+    async def _persist(self, username, last_seen, online):
+        self.persisted[username] = last_seen
+        await cache.aset(presence_cache_key(username), [last_seen, online], LAST_SEEN_TTL)
+
+    def _ensure_sweeper(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.ensure_future(self._sweep())
+
+    async def _sweep(self):
+        # Mark users whose sockets have all gone quiet as offline; runs
+        # while this process has any socket open
+        while self.sockets:
+            await asyncio.sleep(HEARTBEAT_TIMEOUT / 4)
+            now = time.time()
+            for username in list(self.online):
+                if username not in self.sockets:
+                    self.online.discard(username)
+                    self.groups.pop(username, None)
+                    continue
+                last_seen = self.last_heartbeat(username)
+                if now - last_seen > HEARTBEAT_TIMEOUT:
+                    self.online.discard(username)
+                    self._announce(username, False, last_seen)
+                    try:
+                        await self._persist(username, last_seen, False)
+                    except Exception as e:
+                        logger.error(f"Failed to store presence for {username}: {str(e)}")
+
+
+class TypingTracker:
+
+    def __init__(self):
+        # (group, username) -> monotonic deadline
+        self.deadlines = {}
+
+    def touch(self, group, username):
+        key = (group, username)
+        deadline = time.monotonic() + TYPING_TIMEOUT
+        if key in self.deadlines:
+            # Already typing: just move the deadline, the timer re-arms
+            self.deadlines[key] = deadline
+            return
+        self.deadlines[key] = deadline
+        coalescer.publish(group, ('typing', username), True, typing_frame(username, True))
+        asyncio.get_running_loop().call_later(TYPING_TIMEOUT, self._expire, key)
+
+    def stop(self, group, username):
+        if self.deadlines.pop((group, username), None) is not None:
+            coalescer.publish(group, ('typing', username), False, typing_frame(username, False))
+
+    def _expire(self, key):
+        deadline = self.deadlines.get(key)
+        if deadline is None:
+            return
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            asyncio.get_running_loop().call_later(remaining, self._expire, key)
+        else:
+            self.stop(*key)
+
+
+coalescer = Coalescer(BROADCAST_INTERVAL)
+presence_tracker = PresenceTracker()
+typing_tracker = TypingTracker()
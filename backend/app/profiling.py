@@ -0,0 +1,172 @@
+# profiling.py
+#
+# Opt-in per-request query profiler (QUERY_PROFILER['ENABLED']). For each
+# HTTP request, and each ChatConsumer handler call, it counts the queries
+# run, their total time, and how often each query template repeats. A
+# template seen REPEAT_THRESHOLD or more times is almost always an N+1 (one
+# query per row of something fetched earlier) and is logged as a warning.
+# HTTP responses also get an X-Query-Profile header.
+#
+# The profile being recorded lives in a context variable and every
+# connection carries one execute wrapper that reads it. Context variables
+# follow the request into sync_to_async threads, so queries are attributed
+# to the request or handler that ran them, whichever thread opened the
+# connection. Queries from background threads (the message write buffer)
+# are not.
+#
+# assert_max_queries() uses the same recorder to hold a view or serializer
+# to a query budget.
+
+import contextvars
+import functools
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+QUERY_PROFILER = getattr(settings, 'QUERY_PROFILER', {})
+ENABLED = QUERY_PROFILER.get('ENABLED', False)
+REPEAT_THRESHOLD = QUERY_PROFILER.get('REPEAT_THRESHOLD', 5)
+
+_current = contextvars.ContextVar('query_profile', default=None)
+
+# "IN (%s, %s, %s)" is the same query whatever the list length
+_IN_LIST = re.compile(r'\((?:%s, )*%s\)')
+
+
+def query_template(sql):
+    return _IN_LIST.sub('(...)', ' '.join(sql.split()))
+
+
+class QueryProfile:
+
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.seconds = 0.0
+        self.templates = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+            self.templates[query_template(sql)] += 1
+
+    def repeated(self, threshold=None):
+        threshold = REPEAT_THRESHOLD if threshold is None else threshold
+        return [(template, n) for template, n in self.templates.most_common() if n >= threshold]
+
+    def summary(self):
+        return f"queries={self.count}; db_ms={self.seconds * 1000:.1f}; repeated={len(self.repeated())}"
+
+    def report(self):
+        repeated = self.repeated()
+        if not repeated:
+            logger.info(f"{self.label}: {self.summary()}")
+            return
+        details = '; '.join(f"{n}x {template[:200]}" for template, n in repeated)
+        logger.warning(f"{self.label}: {self.summary()}; possible N+1: {details}")
+
+
+def _record(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def install(connection, **kwargs):
+    if _record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record)
+
+
+def install_all():
+    connection_created.connect(install, dispatch_uid='app.profiling.install')
+    for connection in connections.all():
+        install(connection)
+
+
+@contextmanager
+def profile_queries(label):
+    profile = QueryProfile(label)
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def assert_max_queries(maximum, label='assert_max_queries'):
+    """
+    Fail if the block runs more than ``maximum`` queries, listing them by
+    template, e.g. ``with assert_max_queries(4): client.get('/API/contacts/')``.
+    Works whether or not the profiler is enabled.
+    """
+    install_all()
+    with profile_queries(label) as profile:
+        yield profile
+    if profile.count > maximum:
+        details = '\n'.join(f"  {n}x {template}" for template, n in profile.templates.most_common())
+        raise AssertionError(f"{label}: {profile.count} queries, expected at most {maximum}:\n{details}")
+
+
+class QueryProfilerMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not ENABLED:
+            raise MiddlewareNotUsed()
+        install_all()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with profile_queries(f"{request.method} {request.path}") as profile:
+            response = self.get_response(request)
+        return self.finish(profile, response)
+
+    async def __acall__(self, request):
+        with profile_queries(f"{request.method} {request.path}") as profile:
+            response = await self.get_response(request)
+        return self.finish(profile, response)
+
+    def finish(self, profile, response):
+        profile.report()
+        response['X-Query-Profile'] = profile.summary()
+        return response
+
+
+def profile_handler(handler):
+    """Profile an async consumer method; a no-op unless the profiler is enabled."""
+    if not ENABLED:
+        return handler
+    install_all()
+
+    @functools.wraps(handler)
+    async def wrapper(self, *args, **kwargs):
+        room = getattr(self, 'room_group_name', self.scope.get('path'))
+        with profile_queries(f"{type(self).__name__}.{handler.__name__} {room}") as profile:
+            try:
+                return await handler(self, *args, **kwargs)
+            finally:
+                if profile.count:
+                    profile.report()
+    return wrapper
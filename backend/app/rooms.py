@@ -0,0 +1,25 @@
+# rooms.py
+#
+# Room names are built by the frontend from the two participants' usernames,
+# sorted, joined with "and" (see getRoomName in chat.jsx).
+
+
+def room_name_for(username, other_username):
+    first, second = sorted([username, other_username])
+    return f"{first}and{second}"
+
+
+def room_peer(room_name, username):
+    """
+    Return the other participant's username in ``room_name`` or None when
+    ``username`` is not part of the room.
+    """
+    if room_name.startswith(f"{username}and"):
+        peer = room_name[len(username) + 3:]
+        if peer and room_name_for(username, peer) == room_name:
+            return peer
+    if room_name.endswith(f"and{username}"):
+        peer = room_name[:-(len(username) + 3)]
+        if peer and room_name_for(username, peer) == room_name:
+            return peer
+    return None
@@ -0,0 +1,131 @@
+# routers.py
+#
+# Read replicas. Views decorated with @replica_reads read from one of
+# DATABASE_REPLICAS, picked at random once per request so that all of a
+# request's reads see the same snapshot; everything else, and every write,
+# goes to "default". Code that must not act on lagging data (filling a
+# shared cache, say) reads inside primary_reads().
+#
+# Replicas lag. So a user doesn't write something and then read a replica
+# that hasn't seen it yet, each write pins its author to the primary for
+# REPLICA_PIN_SECONDS: REST writes through PrimaryPinMiddleware, chat
+# messages through the consumer. The pin lives in the cache, so it holds
+# across processes when the cache is shared. Other users may still see a
+# replica's view of the world for as long as it lags.
+#
+# With no replicas configured none of this does anything. To try it locally
+# with two SQLite files, set REPLICA_DATABASE_NAMES and copy the primary
+# over with `manage.py sync_replicas`.
+
+import contextvars
+import functools
+import random
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+
+REPLICAS = getattr(settings, 'DATABASE_REPLICAS', [])
+PIN_SECONDS = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# The replica alias chosen for the current request, if any
+_replica_alias = contextvars.ContextVar('replica_alias', default=None)
+
+
+def pin_cache_key(user_id):
+    return f"db_pin:{user_id}"
+
+
+def pin_to_primary(user_id):
+    if REPLICAS:
+        cache.set(pin_cache_key(user_id), True, PIN_SECONDS)
+
+
+async def apin_to_primary(user_id):
+    if REPLICAS:
+        await cache.aset(pin_cache_key(user_id), True, PIN_SECONDS)
+
+
+def is_pinned(user_id):
+    return cache.get(pin_cache_key(user_id)) is not None
+
+
+@contextmanager
+def primary_reads():
+    """Send the block's reads to the primary, even inside @replica_reads."""
+    token = _replica_alias.set(None)
+    try:
+        yield
+    finally:
+        _replica_alias.reset(token)
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return _replica_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Explicit, or an object read from a replica would be saved there
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+def replica_reads(handler):
+    """Let a view method's reads go to a replica, unless its user just wrote."""
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        if not REPLICAS or is_pinned(request.user.id):
+            return handler(self, request, *args, **kwargs)
+        token = _replica_alias.set(random.choice(REPLICAS))
+        try:
+            return handler(self, request, *args, **kwargs)
+        finally:
+            _replica_alias.reset(token)
+    return wrapper
+
+
+class PrimaryPinMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not REPLICAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self.wrote(request, response):
+            user_id = self.user_id(request)
+            if user_id is not None:
+                pin_to_primary(user_id)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.wrote(request, response):
+            # The session user is resolved lazily, with a query
+            user_id = await sync_to_async(self.user_id)(request)
+            if user_id is not None:
+                await apin_to_primary(user_id)
+        return response
+
+    def wrote(self, request, response):
+        return request.method not in SAFE_METHODS and response.status_code < 400
+
+    def user_id(self, request):
+        # DRF puts the token's user on the underlying request too
+        user = getattr(request, 'user', None)
+        return user.id if user is not None and user.is_authenticated else None
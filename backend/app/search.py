@@ -0,0 +1,191 @@
+# search.py
+#
+# Full-text search over text messages and uploaded files (file name and
+# caption).
+#
+# SQLite: an FTS5 table, app_search, kept in sync by triggers on
+# app_message and app_uploadedfile. Because the triggers live in the
+# database, inserts and deletes from bulk_create, the admin or raw SQL are
+# covered too. Rows are keyed by rowid = id * 2 for messages and
+# id * 2 + 1 for files.
+#
+# PostgreSQL: a generated tsvector column with a GIN index on each table.
+#
+# Anything else: every word must appear (icontains), newest first, unranked.
+# A table scan, but searching works the same way on every database.
+#
+# Migrations aren't tracked in this repo, so install_search_index runs on
+# post_migrate (see apps.py). `manage.py rebuild_search_index` rebuilds the
+# index from scratch.
+
+import re
+
+from django.db import connection
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+SQLITE_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS app_search USING fts5(
+        body, room_name UNINDEXED, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS app_message_search_insert AFTER INSERT ON app_message BEGIN
+        INSERT INTO app_search(rowid, body, room_name) VALUES (new.id * 2, new.message, new.room_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS app_message_search_update AFTER UPDATE OF message ON app_message BEGIN
+        UPDATE app_search SET body = new.message WHERE rowid = new.id * 2;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS app_message_search_delete AFTER DELETE ON app_message BEGIN
+        DELETE FROM app_search WHERE rowid = old.id * 2;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS app_uploadedfile_search_insert AFTER INSERT ON app_uploadedfile BEGIN
+        INSERT INTO app_search(rowid, body, room_name)
+        VALUES (new.id * 2 + 1, new.file_name || ' ' || coalesce(new.message, ''), new.room_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS app_uploadedfile_search_update AFTER UPDATE OF file_name, message ON app_uploadedfile BEGIN
+        UPDATE app_search SET body = new.file_name || ' ' || coalesce(new.message, '') WHERE rowid = new.id * 2 + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS app_uploadedfile_search_delete AFTER DELETE ON app_uploadedfile BEGIN
+        DELETE FROM app_search WHERE rowid = old.id * 2 + 1;
+    END
+    """,
+]
+
+POSTGRES_SCHEMA = [
+    """
+    ALTER TABLE app_message ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', coalesce(message, ''))) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS app_message_search_idx ON app_message USING GIN (search_vector)",
+    """
+    ALTER TABLE app_uploadedfile ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', file_name || ' ' || coalesce(message, ''))) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS app_uploadedfile_search_idx ON app_uploadedfile USING GIN (search_vector)",
+]
+
+
+def install_search_index(using=connection):
+    schema = {'sqlite': SQLITE_SCHEMA, 'postgresql': POSTGRES_SCHEMA}.get(using.vendor)
+    if schema is None:
+        return False
+    with using.cursor() as cursor:
+        for statement in schema:
+            cursor.execute(statement)
+    return True
+
+
+def rebuild_search_index(using=connection):
+    if using.vendor == 'sqlite':
+        install_search_index(using)
+        with using.cursor() as cursor:
+            cursor.execute("DELETE FROM app_search")
+            cursor.execute(
+                "INSERT INTO app_search(rowid, body, room_name) "
+                "SELECT id * 2, message, room_name FROM app_message"
+            )
+            cursor.execute(
+                "INSERT INTO app_search(rowid, body, room_name) "
+                "SELECT id * 2 + 1, file_name || ' ' || coalesce(message, ''), room_name FROM app_uploadedfile"
+            )
+            cursor.execute("INSERT INTO app_search(app_search) VALUES ('optimize')")
+    elif using.vendor == 'postgresql':
+        # Generated columns are always current; recreate them in case the
+        # expression changed
+        with using.cursor() as cursor:
+            cursor.execute("ALTER TABLE app_message DROP COLUMN IF EXISTS search_vector")
+            cursor.execute("ALTER TABLE app_uploadedfile DROP COLUMN IF EXISTS search_vector")
+        install_search_index(using)
+    else:
+        # Nothing to rebuild: searches fall back to icontains
+        return False
+    return True
+
+
+def _fts5_query(text):
+    # Quote every word so user input can't hit FTS5 query syntax; the last
+    # word matches as a prefix for search-as-you-type
+    tokens = TOKEN.findall(text)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_messages(text, room_names, limit, offset=0, using=connection):
+    """
+    Ranked matches in ``room_names`` as [(kind, id, score)], best first.
+    """
+    if not room_names:
+        return []
+
+    placeholders = ', '.join(['%s'] * len(room_names))
+
+    if using.vendor == 'sqlite':
+        query = _fts5_query(text)
+        if query is None:
+            return []
+        sql = (
+            f"SELECT rowid, bm25(app_search) AS score FROM app_search "
+            f"WHERE app_search MATCH %s AND room_name IN ({placeholders}) "
+            f"ORDER BY score LIMIT %s OFFSET %s"
+        )
+        with using.cursor() as cursor:
+            cursor.execute(sql, [query, *room_names, limit, offset])
+            # bm25 is lower-is-better; flip it so scores read naturally
+            return [('file' if rowid % 2 else 'text', rowid // 2, -score) for rowid, score in cursor.fetchall()]
+
+    if using.vendor == 'postgresql':
+        sql = (
+            f"SELECT kind, id, score FROM ("
+            f"  SELECT 'text' AS kind, id, ts_rank(search_vector, q) AS score"
+            f"  FROM app_message, websearch_to_tsquery('simple', %s) q"
+            f"  WHERE search_vector @@ q AND room_name IN ({placeholders})"
+            f"  UNION ALL"
+            f"  SELECT 'file' AS kind, id, ts_rank(search_vector, q) AS score"
+            f"  FROM app_uploadedfile, websearch_to_tsquery('simple', %s) q"
+            f"  WHERE search_vector @@ q AND room_name IN ({placeholders})"
+            f") matches ORDER BY score DESC LIMIT %s OFFSET %s"
+        )
+        with using.cursor() as cursor:
+            cursor.execute(sql, [text, *room_names, text, *room_names, limit, offset])
+            return cursor.fetchall()
+
+    return _icontains_search(text, room_names, limit, offset, using)
+
+
+def _icontains_search(text, room_names, limit, offset, using):
+    from django.db.models import Q
+
+    from .models import Message, UploadedFile
+
+    tokens = TOKEN.findall(text)
+    if not tokens:
+        return []
+
+    text_q, file_q = Q(), Q()
+    for token in tokens:
+        text_q &= Q(message__icontains=token)
+        file_q &= Q(file_name__icontains=token) | Q(message__icontains=token)
+
+    # Newest matches from each table, enough to cover the page, merged
+    window = offset + limit
+    matches = []
+    for kind, model, q in (('text', Message, text_q), ('file', UploadedFile, file_q)):
+        rows = model.objects.using(using.alias).filter(q, room_name__in=room_names).order_by('-timestamp', '-id')
+        matches += [(timestamp, kind, pk) for pk, timestamp in rows.values_list('id', 'timestamp')[:window]]
+    matches.sort(reverse=True)
+    return [(kind, pk, 0.0) for timestamp, kind, pk in matches[offset:window]]
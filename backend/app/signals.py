@@ -1,9 +1,14 @@
 # In your app (e.g., profiles/signals.py)
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.dispatch import receiver
-from .models import UserProfile
+from .contacts import invalidate_contact_lists
+from .conversations import assign_conversations, forget_conversation, record_deleted_message, record_new_messages
+from .models import ContactList, Conversation, Message, UploadedFile, UserProfile
+from .storage import acquire_blob, release_blob
+from .thumbnails import schedule_variants
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -14,3 +19,79 @@ def create_user_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
     instance.userprofile.save()
+
+
+
+# Contact list cache (see contacts.py)
+
+@receiver(post_save, sender=ContactList)
+@receiver(post_delete, sender=ContactList)
+def invalidate_contact_list(sender, instance, **kwargs):
+    invalidate_contact_lists(instance.user_id)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=UploadedFile)
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=UploadedFile)
+def invalidate_participant_contact_lists(sender, instance, **kwargs):
+    invalidate_contact_lists(instance.sender_id, instance.receiver_id)
+
+
+
+# Conversation counters (see conversations.py)
+
+@receiver(pre_save, sender=Message)
+@receiver(pre_save, sender=UploadedFile)
+def link_conversation(sender, instance, **kwargs):
+    # Also refuses rows whose sender isn't in the room, before they are written
+    if instance._state.adding:
+        assign_conversations([instance])
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=UploadedFile)
+def count_new_message(sender, instance, created, **kwargs):
+    if created:
+        record_new_messages([instance])
+
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=UploadedFile)
+def count_deleted_message(sender, instance, **kwargs):
+    record_deleted_message(instance)
+
+
+@receiver(post_delete, sender=Conversation)
+def drop_cached_conversation(sender, instance, **kwargs):
+    forget_conversation(instance.room_name)
+
+
+
+# Content-addressed file references (see storage.py)
+
+@receiver(post_save, sender=UploadedFile)
+def reference_blob(sender, instance, created, **kwargs):
+    if created and instance.file:
+        acquire_blob(instance.file.name)
+
+
+@receiver(post_delete, sender=UploadedFile)
+def dereference_blob(sender, instance, **kwargs):
+    if instance.file:
+        release_blob(instance.file.name)
+
+
+
+# Image variants (see thumbnails.py)
+
+@receiver(post_save, sender=UploadedFile)
+def render_upload_variants(sender, instance, created, **kwargs):
+    if created and instance.file:
+        transaction.on_commit(lambda: schedule_variants(instance.file))
+
+
+@receiver(post_save, sender=UserProfile)
+def render_profile_photo_variants(sender, instance, **kwargs):
+    if instance.profile_photo:
+        transaction.on_commit(lambda: schedule_variants(instance.profile_photo))
@@ -0,0 +1,72 @@
+# sqlite.py
+#
+# Single writer for SQLite production mode (SQLITE_SERIALIZE_WRITES). SQLite
+# allows one writer at a time; with many threads writing, each one waits on
+# the file lock, retrying until busy_timeout and, under enough load, failing
+# with "database is locked". Handing writes to one dedicated thread instead
+# turns that into an in-process queue. Its connection stays open, so the
+# pragmas run once, and each write runs in one transaction, so the row and
+# whatever its signal handlers write cost a single commit. With WAL, reads
+# carry on in the callers' threads meanwhile.
+#
+# run_write() / arun_write() take the function doing the write. With the
+# setting off they call it in place (arun_write through
+# database_sync_to_async), so callers don't need to know which mode is on.
+# Called inside a transaction that is already open, they also run in place:
+# the write belongs to that transaction (a signal handler's, say), and the
+# writer would otherwise wait for the caller's lock while the caller waits
+# for the writer. Route the outermost write instead.
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+_writer = None
+_writer_lock = threading.Lock()
+_writer_thread = None
+
+
+def _mark_writer_thread():
+    global _writer_thread
+    _writer_thread = threading.get_ident()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='sqlite-writer', initializer=_mark_writer_thread,
+                )
+    return _writer
+
+
+def _in_transaction(fn, args, kwargs):
+    with transaction.atomic():
+        return fn(*args, **kwargs)
+
+
+def _serialized():
+    # Writes made by the writer itself (signal handlers) run in place
+    return (
+        getattr(settings, 'SQLITE_SERIALIZE_WRITES', False)
+        and threading.get_ident() != _writer_thread
+        and not transaction.get_connection().in_atomic_block
+    )
+
+
+def run_write(fn, *args, **kwargs):
+    if not _serialized():
+        return fn(*args, **kwargs)
+    return get_writer().submit(_in_transaction, fn, args, kwargs).result()
+
+
+async def arun_write(fn, *args, **kwargs):
+    if not _serialized():
+        return await database_sync_to_async(fn)(*args, **kwargs)
+    return await asyncio.wrap_future(get_writer().submit(_in_transaction, fn, args, kwargs))
@@ -0,0 +1,214 @@
+# storage.py
+#
+# Content-addressed storage for UploadedFile.file. A file is stored once per
+# SHA-256 under uploaded_files/<aa>/<bb>/<sha256><ext>, so forwarding the
+# same file to many contacts costs no extra disk. Blob rows count the
+# UploadedFile rows that point at each stored file, and the file is removed
+# when the last one goes (see the UploadedFile signals in signals.py).
+#
+# Adding a reference to a file that is already stored and dropping the last
+# reference to it can race: the file could be unlinked right after a new
+# upload was found to be a duplicate of it. So both sides lock the Blob row,
+# new references are written in the transaction that adopted the file, and
+# the file is only unlinked if its count is still zero once the release has
+# committed. Count changes go through the SQLite writer (see sqlite.py) like
+# any other write.
+
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F, Q
+
+from .sqlite import run_write
+
+BLOB_PREFIX = 'uploaded_files'
+BLOB_NAME = re.compile(rf'^{BLOB_PREFIX}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/([0-9a-f]{{64}})[^/]*$')
+
+
+def blob_sha256(name):
+    """SHA-256 of a content-addressed file name, None for anything else."""
+    match = BLOB_NAME.match(name or '')
+    return match.group(1) if match else None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def blob_name(self, sha256, original_name):
+        ext = os.path.splitext(original_name)[1].lower()[:16]
+        return f"{BLOB_PREFIX}/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+    def get_available_name(self, name, max_length=None):
+        # Names are derived from content, so an existing name already holds
+        # the right bytes
+        return name
+
+    def stage(self, content):
+        """
+        Copy ``content`` to a temporary file in the store, hashing it on the
+        way; returns (path, sha256) for adopt(). The caller removes the file
+        if it never gets adopted.
+        """
+        tmp_dir = self.path(os.path.join(BLOB_PREFIX, 'tmp'))
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        hasher = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    hasher.update(chunk)
+                    tmp.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path, hasher.hexdigest()
+
+    def _save(self, name, content):
+        tmp_path, sha256 = self.stage(content)
+        try:
+            return self.adopt(tmp_path, sha256, name)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def adopt(self, path, sha256, original_name):
+        """
+        Move a file whose hash is already known into the store and return its
+        name. If the blob already exists the file is simply dropped.
+
+        Call it inside the transaction that saves the UploadedFile: the Blob
+        row stays locked until then, so the stored file can't be released
+        between here and the new reference. If that transaction rolls back,
+        call discard_adopted() with the name.
+        """
+        from .models import Blob
+        name = self.blob_name(sha256, original_name)
+        destination = self.path(name)
+        with transaction.atomic():
+            Blob.objects.select_for_update().get_or_create(
+                name=name, defaults={'sha256': sha256, 'size': os.path.getsize(path)},
+            )
+            if os.path.exists(destination):
+                os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                os.replace(path, destination)
+                if self.file_permissions_mode is not None:
+                    os.chmod(destination, self.file_permissions_mode)
+        return name
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def get_blob_storage():
+    return blob_storage
+
+
+def find_blob(sha256, user):
+    """
+    Name of a stored blob with this hash that ``user`` already has access to,
+    for upload-by-hash. Blobs only other people can see are never offered:
+    knowing a hash is not proof of having the file.
+    """
+    from .models import Blob, UploadedFile
+    names = Blob.objects.filter(sha256=sha256, ref_count__gt=0).values_list('name', flat=True)
+    name = UploadedFile.objects.filter(
+        Q(sender=user) | Q(receiver=user), file__in=names
+    ).values_list('file', flat=True).first()
+    if name is not None and blob_storage.exists(name):
+        return name
+    return None
+
+
+def lock_blob(name):
+    """
+    Lock a referenced blob's row for the rest of the transaction, so the file
+    stays while a new reference to it is written. False if it is being
+    released.
+    """
+    from .models import Blob
+    return Blob.objects.select_for_update().filter(name=name, ref_count__gt=0).first() is not None
+
+
+def acquire_blob(name):
+    sha256 = blob_sha256(name)
+    if sha256 is not None:
+        run_write(_acquire_blob, name, sha256)
+
+
+def _acquire_blob(name, sha256):
+    from .models import Blob
+    with transaction.atomic():
+        blob, _ = Blob.objects.select_for_update().get_or_create(
+            name=name,
+            defaults={'sha256': sha256, 'size': blob_storage.size(name) if blob_storage.exists(name) else 0},
+        )
+        Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+
+
+def release_blob(name):
+    if blob_sha256(name) is not None:
+        run_write(_release_blob, name)
+
+
+def _release_blob(name):
+    from .models import Blob
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(name=name).first()
+        if blob is None:
+            return
+        Blob.objects.filter(pk=blob.pk, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        if blob.ref_count <= 1:
+            # Only drop the bytes once nothing can roll the release back
+            transaction.on_commit(lambda: collect_blob(name))
+
+
+def collect_blob(name):
+    """Delete an unreferenced blob, unless it gained a reference meanwhile."""
+    run_write(_collect_blob, name)
+
+
+def _collect_blob(name):
+    from .models import Blob
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(name=name, ref_count=0).first()
+        if blob is None:
+            return
+        blob.delete()
+        _delete_blob_files(name)
+
+
+def discard_adopted(name):
+    """
+    Undo adopt() after the transaction that was to reference ``name`` rolled
+    back, taking the Blob row with it: delete the file unless a Blob row for
+    it exists, i.e. it was stored before or has been adopted again since.
+    """
+    run_write(_discard_adopted, name)
+
+
+def _discard_adopted(name):
+    from .models import Blob
+    with transaction.atomic():
+        # Creating the row locks the name against a concurrent adopt()
+        blob, created = Blob.objects.select_for_update().get_or_create(
+            name=name, defaults={'sha256': blob_sha256(name) or ''},
+        )
+        if not created:
+            return
+        blob.delete()
+        _delete_blob_files(name)
+
+
+def _delete_blob_files(name):
+    from .thumbnails import delete_variants
+    blob_storage.delete(name)
+    delete_variants(blob_storage, name)
@@ -0,0 +1,102 @@
+import asyncio
+import gc
+import time
+
+from django.test import SimpleTestCase
+
+from app.batching import FrameBatcher, wants_batching
+
+
+class FrameBatcherTests(SimpleTestCase):
+
+    def setUp(self):
+        self.frames = []
+
+    async def send(self, events):
+        self.frames.append(events)
+
+    async def wait_for_frames(self, count):
+        for _ in range(500):
+            if len(self.frames) >= count:
+                return
+            await asyncio.sleep(0.01)
+        self.fail(f"Expected {count} frames, got {self.frames}")
+
+    def test_wants_batching(self):
+        self.assertTrue(wants_batching({'batch': ['1']}))
+        self.assertTrue(wants_batching({'batch': ['true']}))
+        self.assertFalse(wants_batching({'batch': ['0']}))
+        self.assertFalse(wants_batching({}))
+
+    async def test_first_event_after_a_quiet_spell_goes_out_at_once(self):
+        batcher = FrameBatcher(self.send, max_delay=60)
+        await batcher.add({'n': 1})
+        self.assertEqual(self.frames, [[{'n': 1}]])
+        self.assertIsNone(batcher.timer)
+
+    async def test_burst_is_sent_as_one_frame(self):
+        batcher = FrameBatcher(self.send, max_delay=0.02)
+        for n in range(4):
+            await batcher.add({'n': n})
+        self.assertEqual(len(self.frames), 1)
+
+        await self.wait_for_frames(2)
+        self.assertEqual(self.frames[1], [{'n': 1}, {'n': 2}, {'n': 3}])
+
+    async def test_full_batch_goes_out_without_waiting(self):
+        batcher = FrameBatcher(self.send, max_delay=60, max_events=3)
+        for n in range(4):
+            await batcher.add({'n': n})
+        self.assertEqual(self.frames, [[{'n': 0}], [{'n': 1}, {'n': 2}, {'n': 3}]])
+        await batcher.close()
+
+    async def test_timer_flush_is_kept_until_it_finishes(self):
+        release = asyncio.Event()
+
+        async def slow_send(events):
+            await release.wait()
+            self.frames.append(events)
+
+        batcher = FrameBatcher(slow_send, max_delay=0.01)
+        # Just flushed, so the next event waits for the timer
+        batcher.last_flush = time.monotonic()
+        await batcher.add({'n': 1})
+        for _ in range(100):
+            if batcher.tasks:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(len(batcher.tasks), 1)
+
+        # Only the batcher holds the task; it must survive a collection
+        gc.collect()
+        release.set()
+        await self.wait_for_frames(1)
+        self.assertEqual(self.frames, [[{'n': 1}]])
+        await asyncio.sleep(0)
+        self.assertEqual(batcher.tasks, set())
+
+    async def test_close_cancels_and_awaits_a_flush_in_progress(self):
+        started = asyncio.Event()
+
+        async def stuck_send(events):
+            started.set()
+            await asyncio.Event().wait()
+
+        batcher = FrameBatcher(stuck_send, max_delay=0.01)
+        batcher.last_flush = time.monotonic()
+        await batcher.add({'n': 1})
+        await asyncio.wait_for(started.wait(), 5)
+        task, = batcher.tasks
+
+        await batcher.close()
+        self.assertTrue(task.cancelled())
+        self.assertEqual(batcher.tasks, set())
+        self.assertIsNone(batcher.timer)
+
+    async def test_failed_send_is_logged_not_raised(self):
+        async def broken_send(events):
+            raise ConnectionError("socket closed")
+
+        batcher = FrameBatcher(broken_send, max_delay=60)
+        with self.assertLogs('app.batching', level='ERROR'):
+            await batcher.add({'n': 1})
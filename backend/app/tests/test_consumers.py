@@ -0,0 +1,145 @@
+from unittest import mock
+
+from channels.layers import DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer, channel_layers
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app import codec
+from app.models import Message
+from app.persistence import get_message_buffer
+from app.presence import BROADCAST_INTERVAL, Coalescer, PresenceTracker
+
+
+class ChatConsumerTests(TransactionTestCase):
+
+    def setUp(self):
+        # Redis isn't available to tests
+        channel_layers.set(DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer())
+        cache.clear()
+        # Timers left by an earlier test died with its event loop
+        self.enterContext(mock.patch('app.presence.coalescer', Coalescer(BROADCAST_INTERVAL)))
+        self.enterContext(mock.patch('app.consumers.presence_tracker', PresenceTracker()))
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.carol = User.objects.create(username='carol')
+
+    async def connect(self, user, room='aliceandbob'):
+        from backend.asgi import application
+
+        communicator = WebsocketCommunicator(
+            application, f"/ws/chat/{room}/", subprotocols=['bearer', str(AccessToken.for_user(user))],
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive_chat(self, communicator):
+        while True:
+            frame = await communicator.receive_json_from(timeout=5)
+            if frame.get('type') == 'chat':
+                return frame
+
+    async def test_sender_and_receiver_come_from_the_socket(self):
+        communicator = await self.connect(self.alice)
+        await communicator.send_json_to({
+            'type': 'chat_message', 'message': 'hi', 'sender': 'carol', 'receiver': 'mallory',
+        })
+
+        frame = await self.receive_chat(communicator)
+        self.assertEqual((frame['sender'], frame['receiver']), ('alice', 'bob'))
+
+        await get_message_buffer().flush()
+        message = await Message.objects.aget()
+        self.assertEqual((message.sender_id, message.receiver_id), (self.alice.id, self.bob.id))
+        await communicator.disconnect()
+
+    async def test_non_participant_is_refused_and_receives_nothing(self):
+        from backend.asgi import application
+
+        alice = await self.connect(self.alice)
+        self.assertIn(('alice', True), await self.presence_frames(alice))
+        for subprotocols in (['bearer', str(AccessToken.for_user(self.carol))], None):
+            communicator = WebsocketCommunicator(application, "/ws/chat/aliceandbob/", subprotocols=subprotocols)
+            with self.assertLogs('app.consumers', level='WARNING'):
+                connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+
+        # Neither socket joined the room, and nobody was announced in it
+        layer = channel_layers[DEFAULT_CHANNEL_LAYER]
+        self.assertEqual(len(layer.groups['chat_aliceandbob']), 1)
+        self.assertEqual(await self.presence_frames(alice), [])
+        await alice.disconnect()
+
+    async def presence_frames(self, communicator, timeout=1):
+        frames = []
+        while not await communicator.receive_nothing(timeout=timeout):
+            frame = await communicator.receive_json_from()
+            if frame.get('type') == 'presence':
+                frames.append((frame['user'], frame['online']))
+        return frames
+
+    async def test_offline_reaches_every_room_the_user_was_in(self):
+        bob = await self.connect(self.bob)
+        carol = await self.connect(self.carol, room='aliceandcarol')
+        alice_with_bob = await self.connect(self.alice)
+        alice_with_carol = await self.connect(self.alice, room='aliceandcarol')
+        self.assertIn(('alice', True), await self.presence_frames(bob))
+        self.assertIn(('alice', True), await self.presence_frames(carol))
+
+        # The socket in bob's room closes first; alice is still online
+        await alice_with_bob.disconnect()
+        self.assertNotIn(('alice', False), await self.presence_frames(bob))
+
+        await alice_with_carol.disconnect()
+        self.assertIn(('alice', False), await self.presence_frames(bob))
+        self.assertIn(('alice', False), await self.presence_frames(carol))
+
+        await bob.disconnect()
+        await carol.disconnect()
+
+    async def receive_error(self, communicator):
+        while True:
+            frame = await communicator.receive_json_from(timeout=5)
+            if frame.get('type') == 'error':
+                return frame
+
+    async def test_malformed_frames_get_an_error_and_keep_the_socket(self):
+        communicator = await self.connect(self.alice)
+        with self.assertLogs('app.consumers', level='WARNING'):
+            for text in ('{not json', '[1, 2]', '"hi"', '42'):
+                await communicator.send_to(text_data=text)
+                await self.receive_error(communicator)
+
+        await communicator.send_json_to({'type': 'chat_message', 'message': 'still here'})
+        frame = await self.receive_chat(communicator)
+        self.assertEqual(frame['message'], 'still here')
+        await communicator.disconnect()
+
+    async def test_malformed_msgpack_gets_an_error_frame(self):
+        from backend.asgi import application
+
+        communicator = WebsocketCommunicator(
+            application, "/ws/chat/aliceandbob/",
+            subprotocols=['msgpack', 'bearer', str(AccessToken.for_user(self.alice))],
+        )
+        connected, subprotocol = await communicator.connect()
+        self.assertEqual((connected, subprotocol), (True, 'msgpack'))
+
+        with self.assertLogs('app.consumers', level='WARNING'):
+            for data in (b'\xc1', codec.pack([1, 2])):
+                await communicator.send_to(bytes_data=data)
+                while True:
+                    frame = codec.unpack(await communicator.receive_from(timeout=5))
+                    if frame.get('type') == 'error':
+                        break
+
+        await communicator.send_to(bytes_data=codec.pack({'type': 'chat_message', 'message': 'still here'}))
+        while True:
+            frame = codec.unpack(await communicator.receive_from(timeout=5))
+            if frame.get('type') == 'chat':
+                break
+        self.assertEqual(frame['message'], 'still here')
+        await communicator.disconnect()
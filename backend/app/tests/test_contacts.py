@@ -0,0 +1,85 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from app import conversations
+from app.contacts import get_contacts
+from app.models import ContactList, Conversation, Message, UploadedFile
+
+
+class ContactListTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.carol = User.objects.create(username='carol')
+        ContactList.objects.create(user=self.alice, contacts=self.bob)
+        ContactList.objects.create(user=self.alice, contacts=self.carol)
+        self.client.force_authenticate(self.alice)
+
+    def send(self, text, sender, receiver):
+        room = 'and'.join(sorted([sender.username, receiver.username]))
+        return Message.objects.create(room_name=room, message=text, sender=sender, receiver=receiver)
+
+    def contacts(self):
+        return {contact['name']: contact for contact in self.client.get('/API/contacts/').json()}
+
+    def test_preview_and_unread_come_from_the_conversation(self):
+        self.send("hi alice", self.bob, self.alice)
+        self.send("one more", self.bob, self.alice)
+        self.send("hello", self.alice, self.carol)
+
+        contacts = self.contacts()
+        self.assertEqual(contacts['bob']['last_message']['message'], "one more")
+        self.assertEqual(contacts['bob']['last_message']['sender'], 'bob')
+        self.assertEqual(contacts['bob']['unread_count'], 2)
+        self.assertEqual(contacts['carol']['last_message']['sender'], 'alice')
+        self.assertEqual(contacts['carol']['unread_count'], 0)
+
+    def test_query_count_does_not_grow_with_history(self):
+        for i in range(20):
+            self.send(f"m{i}", self.bob, self.alice)
+        with self.assertNumQueries(2):
+            get_contacts(self.alice)
+
+    def test_file_preview(self):
+        self.send("text first", self.bob, self.alice)
+        # Same instant as the text: the file still counts as newer
+        upload = UploadedFile(
+            pk=1, room_name='aliceandbob', sender=self.alice, receiver=self.bob, file_name='cat.png',
+            timestamp=Message.objects.get().timestamp,
+        )
+        conversations.record_new_messages([upload])
+
+        conversation = Conversation.objects.get(room_name='aliceandbob')
+        self.assertEqual(conversation.last_message_kind, 'file')
+        self.assertEqual(conversation.last_message_text, 'cat.png')
+        self.assertEqual(conversation.last_message_sender_id, self.alice.id)
+
+    def test_opening_a_read_chat_writes_nothing(self):
+        self.send("hi alice", self.bob, self.alice)
+
+        self.client.get('/API/messages/aliceandbob/')
+        self.assertEqual(Conversation.objects.get().unread_for(self.alice), 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/API/messages/aliceandbob/')
+        writes = [q['sql'] for q in queries if not q['sql'].lstrip().upper().startswith('SELECT')]
+        self.assertEqual(writes, [])
+
+    def test_backfill_rebuilds_the_preview(self):
+        self.send("hi alice", self.bob, self.alice)
+        Conversation.objects.update(last_message_kind='', last_message_text='', last_message_sender=None, last_message_at=None)
+
+        call_command('backfill_conversations', stdout=StringIO())
+
+        conversation = Conversation.objects.get()
+        self.assertEqual((conversation.last_message_kind, conversation.last_message_text), ('text', "hi alice"))
+        self.assertEqual(conversation.last_message_sender_id, self.bob.id)
+        self.assertEqual(conversation.last_message_at, Message.objects.get().timestamp)
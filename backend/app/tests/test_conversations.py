@@ -0,0 +1,88 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from app.conversations import InvalidRoom, mark_read
+from app.models import ContactList, Conversation, Message
+
+
+class ConversationCounterTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.carol = User.objects.create(username='carol')
+        self.room = 'aliceandbob'
+
+    def send(self, text, sender, receiver, room=None):
+        return Message.objects.create(room_name=room or self.room, message=text, sender=sender, receiver=receiver)
+
+    def conversation(self):
+        return Conversation.objects.get(room_name=self.room)
+
+    def test_participants_come_from_the_room_name(self):
+        # A bogus receiver doesn't make carol a participant
+        self.send("hi", self.bob, self.carol)
+        conversation = self.conversation()
+        self.assertEqual(
+            {conversation.participant_one_id, conversation.participant_two_id}, {self.alice.id, self.bob.id}
+        )
+
+    def test_rows_are_linked_to_their_conversation(self):
+        message = self.send("hi", self.alice, self.bob)
+        self.assertEqual(message.conversation_id, self.conversation().id)
+        self.assertEqual(list(self.conversation().messages.all()), [message])
+
+    def test_backfill_links_unlinked_rows(self):
+        self.send("hi", self.alice, self.bob)
+        self.send("there", self.bob, self.alice)
+        Message.objects.update(conversation=None)
+
+        call_command('backfill_conversations', stdout=StringIO())
+
+        self.assertEqual(self.conversation().messages.count(), 2)
+        self.assertEqual(self.conversation().message_count, 2)
+
+    def test_sender_outside_the_room_is_refused(self):
+        with self.assertRaises(InvalidRoom):
+            self.send("hi", self.carol, self.alice)
+        self.assertFalse(Message.objects.exists())
+
+    def test_deleting_the_newest_message_restores_the_preview(self):
+        self.send("older", self.alice, self.bob)
+        newest = self.send("newer", self.bob, self.alice)
+
+        newest.delete()
+
+        conversation = self.conversation()
+        self.assertEqual(conversation.message_count, 1)
+        self.assertEqual(conversation.last_message_text, "older")
+        self.assertEqual(conversation.last_message_sender_id, self.alice.id)
+        self.assertEqual(conversation.last_message_at, Message.objects.get().timestamp)
+
+    def test_deleting_the_last_message_clears_the_preview(self):
+        self.send("only", self.alice, self.bob).delete()
+        conversation = self.conversation()
+        self.assertEqual((conversation.message_count, conversation.last_message_kind), (0, ''))
+        self.assertIsNone(conversation.last_message_at)
+
+    def test_deleting_an_unread_message_decrements_unread(self):
+        message = self.send("hi", self.bob, self.alice)
+        self.send("there", self.bob, self.alice)
+        message.delete()
+        self.assertEqual(self.conversation().unread_for(self.alice), 1)
+
+    def test_deleting_a_read_message_keeps_unread(self):
+        ContactList.objects.create(user=self.alice, contacts=self.bob)
+        read = self.send("read", self.bob, self.alice)
+        mark_read(self.room, self.alice)
+        ContactList.objects.update(last_read_at=timezone.now())
+        self.send("unread", self.bob, self.alice)
+
+        read.delete()
+        self.assertEqual(self.conversation().unread_for(self.alice), 1)
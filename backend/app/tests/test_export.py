@@ -0,0 +1,113 @@
+import csv
+import gzip
+import io
+import json
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import AsyncClient
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from API import export
+from app.models import Message, UploadedFile
+from app.storage import blob_storage
+
+
+class ConversationExportTests(APITestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(self.settings(MEDIA_ROOT=media_root))
+        cache.clear()
+
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.carol = User.objects.create(username='carol')
+        for i in range(3):
+            Message.objects.create(room_name='aliceandbob', message=f"hi {i}", sender=self.alice, receiver=self.bob)
+        self.uploaded = UploadedFile.objects.create(
+            sender=self.bob, receiver=self.alice, room_name='aliceandbob',
+            file=blob_storage.save('notes.txt', ContentFile(b'notes')), file_name='notes.txt', size=5,
+            message="for you",
+        )
+        Message.objects.create(room_name='aliceandbob', message="got it", sender=self.alice, receiver=self.bob)
+        self.client.force_authenticate(self.alice)
+
+    def export(self, **params):
+        response = self.client.get('/API/export/aliceandbob/', params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_ndjson_is_the_whole_timeline_oldest_first(self):
+        response = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="aliceandbob.ndjson"')
+
+        records = [json.loads(line) for line in self.body(response).decode().splitlines()]
+        self.assertEqual([record['message'] for record in records], ["hi 0", "hi 1", "hi 2", "for you", "got it"])
+        file_record = records[3]
+        self.assertEqual((file_record['type'], file_record['sender'], file_record['receiver']), ('file', 'bob', 'alice'))
+        self.assertEqual((file_record['file_name'], file_record['file_url']), ('notes.txt', self.uploaded.file.url))
+
+    def test_csv(self):
+        response = self.export(fmt='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+
+        rows = list(csv.DictReader(io.StringIO(self.body(response).decode())))
+        self.assertEqual([row['type'] for row in rows], ['text', 'text', 'text', 'file', 'text'])
+        self.assertEqual(rows[3]['file_name'], 'notes.txt')
+        self.assertEqual(rows[0]['file_name'], '')
+
+    def test_gzip(self):
+        response = self.export(fmt='csv', gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="aliceandbob.csv.gz"')
+        self.assertEqual(gzip.decompress(self.body(response)), self.body(self.export(fmt='csv')))
+
+    def test_unknown_format_is_refused(self):
+        self.assertEqual(self.client.get('/API/export/aliceandbob/', {'fmt': 'xml'}).status_code, 400)
+
+    def test_non_participant_gets_404(self):
+        self.client.force_authenticate(self.carol)
+        self.assertEqual(self.client.get('/API/export/aliceandbob/').status_code, 404)
+
+    def test_token_query_parameter(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/API/export/aliceandbob/').status_code, 401)
+
+        response = self.client.get('/API/export/aliceandbob/', {'token': str(AccessToken.for_user(self.bob))})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.body(response).splitlines()), 5)
+
+    async def test_asgi_streams_the_export_a_chunk_at_a_time(self):
+        read = []
+        real_record = export.export_record
+
+        def record(kind, obj):
+            read.append(obj.pk)
+            return real_record(kind, obj)
+
+        client = AsyncClient()
+        with mock.patch.object(export, 'export_record', record), mock.patch.object(export, 'FLUSH_BYTES', 1):
+            response = await client.get('/API/export/aliceandbob/', {'token': str(AccessToken.for_user(self.alice))})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+
+            chunks = []
+            async for chunk in response.streaming_content:
+                if not chunks:
+                    # Nothing past the first row has been turned into output
+                    self.assertEqual(len(read), 1)
+                chunks.append(chunk)
+
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(len(b''.join(chunks).splitlines()), 5)
@@ -0,0 +1,126 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from API.pagination import encode_cursor
+from app.models import Message
+
+
+class MessageHistoryPaginationTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.room = 'aliceandbob'
+        self.client.force_authenticate(self.alice)
+
+    def add_messages(self, count, timestamp=None):
+        start = timezone.now() - timedelta(hours=1)
+        messages = []
+        for i in range(count):
+            message = Message.objects.create(room_name=self.room, message=f"m{len(messages)}", sender=self.alice, receiver=self.bob)
+            # Same instant for all of them when given, to exercise the id tie-break
+            Message.objects.filter(pk=message.pk).update(timestamp=timestamp or start + timedelta(seconds=i))
+            messages.append(message.message)
+        return messages
+
+    def history(self, **params):
+        return self.client.get(f'/API/messages/{self.room}/', params)
+
+    def walk(self, direction, cursor_header, **params):
+        seen = []
+        response = self.history(**params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            page = [row['message'] for row in response.json()]
+            seen = page + seen if direction == 'before' else seen + page
+            if response['X-Has-More'] != 'true':
+                return seen
+            response = self.history(**{**params, direction: response[cursor_header]})
+
+    def test_newest_page_first(self):
+        messages = self.add_messages(5)
+        response = self.history(page_size=2)
+        self.assertEqual([row['message'] for row in response.json()], messages[-2:])
+        self.assertEqual(response['X-Has-More'], 'true')
+
+    def test_walking_back_visits_every_message_once(self):
+        messages = self.add_messages(7)
+        self.assertEqual(self.walk('before', 'X-Before-Cursor', page_size=3), messages)
+
+    def test_equal_timestamps_are_split_by_id(self):
+        messages = self.add_messages(5, timestamp=timezone.now())
+        self.assertEqual(self.walk('before', 'X-Before-Cursor', page_size=2), messages)
+
+    def test_walking_forward_from_a_cursor(self):
+        messages = self.add_messages(6)
+        first = Message.objects.order_by('timestamp', 'id').first()
+        cursor = encode_cursor(first.timestamp, 'text', first.pk)
+        self.assertEqual(self.walk('after', 'X-After-Cursor', after=cursor, page_size=2), messages[1:])
+
+    def test_page_size_is_capped(self):
+        self.add_messages(3)
+        with mock.patch('API.pagination.MAX_PAGE_SIZE', 2):
+            response = self.history(page_size=10_000)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_bad_parameters_are_rejected(self):
+        self.assertEqual(self.history(before='not-a-cursor').status_code, 400)
+        self.assertEqual(self.history(page_size=0).status_code, 400)
+        cursor = encode_cursor(timezone.now(), 'text', 1)
+        self.assertEqual(self.history(before=cursor, after=cursor).status_code, 400)
+
+
+class MessageHistoryETagTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.room = 'aliceandbob'
+        self.client.force_authenticate(self.alice)
+        self.send("hello")
+
+    def send(self, text):
+        return Message.objects.create(room_name=self.room, message=text, sender=self.bob, receiver=self.alice)
+
+    def history(self, etag=None, **params):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get(f'/API/messages/{self.room}/', params, headers=headers)
+
+    def test_unchanged_room_is_not_modified(self):
+        etag = self.history()['ETag']
+        response = self.history(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        # Weak comparison, as sent back by some proxies
+        self.assertEqual(self.history(f'W/{etag}').status_code, 304)
+
+    def test_new_message_changes_the_etag(self):
+        etag = self.history()['ETag']
+        self.send("again")
+        response = self.history(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_the_query(self):
+        etag = self.history()['ETag']
+        self.assertEqual(self.history(etag, page_size=1).status_code, 200)
+
+    def test_since_returns_only_newer_messages(self):
+        response = self.history()
+        cursor = response['X-After-Cursor']
+        self.send("new")
+        self.assertEqual([row['message'] for row in self.history(since=cursor).json()], ['new'])
+
+        timestamp = Message.objects.get(message="hello").timestamp.isoformat()
+        self.assertEqual([row['message'] for row in self.history(since=timestamp).json()], ['new'])
+
+    def test_since_needs_an_offset(self):
+        self.assertEqual(self.history(since='2024-01-01T00:00:00').status_code, 400)
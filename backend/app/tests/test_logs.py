@@ -0,0 +1,47 @@
+import json
+import logging
+import uuid
+
+from django.test import RequestFactory, SimpleTestCase
+
+from app.logs import JSONFormatter
+
+
+class JSONFormatterTests(SimpleTestCase):
+
+    def format(self, **extra):
+        record = logging.makeLogRecord({'name': 'django.request', 'levelname': 'WARNING', 'msg': 'Not Found: %s',
+                                        'args': ('/media/a.png',), **extra})
+        return json.loads(JSONFormatter().format(record))
+
+    def test_request_is_logged_without_its_query_string(self):
+        request = RequestFactory().get('/media/a.png', {'token': 'eyJhbGciOiJIUzI1NiJ9.secret'})
+        line = JSONFormatter().format(logging.makeLogRecord({
+            'name': 'django.request', 'msg': 'Not Found: %s', 'args': (request.path,),
+            'request': request, 'status_code': 404,
+        }))
+
+        self.assertNotIn('token', line)
+        self.assertNotIn('eyJhbGci', line)
+        entry = json.loads(line)
+        self.assertEqual(entry['request'], {'method': 'GET', 'path': '/media/a.png'})
+        self.assertEqual(entry['status_code'], 404)
+        self.assertEqual(entry['message'], 'Not Found: /media/a.png')
+
+    def test_plain_extras_are_kept(self):
+        room_id = uuid.uuid4()
+        entry = self.format(event='history.page', room='aliceandbob', count=3, id=room_id,
+                            payload=[{'message': 'hi', 'sender': 'alice'}])
+        self.assertEqual(entry['room'], 'aliceandbob')
+        self.assertEqual(entry['count'], 3)
+        self.assertEqual(entry['id'], str(room_id))
+        self.assertEqual(entry['payload'], [{'message': 'hi', 'sender': 'alice'}])
+
+    def test_other_objects_are_reduced_to_their_type(self):
+        class Secretive:
+            def __repr__(self):
+                return 'password=hunter2'
+
+        entry = self.format(thing=Secretive(), nested={'inner': [Secretive()]})
+        self.assertEqual(entry['thing'], '<Secretive>')
+        self.assertEqual(entry['nested'], {'inner': ['<Secretive>']})
@@ -0,0 +1,92 @@
+import threading
+from unittest import mock
+
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import SimpleTestCase, TestCase
+
+from app.mail import MailQueue, get_mail_queue
+from app.models import OTP
+
+failures = {'left': 0}
+
+
+class FlakyBackend(EmailBackend):
+    # locmem, failing the next failures['left'] sends
+
+    def send_messages(self, messages):
+        if failures['left']:
+            failures['left'] -= 1
+            raise ConnectionError("SMTP went away")
+        return super().send_messages(messages)
+
+
+def message(to='alice@example.com'):
+    return EmailMessage('Your OTP Code', 'Your OTP is 123456', 'noreply@example.com', [to])
+
+
+class MailQueueTests(SimpleTestCase):
+
+    def setUp(self):
+        failures['left'] = 0
+
+    def test_queued_mail_is_sent_in_the_background(self):
+        mail_queue = MailQueue(batch_size=10, idle_timeout=0.1)
+        for i in range(3):
+            mail_queue.send(message(f"user{i}@example.com"))
+
+        self.assertTrue(mail_queue.flush(5))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), [f"user{i}@example.com" for i in range(3)])
+        self.assertEqual((mail_queue.sent, mail_queue.failed, mail_queue.queue_depth), (3, 0, 0))
+
+    def test_failed_send_is_retried_with_backoff_on_a_timer(self):
+        failures['left'] = 2
+        mail_queue = MailQueue(backoff=0.01, max_retries=5, idle_timeout=0.1)
+
+        with self.settings(EMAIL_BACKEND='app.tests.test_mail.FlakyBackend'), \
+                mock.patch('app.mail.threading.Timer', wraps=threading.Timer) as timer, \
+                self.assertLogs('app.mail', level='WARNING'):
+            mail_queue.send(message())
+            self.assertTrue(mail_queue.flush(5))
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual((mail_queue.sent, mail_queue.retries, mail_queue.failed), (1, 2, 0))
+        # Doubling delays, waited out off the worker thread
+        self.assertEqual([call.args[0] for call in timer.call_args_list], [0.01, 0.02])
+
+    def test_gives_up_after_max_retries(self):
+        failures['left'] = 100
+        mail_queue = MailQueue(backoff=0.01, max_retries=3, idle_timeout=0.1)
+
+        with self.settings(EMAIL_BACKEND='app.tests.test_mail.FlakyBackend'), \
+                self.assertLogs('app.mail', level='WARNING') as logs:
+            mail_queue.send(message())
+            self.assertTrue(mail_queue.flush(5))
+
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual((mail_queue.sent, mail_queue.retries, mail_queue.failed), (0, 2, 1))
+        self.assertIn('Giving up', logs.output[-1])
+
+    def test_one_failure_does_not_hold_up_other_mail(self):
+        failures['left'] = 1
+        mail_queue = MailQueue(backoff=0.05, idle_timeout=0.1)
+
+        with self.settings(EMAIL_BACKEND='app.tests.test_mail.FlakyBackend'), self.assertLogs('app.mail', level='WARNING'):
+            mail_queue.send(message('first@example.com'))
+            mail_queue.send(message('second@example.com'))
+            self.assertTrue(mail_queue.flush(5))
+
+        # The second went out while the first waited for its retry
+        self.assertEqual([m.to[0] for m in mail.outbox], ['second@example.com', 'first@example.com'])
+
+
+class SendOtpTests(TestCase):
+
+    def test_otp_mail_goes_through_the_queue(self):
+        response = self.client.post('/API/signup/send-otp/', {'email': 'alice@example.com'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertTrue(get_mail_queue().flush(5))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(OTP.objects.get(email='alice@example.com').otp_code, mail.outbox[0].body)
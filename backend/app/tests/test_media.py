@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import AsyncClient
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from API import media
+from app.models import UploadedFile
+from app.storage import blob_storage
+
+
+class MediaViewTests(APITestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(self.settings(MEDIA_ROOT=media_root))
+        cache.clear()
+
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.carol = User.objects.create(username='carol')
+        self.content = os.urandom(200 * 1024)
+        self.uploaded = UploadedFile.objects.create(
+            sender=self.alice, receiver=self.bob, room_name='aliceandbob',
+            file=blob_storage.save('clip.mp4', ContentFile(self.content)), file_name='clip.mp4',
+        )
+        self.url = self.uploaded.file.url
+        self.client.force_authenticate(self.bob)
+
+    def get(self, **headers):
+        return self.client.get(self.url, headers=headers)
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(int(response['Content-Length']), len(self.content))
+        self.assertEqual(self.body(response), self.content)
+
+    def test_byte_range(self):
+        response = self.get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(self.body(response), self.content[10:20])
+
+    def test_suffix_and_open_ended_ranges(self):
+        self.assertEqual(self.body(self.get(Range='bytes=-5')), self.content[-5:])
+        self.assertEqual(self.body(self.get(Range=f'bytes={len(self.content) - 3}-')), self.content[-3:])
+
+    def test_unsatisfiable_range(self):
+        response = self.get(Range=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_stale_if_range_sends_the_whole_file(self):
+        response = self.get(Range='bytes=0-9', **{'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.body(response)), len(self.content))
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(**{'If-None-Match': etag}).status_code, 304)
+
+    def test_only_participants_can_fetch(self):
+        self.client.force_authenticate(self.carol)
+        self.assertEqual(self.get().status_code, 404)
+
+    async def test_asgi_streams_the_file_a_block_at_a_time(self):
+        read_sizes = []
+        real_read = media.RangeFile.read
+
+        def read(range_file, size=-1):
+            data = real_read(range_file, size)
+            read_sizes.append(len(data))
+            return data
+
+        client = AsyncClient()
+        with mock.patch.object(media.RangeFile, 'read', read):
+            response = await client.get(self.url, {'token': str(AccessToken.for_user(self.bob))}, headers={'Range': 'bytes=0-'})
+            self.assertEqual(response.status_code, 206)
+            self.assertTrue(response.is_async)
+
+            chunks = []
+            async for chunk in response.streaming_content:
+                if not chunks:
+                    # Only the first block has been read off the disk
+                    self.assertEqual(sum(read_sizes), len(chunk))
+                chunks.append(chunk)
+
+        self.assertEqual(b''.join(chunks), self.content)
+        self.assertGreater(len(chunks), 1)
+        self.assertLessEqual(max(read_sizes), media.STREAM_BLOCK_SIZE)
@@ -0,0 +1,155 @@
+import asyncio
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError
+from django.test import TransactionTestCase
+
+from app import conversations
+from app.models import Conversation, Message
+from app.persistence import MessageWriteBuffer
+
+
+class MessageWriteBufferTests(TransactionTestCase):
+    # Foreign keys are checked at commit, so these need real transactions
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.room = 'aliceandbob'
+
+    def message(self, text, sender=None, receiver=None):
+        return Message(room_name=self.room, message=text, sender=sender or self.alice, receiver=receiver or self.bob)
+
+    async def count(self, **filters):
+        return await Message.objects.filter(**filters).acount()
+
+    async def test_flush_writes_pending_rows_and_counters(self):
+        buffer = MessageWriteBuffer(batch_size=100, flush_interval_ms=1000)
+        for i in range(3):
+            await buffer.enqueue(self.message(f"hi {i}"))
+        self.assertEqual(await self.count(), 0)
+
+        await buffer.flush()
+
+        self.assertEqual(await self.count(room_name=self.room), 3)
+        conversation = await Conversation.objects.aget(room_name=self.room)
+        self.assertEqual(conversation.message_count, 3)
+        self.assertEqual(conversation.unread_for(self.bob), 3)
+        self.assertEqual(buffer.queue_depth, 0)
+
+    async def test_full_batch_flushes_without_waiting(self):
+        buffer = MessageWriteBuffer(batch_size=2, flush_interval_ms=60000)
+        await buffer.enqueue(self.message("one"))
+        await buffer.enqueue(self.message("two"))
+        self.assertEqual(await self.count(), 2)
+
+    async def test_timer_flushes_partial_batch(self):
+        buffer = MessageWriteBuffer(batch_size=100, flush_interval_ms=10)
+        await buffer.enqueue(self.message("one"))
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if buffer.written:
+                break
+        self.assertEqual(await self.count(), 1)
+        self.assertFalse(buffer._tasks)
+
+    async def test_poison_row_is_dropped_and_the_rest_written(self):
+        buffer = MessageWriteBuffer(batch_size=100, flush_interval_ms=1000)
+        ghost = User(id=999999, username='ghost')
+        await buffer.enqueue(self.message("before"))
+        await buffer.enqueue(self.message("poison", sender=ghost))
+        await buffer.enqueue(self.message("after"))
+
+        with self.assertLogs('app.persistence', level='ERROR'):
+            await buffer.flush()
+
+        texts = await sync_to_async(lambda: sorted(Message.objects.values_list('message', flat=True)))()
+        self.assertEqual(texts, ['after', 'before'])
+        self.assertEqual(buffer.dropped, 1)
+        self.assertEqual(buffer.queue_depth, 0)
+
+        # Later messages are not held up by it
+        await buffer.enqueue(self.message("later"))
+        await buffer.flush()
+        self.assertEqual(await self.count(), 3)
+
+    async def test_conversation_deleted_elsewhere_is_recreated(self):
+        buffer = MessageWriteBuffer(batch_size=100, flush_interval_ms=1000)
+        await buffer.enqueue(self.message("first"))
+        await buffer.flush()
+        # Deleted by another process whose signal cleared a cache this one
+        # doesn't share; this one still has the old id
+        stale = await cache.aget(conversations.conversation_cache_key(self.room))
+        await Conversation.objects.filter(room_name=self.room).adelete()
+        await cache.aset(conversations.conversation_cache_key(self.room), stale)
+
+        await buffer.enqueue(self.message("second"))
+        await buffer.flush()
+
+        self.assertEqual(await self.count(message="second"), 1)
+        conversation = await Conversation.objects.aget(room_name=self.room)
+        self.assertEqual(conversation.message_count, 1)
+        self.assertEqual(conversation.last_message_text, "second")
+        self.assertEqual(await self.count(message="second", conversation=conversation), 1)
+        # Relinked in the same transaction, not dropped to the row-by-row retry
+        self.assertEqual(buffer.failed_flushes, 0)
+
+    async def test_sender_outside_the_room_is_dropped(self):
+        buffer = MessageWriteBuffer(batch_size=100, flush_interval_ms=1000)
+        carol = await User.objects.acreate(username='carol')
+        await buffer.enqueue(self.message("spoofed", sender=carol))
+        await buffer.enqueue(self.message("fine"))
+
+        with self.assertLogs('app.persistence', level='ERROR'):
+            await buffer.flush()
+
+        self.assertEqual(await self.count(message="fine"), 1)
+        self.assertEqual(buffer.dropped, 1)
+
+    async def test_database_outage_keeps_rows_for_retry(self):
+        buffer = MessageWriteBuffer(batch_size=100, flush_interval_ms=60000)
+        await buffer.enqueue(self.message("kept"))
+
+        with mock.patch.object(buffer, '_write', side_effect=OperationalError("database is locked")):
+            with self.assertLogs('app.persistence', level='ERROR'):
+                await buffer.flush()
+        self.assertEqual(buffer.queue_depth, 1)
+        self.assertEqual(buffer.dropped, 0)
+
+        buffer._timer.cancel()
+        buffer._timer = None
+        await buffer.flush()
+        self.assertEqual(await self.count(message="kept"), 1)
+
+    async def test_full_buffer_applies_backpressure(self):
+        buffer = MessageWriteBuffer(batch_size=100, flush_interval_ms=5, max_pending=2)
+        real_write = buffer._write
+        outage = {'on': True}
+
+        def write(batch):
+            if outage['on']:
+                raise OperationalError("database is locked")
+            real_write(batch)
+
+        with mock.patch.object(buffer, '_write', side_effect=write), self.assertLogs('app.persistence', level='ERROR'):
+            await buffer.enqueue(self.message("one"))
+            await buffer.enqueue(self.message("two"))
+            third = asyncio.ensure_future(buffer.enqueue(self.message("three")))
+            # Wait for writes to have failed, however slow the first one is
+            for _ in range(500):
+                await asyncio.sleep(0.01)
+                if buffer.failed_flushes >= 2:
+                    break
+            # Still waiting, and the buffer never grew past its cap
+            self.assertFalse(third.done())
+            self.assertLessEqual(buffer.queue_depth, 2)
+
+            outage['on'] = False
+            await asyncio.wait_for(third, 5)
+            await buffer.flush()
+
+        self.assertEqual(await self.count(), 3)
@@ -0,0 +1,111 @@
+import asyncio
+import gc
+from unittest import mock
+
+from channels.layers import DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer, channel_layers
+from django.test import SimpleTestCase
+
+from app.presence import Coalescer, TypingTracker, presence_frame, typing_frame
+
+
+class PresenceTestCase(SimpleTestCase):
+    group = 'chat_aliceandbob'
+
+    def setUp(self):
+        # Redis isn't available to tests
+        self.layer = InMemoryChannelLayer()
+        channel_layers.set(DEFAULT_CHANNEL_LAYER, self.layer)
+        self.coalescer = Coalescer(0.02)
+        self.enterContext(mock.patch('app.presence.coalescer', self.coalescer))
+
+    async def listen(self):
+        self.channel = await self.layer.new_channel()
+        await self.layer.group_add(self.group, self.channel)
+
+    async def broadcasts(self, timeout=0.2):
+        """Every presence_update the group receives within ``timeout``."""
+        events = []
+        while True:
+            try:
+                events.append(await asyncio.wait_for(self.layer.receive(self.channel), timeout))
+            except asyncio.TimeoutError:
+                return [event['frames'] for event in events]
+
+
+class CoalescerTests(PresenceTestCase):
+
+    def publish(self, username, online):
+        self.coalescer.publish(self.group, ('presence', username), online, presence_frame(username, online, None))
+
+    async def test_changes_in_one_window_go_out_as_one_event(self):
+        await self.listen()
+        self.publish('alice', True)
+        self.publish('bob', True)
+        self.assertEqual(await self.broadcasts(), [[presence_frame('alice', True, None), presence_frame('bob', True, None)]])
+
+    async def test_change_undone_inside_the_window_is_never_sent(self):
+        await self.listen()
+        self.publish('alice', True)
+        self.publish('alice', False)
+        self.assertEqual(await self.broadcasts(), [])
+        self.assertEqual(self.coalescer.broadcasts, 0)
+
+    async def test_state_the_room_already_heard_is_not_repeated(self):
+        await self.listen()
+        self.publish('alice', True)
+        self.assertEqual(len(await self.broadcasts()), 1)
+        self.publish('alice', True)
+        self.assertEqual(await self.broadcasts(), [])
+
+    async def test_flush_is_kept_until_it_finishes(self):
+        release = asyncio.Event()
+        sent = []
+
+        async def slow_group_send(group, event):
+            await release.wait()
+            sent.append(event)
+
+        with mock.patch.object(self.layer, 'group_send', slow_group_send):
+            self.publish('alice', True)
+            for _ in range(100):
+                if self.coalescer.tasks:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(len(self.coalescer.tasks), 1)
+
+            # Only the coalescer holds the task; it must survive a collection
+            gc.collect()
+            release.set()
+            for _ in range(100):
+                if sent:
+                    break
+                await asyncio.sleep(0.01)
+
+        self.assertEqual(len(sent), 1)
+        await asyncio.sleep(0)
+        self.assertEqual(self.coalescer.tasks, set())
+
+
+class TypingTrackerTests(PresenceTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch('app.presence.TYPING_TIMEOUT', 0.1))
+        self.typing = TypingTracker()
+
+    async def test_typing_frames_are_debounced(self):
+        await self.listen()
+        for _ in range(5):
+            self.typing.touch(self.group, 'alice')
+            await asyncio.sleep(0.03)
+
+        # One typing=true for the whole run of keystrokes, then typing=false
+        # once they stop for TYPING_TIMEOUT
+        self.assertEqual(await self.broadcasts(0.3), [[typing_frame('alice', True)], [typing_frame('alice', False)]])
+        self.assertEqual(self.typing.deadlines, {})
+
+    async def test_typing_that_stops_inside_the_window_is_never_sent(self):
+        await self.listen()
+        self.typing.touch(self.group, 'alice')
+        self.typing.stop(self.group, 'alice')
+        self.assertEqual(await self.broadcasts(), [])
@@ -0,0 +1,66 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from rest_framework.test import APITestCase
+
+from app.models import ContactList, Message, UploadedFile
+from app.profiling import assert_max_queries
+
+
+class QueryBudgetTests(APITestCase):
+    # Each budget holds whatever the size of the data, so an N+1 fails here
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(username='alice')
+        self.client.force_authenticate(self.alice)
+
+    def add_contacts(self, n):
+        for i in range(n):
+            contact = User.objects.create(username=f"contact{ContactList.objects.count():03d}")
+            ContactList.objects.create(user=self.alice, contacts=contact)
+            self.exchange(contact, 1)
+
+    def exchange(self, contact, n):
+        room = 'and'.join(sorted([self.alice.username, contact.username]))
+        for i in range(n):
+            Message.objects.create(room_name=room, message=f"hi {i}", sender=contact, receiver=self.alice)
+            UploadedFile.objects.create(
+                room_name=room, sender=self.alice, receiver=contact, file_name=f"{i}.png", file=f"{i}.png",
+            )
+        return room
+
+    def test_contact_list(self):
+        for n in (1, 20):
+            self.add_contacts(n)
+            cache.clear()
+            # Contacts with their profiles, then their conversations
+            with assert_max_queries(2, f"contacts x{ContactList.objects.count()}"):
+                response = self.client.get('/API/contacts/')
+            self.assertEqual(len(response.json()), ContactList.objects.count())
+
+            with assert_max_queries(0, 'cached contacts'):
+                self.client.get('/API/contacts/')
+
+    def test_get_user(self):
+        with assert_max_queries(1, 'get-user'):
+            response = self.client.get('/API/get-user/')
+        self.assertEqual(response.json()['username'], 'alice')
+
+    def test_message_list(self):
+        bob = User.objects.create(username='bob')
+        for n in (1, 30):
+            room = self.exchange(bob, n)
+            # ETag (newest text and file id), a page of each, and mark_read
+            # finding nothing unread or zeroing the counter, plus
+            # ContactList.last_read_at
+            with assert_max_queries(7, f"unread messages x{n}"):
+                response = self.client.get(f"/API/messages/{room}/")
+            self.assertTrue(response.json())
+
+            with assert_max_queries(5, f"read messages x{n}"):
+                self.client.get(f"/API/messages/{room}/")
+
+            etag = response['ETag']
+            with assert_max_queries(2, '304'):
+                response = self.client.get(f"/API/messages/{room}/", HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
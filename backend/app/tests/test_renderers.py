@@ -0,0 +1,45 @@
+import datetime
+import uuid
+from decimal import Decimal
+from unittest import mock
+
+from django.test import SimpleTestCase
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+
+from API.renderers import FastJSONRenderer
+from app.codec import CODECS, orjson
+
+PAYLOAD = {
+    'text': 'line\u2028break\u2029para, caf\u00e9 \U0001f600 "quoted"',
+    'at': datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+    'offset_at': datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=5, minutes=30))),
+    'naive_at': datetime.datetime(2024, 5, 1, 12, 30),
+    'day': datetime.date(2024, 5, 1),
+    'time': datetime.time(8, 15),
+    'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+    'amount': Decimal('1.50'),
+    'label': gettext_lazy('Hello'),
+    'nested': [{'n': 1, 'f': 0.5, 'none': None, 'flag': True}],
+}
+
+
+class FastJSONRendererTests(SimpleTestCase):
+
+    def assert_matches_drf(self):
+        self.assertEqual(FastJSONRenderer().render(PAYLOAD), JSONRenderer().render(PAYLOAD))
+
+    def test_matches_drf_with_each_codec(self):
+        for name, codec_class in CODECS.items():
+            if name == 'orjson' and orjson is None:
+                continue
+            with self.subTest(codec=name), mock.patch('API.renderers.codec', codec_class()):
+                self.assert_matches_drf()
+
+    def test_utc_datetimes_use_z(self):
+        body = FastJSONRenderer().render({'at': PAYLOAD['at']})
+        self.assertEqual(body, b'{"at":"2024-05-01T12:30:15.123456Z"}')
+
+    def test_line_separators_are_escaped(self):
+        body = FastJSONRenderer().render({'text': 'a\u2028b\u2029c'})
+        self.assertEqual(body, b'{"text":"a\\u2028b\\u2029c"}')
@@ -0,0 +1,127 @@
+from contextlib import ExitStack
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from app.models import ContactList
+from app.routers import PrimaryReplicaRouter, is_pinned, pin_to_primary, primary_reads, replica_reads
+
+REPLICAS = ['replica_1', 'replica_2']
+
+# Registered at import, before the runner sets up the test databases. As
+# test mirrors the replicas are the primary's database on connections of
+# their own, so which alias a query went to can be told apart.
+for alias in REPLICAS:
+    connections.settings.setdefault(alias, dict(connections['default'].settings_dict, TEST={'MIRROR': 'default'}))
+
+
+class ReplicaTestCase(TransactionTestCase):
+    databases = {'default', *REPLICAS}
+    client_class = APIClient
+
+    def setUp(self):
+        cache.clear()
+        self.enterContext(mock.patch('app.routers.REPLICAS', REPLICAS))
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+
+    def queries(self):
+        """Context managers capturing the queries sent to each alias."""
+        return {alias: CaptureQueriesContext(connections[alias]) for alias in ('default', *REPLICAS)}
+
+    def run_view(self, handler, user):
+        request = mock.Mock(user=user)
+        captured = self.queries()
+        with ExitStack() as stack:
+            for context in captured.values():
+                stack.enter_context(context)
+            replica_reads(lambda view, request: handler())(None, request)
+        return {alias: [query['sql'] for query in context] for alias, context in captured.items()}
+
+    def counts(self, queries):
+        return {alias: len(sqls) for alias, sqls in queries.items()}
+
+
+class PrimaryReplicaRouterTests(ReplicaTestCase):
+
+    def read_a_few(self):
+        for _ in range(5):
+            list(User.objects.all())
+
+    def test_replica_is_chosen_once_per_request(self):
+        with mock.patch('app.routers.random.choice', return_value='replica_2') as choice:
+            counts = self.counts(self.run_view(self.read_a_few, self.alice))
+        choice.assert_called_once_with(REPLICAS)
+        self.assertEqual(counts, {'default': 0, 'replica_1': 0, 'replica_2': 5})
+
+    def test_reads_outside_replica_views_use_the_primary(self):
+        self.assertIsNone(PrimaryReplicaRouter().db_for_read(User))
+        self.assertEqual(User.objects.all().db, 'default')
+
+    def test_writes_go_to_the_primary(self):
+        def write():
+            user = User.objects.get(username='bob')
+            user.first_name = 'Bob'
+            user.save()
+
+        with mock.patch('app.routers.random.choice', return_value='replica_1'):
+            queries = self.run_view(write, self.alice)
+        self.assertTrue(queries['replica_1'])
+        self.assertTrue(all(sql.startswith('SELECT') for sql in queries['replica_1']))
+        self.assertTrue(any(sql.startswith('UPDATE') for sql in queries['default']))
+        self.assertEqual(User.objects.get(username='bob').first_name, 'Bob')
+
+    def test_primary_reads_inside_a_replica_view(self):
+        def read():
+            list(User.objects.all())
+            with primary_reads():
+                list(User.objects.all())
+
+        with mock.patch('app.routers.random.choice', return_value='replica_1'):
+            counts = self.counts(self.run_view(read, self.alice))
+        self.assertEqual((counts['replica_1'], counts['default']), (1, 1))
+
+    def test_pinned_user_reads_the_primary(self):
+        pin_to_primary(self.alice.id)
+        with mock.patch('app.routers.random.choice') as choice:
+            counts = self.counts(self.run_view(self.read_a_few, self.alice))
+        choice.assert_not_called()
+        self.assertEqual(counts, {'default': 5, 'replica_1': 0, 'replica_2': 0})
+
+
+class ReplicaViewTests(ReplicaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.alice)
+
+    def test_a_write_pins_its_author(self):
+        response = self.client.post('/API/contacts/', {'privateKey': str(self.bob.userprofile.private_key)}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(is_pinned(self.alice.id))
+        self.assertFalse(is_pinned(self.bob.id))
+
+    def test_failed_write_does_not_pin(self):
+        response = self.client.post('/API/contacts/', {'privateKey': 'not-a-uuid'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(is_pinned(self.alice.id))
+
+    def test_contact_list_cache_is_filled_from_the_primary(self):
+        ContactList.objects.create(user=self.alice, contacts=self.bob)
+        captured = self.queries()
+        with ExitStack() as stack:
+            for context in captured.values():
+                stack.enter_context(context)
+            self.assertEqual([c['name'] for c in self.client.get('/API/contacts/').json()], ['bob'])
+        self.assertEqual(len(captured['replica_1']) + len(captured['replica_2']), 0)
+        self.assertTrue(len(captured['default']))
+
+        # Served from the cache afterwards
+        with CaptureQueriesContext(connections['default']) as primary:
+            self.client.get('/API/contacts/')
+        self.assertEqual(len(primary), 0)
@@ -0,0 +1,92 @@
+from io import StringIO
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from rest_framework.test import APITestCase
+
+from app.models import Message, UploadedFile
+from app.search import search_messages
+
+
+class MessageSearchTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        for text in ("lunch at noon?", "Lunch moved to one", "see you tomorrow"):
+            Message.objects.create(room_name='aliceandbob', message=text, sender=self.alice, receiver=self.bob)
+        self.client.force_authenticate(self.alice)
+
+    def search(self, text, **params):
+        response = self.client.get('/API/search/', {'q': text, **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def found(self, text, **params):
+        return {row['message'] for row in self.search(text, **params).json()}
+
+    def test_full_text_search(self):
+        self.assertEqual(self.found('lunch'), {"lunch at noon?", "Lunch moved to one"})
+
+    def test_edited_message_is_reindexed(self):
+        message = Message.objects.get(message="see you tomorrow")
+        message.message = "see you friday"
+        message.save()
+
+        self.assertEqual(self.found('tomorrow'), set())
+        self.assertEqual(self.found('friday'), {"see you friday"})
+
+    def test_deleted_message_leaves_the_index(self):
+        Message.objects.get(message="lunch at noon?").delete()
+        self.assertEqual(self.found('lunch'), {"Lunch moved to one"})
+
+    def test_file_name_and_caption_match(self):
+        UploadedFile.objects.create(
+            room_name='aliceandbob', sender=self.bob, receiver=self.alice, file='',
+            file_name='quarterly-report.pdf', message="budget numbers",
+        )
+        for text in ('quarterly', 'budget'):
+            rows = self.search(text).json()
+            self.assertEqual([(row['type'], row['file_name']) for row in rows], [('file', 'quarterly-report.pdf')])
+
+    def test_results_come_only_from_the_users_rooms(self):
+        carol = User.objects.create(username='carol')
+        Message.objects.create(room_name='bobandcarol', message="lunch without alice", sender=self.bob, receiver=carol)
+
+        self.assertEqual(self.found('lunch'), {"lunch at noon?", "Lunch moved to one"})
+        self.assertEqual(self.client.get('/API/search/', {'q': 'lunch', 'room': 'bobandcarol'}).status_code, 404)
+
+        self.client.force_authenticate(carol)
+        self.assertEqual(self.found('lunch'), {"lunch without alice"})
+        self.assertEqual(self.client.get('/API/search/', {'q': 'lunch', 'room': 'aliceandbob'}).status_code, 404)
+
+    def test_pages_and_has_more(self):
+        first = self.search('lunch', page_size=1)
+        second = self.search('lunch', page_size=1, page=2)
+        self.assertEqual((first['X-Has-More'], second['X-Has-More']), ('true', 'false'))
+        self.assertEqual(
+            {row['message'] for row in first.json() + second.json()}, {"lunch at noon?", "Lunch moved to one"}
+        )
+
+    def test_rebuild_search_index_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM app_search")
+        self.assertEqual(self.found('lunch'), set())
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.found('lunch'), {"lunch at noon?", "Lunch moved to one"})
+
+    def test_other_databases_fall_back_to_icontains(self):
+        # Neither SQLite nor PostgreSQL: no index, but no error either
+        other = SimpleNamespace(vendor='mysql', alias='default')
+        matches = search_messages('LUNCH one', ['aliceandbob'], limit=10, using=other)
+        self.assertEqual(
+            [Message.objects.get(pk=pk).message for kind, pk, score in matches], ["Lunch moved to one"]
+        )
+
+        matches = search_messages('lunch', ['aliceandbob'], limit=1, offset=1, using=other)
+        self.assertEqual([Message.objects.get(pk=pk).message for kind, pk, score in matches], ["lunch at noon?"])
@@ -0,0 +1,29 @@
+import threading
+
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+
+from app.models import OTP
+from app.sqlite import run_write
+
+
+def write_otp(email):
+    OTP.objects.create(email=email, otp_code='123456')
+    return threading.current_thread().name
+
+
+@override_settings(SQLITE_SERIALIZE_WRITES=True)
+class RunWriteTests(TransactionTestCase):
+
+    def test_writes_run_on_the_writer_thread(self):
+        self.assertTrue(run_write(write_otp, 'a@example.com').startswith('sqlite-writer'))
+        self.assertTrue(OTP.objects.filter(email='a@example.com').exists())
+
+    def test_writes_inside_an_open_transaction_run_in_place(self):
+        # Routing these would deadlock on the caller's lock, and take the
+        # write out of the caller's transaction
+        with transaction.atomic():
+            thread = run_write(write_otp, 'b@example.com')
+            transaction.set_rollback(True)
+        self.assertEqual(thread, threading.current_thread().name)
+        self.assertFalse(OTP.objects.filter(email='b@example.com').exists())
@@ -0,0 +1,78 @@
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from PIL import Image
+
+from app import thumbnails
+from app.models import UploadedFile
+from app.storage import blob_storage
+
+
+def png():
+    buffer = BytesIO()
+    Image.new('RGB', (800, 600), 'red').save(buffer, 'PNG')
+    return ContentFile(buffer.getvalue(), name='photo.png')
+
+
+class VariantReadinessTests(TransactionTestCase):
+    # The pool reports back on its own thread, with its own connection
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(self.settings(MEDIA_ROOT=media_root))
+        cache.clear()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+
+    def upload(self):
+        with mock.patch('app.signals.schedule_variants'):
+            return UploadedFile.objects.create(
+                sender=self.alice, receiver=self.bob, room_name='aliceandbob',
+                file=blob_storage.save('photo.png', png()), file_name='photo.png',
+            )
+
+    def test_urls_come_from_the_flag_without_touching_storage(self):
+        uploaded = self.upload()
+        with mock.patch.object(blob_storage, 'exists', side_effect=AssertionError("stat")):
+            urls = thumbnails.variant_urls(uploaded.file)
+            self.assertEqual(set(urls.values()), {uploaded.file.url})
+
+            uploaded.file_variants_ready = True
+            urls = thumbnails.variant_urls(uploaded.file)
+        self.assertEqual(urls['thumb'], blob_storage.url(thumbnails.variant_name(uploaded.file.name, 'thumb')))
+
+    def test_rendering_marks_every_row_with_the_file(self):
+        first, second = self.upload(), self.upload()
+        pool = ThreadPoolExecutor(max_workers=1)
+        with mock.patch('app.thumbnails.get_pool', return_value=pool):
+            thumbnails.schedule_variants(first.file)
+            pool.shutdown(wait=True)
+
+        self.assertEqual(UploadedFile.objects.filter(file_variants_ready=True).count(), 2)
+        for variant in thumbnails.VARIANTS:
+            self.assertTrue(blob_storage.exists(thumbnails.variant_name(first.file.name, variant)))
+
+        # Already rendered: marked right away, nothing queued
+        third = self.upload()
+        with mock.patch('app.thumbnails.get_pool', side_effect=AssertionError("queued")):
+            thumbnails.schedule_variants(third.file)
+        third.refresh_from_db()
+        self.assertTrue(third.file_variants_ready)
+
+    def test_command_catches_up_existing_rows(self):
+        uploaded = self.upload()
+        pool = ThreadPoolExecutor(max_workers=1)
+        with mock.patch('app.management.commands.render_variants.get_pool', return_value=pool), \
+                mock.patch('app.thumbnails.get_pool', return_value=pool):
+            call_command('render_variants', stdout=StringIO())
+        uploaded.refresh_from_db()
+        self.assertTrue(uploaded.file_variants_ready)
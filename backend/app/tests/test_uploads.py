@@ -0,0 +1,271 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from channels.layers import DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer, channel_layers
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from API.uploads import _hasher_at, part_path
+from app.models import Blob, ChunkedUpload, UploadedFile
+from app.rooms import room_name_for
+from app.storage import blob_storage
+
+
+class ChunkedUploadTests(APITestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(self.settings(MEDIA_ROOT=media_root))
+        channel_layers.set(DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer())
+        cache.clear()
+
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.client.force_authenticate(self.alice)
+        self.content = os.urandom(1000)
+
+    def start(self, **overrides):
+        data = {'receiver': 'bob', 'room_name': 'aliceandbob', 'file_name': 'notes.bin', 'size': len(self.content)}
+        return self.client.post('/API/upload-file/chunked/', {**data, **overrides}, format='json')
+
+    def put(self, upload_id, start, end):
+        return self.client.put(
+            f'/API/upload-file/chunked/{upload_id}/', self.content[start:end + 1],
+            content_type='application/octet-stream',
+            headers={'Content-Range': f'bytes {start}-{end}/{len(self.content)}'},
+        )
+
+    def finalize(self, upload_id):
+        return self.client.post(f'/API/upload-file/chunked/{upload_id}/finalize/', format='json')
+
+    def upload(self):
+        upload_id = self.start().json()['upload_id']
+        self.assertEqual(self.put(upload_id, 0, 999).status_code, 200)
+        return upload_id
+
+    def test_resume_from_the_committed_offset(self):
+        upload_id = self.start().json()['upload_id']
+        self.assertEqual(self.put(upload_id, 0, 399).json()['offset'], 400)
+        self.assertEqual(self.client.get(f'/API/upload-file/chunked/{upload_id}/').json()['offset'], 400)
+        self.assertEqual(self.put(upload_id, 400, 999).json()['offset'], 1000)
+
+        response = self.finalize(upload_id)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['sha256'], hashlib.sha256(self.content).hexdigest())
+        with UploadedFile.objects.get().file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+
+    def test_chunk_must_start_at_the_offset(self):
+        upload_id = self.start().json()['upload_id']
+        self.put(upload_id, 0, 399)
+        response = self.put(upload_id, 200, 599)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 400)
+
+    def test_leased_upload_rejects_a_second_writer(self):
+        upload_id = self.start().json()['upload_id']
+        self.put(upload_id, 0, 399)
+        # Another request is mid-chunk
+        ChunkedUpload.objects.update(locked_until=timezone.now() + timedelta(minutes=1))
+
+        self.assertEqual(self.put(upload_id, 400, 999).status_code, 409)
+        self.assertEqual(os.path.getsize(part_path(ChunkedUpload.objects.get())), 400)
+
+        # Its lease ran out: the upload can carry on
+        ChunkedUpload.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.put(upload_id, 400, 999).status_code, 200)
+
+    def test_chunk_size_is_capped(self):
+        upload_id = self.start().json()['upload_id']
+        with mock.patch('API.uploads.MAX_CHUNK_SIZE', 500):
+            self.assertEqual(self.put(upload_id, 0, 999).status_code, 413)
+            self.assertEqual(self.put(upload_id, 0, 499).status_code, 200)
+            self.assertEqual(self.put(upload_id, 500, 999).status_code, 200)
+        self.assertEqual(self.finalize(upload_id).status_code, 201)
+
+    def test_cached_hash_is_not_advanced_by_its_users(self):
+        upload_id = self.start().json()['upload_id']
+        self.put(upload_id, 0, 399)
+        upload = ChunkedUpload.objects.get()
+
+        # A writer that lost its lease updates its hasher, then fails to commit
+        stale = _hasher_at(upload, 400)
+        stale.update(b'garbage')
+
+        self.assertEqual(_hasher_at(upload, 400).hexdigest(), hashlib.sha256(self.content[:400]).hexdigest())
+        self.put(upload_id, 400, 999)
+        self.assertEqual(self.finalize(upload_id).json()['sha256'], hashlib.sha256(self.content).hexdigest())
+
+    def test_room_must_be_the_senders_room_with_the_receiver(self):
+        User.objects.create(username='carol')
+        self.assertEqual(self.start(room_name='bobandcarol').status_code, 403)
+        self.assertEqual(self.start(receiver='carol').status_code, 403)
+
+    def test_finalize_is_idempotent(self):
+        upload_id = self.upload()
+        first = self.finalize(upload_id)
+        second = self.finalize(upload_id)
+        self.assertEqual((first.status_code, second.status_code), (201, 200))
+        self.assertEqual(first.json()['id'], second.json()['id'])
+        self.assertEqual(UploadedFile.objects.count(), 1)
+
+    def test_finalize_retry_after_the_part_file_moved(self):
+        upload_id = self.upload()
+        with mock.patch.object(UploadedFile.objects, 'create', side_effect=RuntimeError("boom")):
+            with self.assertLogs('API.uploads', level='ERROR'):
+                self.assertEqual(self.finalize(upload_id).status_code, 500)
+        self.assertFalse(os.path.exists(part_path(ChunkedUpload.objects.get())))
+
+        self.assertEqual(self.finalize(upload_id).status_code, 201)
+        self.assertEqual(UploadedFile.objects.count(), 1)
+
+    def test_expired_uploads_are_gone_and_cleaned_up(self):
+        upload_id = self.start().json()['upload_id']
+        upload = ChunkedUpload.objects.get()
+        ChunkedUpload.objects.update(updated_at=timezone.now() - timedelta(days=2))
+        orphan = os.path.join(os.path.dirname(part_path(upload)), 'orphan.part')
+        open(orphan, 'wb').close()
+        old = (timezone.now() - timedelta(days=2)).timestamp()
+        os.utime(orphan, (old, old))
+
+        self.assertEqual(self.put(upload_id, 0, 999).status_code, 404)
+
+        call_command('cleanup_chunked_uploads', stdout=StringIO())
+        self.assertFalse(ChunkedUpload.objects.exists())
+        self.assertFalse(os.path.exists(part_path(upload)))
+        self.assertFalse(os.path.exists(orphan))
+
+
+class BlobReferenceTests(APITestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(self.settings(MEDIA_ROOT=media_root))
+        channel_layers.set(DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer())
+        cache.clear()
+
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.carol = User.objects.create(username='carol')
+        self.content = os.urandom(1000)
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+
+    def store(self, sender=None, receiver=None):
+        sender, receiver = sender or self.alice, receiver or self.bob
+        tmp_path, sha256 = blob_storage.stage(ContentFile(self.content))
+        with transaction.atomic():
+            name = blob_storage.adopt(tmp_path, sha256, 'notes.bin')
+            return UploadedFile.objects.create(
+                sender=sender, receiver=receiver, room_name=room_name_for(sender.username, receiver.username),
+                file=name, file_name='notes.bin',
+            )
+
+    def start_by_hash(self, user, receiver):
+        self.client.force_authenticate(user)
+        return self.client.post('/API/upload-file/chunked/', {
+            'receiver': receiver.username, 'room_name': room_name_for(user.username, receiver.username),
+            'file_name': 'notes.bin', 'size': len(self.content), 'sha256': self.sha256,
+        }, format='json')
+
+    def test_hash_is_reused_for_a_file_the_user_already_has(self):
+        self.store()
+        # Bob received it, so he may forward it without sending the bytes
+        response = self.start_by_hash(self.bob, self.carol)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.json()['deduplicated'])
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_hash_of_someone_elses_file_starts_a_normal_upload(self):
+        self.store()
+        response = self.start_by_hash(self.carol, self.bob)
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('upload_id', response.json())
+        self.assertNotIn('deduplicated', response.json())
+        self.assertFalse(UploadedFile.objects.filter(sender=self.carol).exists())
+
+    def test_last_release_deletes_the_file(self):
+        uploaded = self.store()
+        path = blob_storage.path(uploaded.file.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            uploaded.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_file_referenced_again_before_collection_survives(self):
+        uploaded = self.store()
+        path = blob_storage.path(uploaded.file.name)
+        with self.captureOnCommitCallbacks() as callbacks:
+            uploaded.delete()
+        # A duplicate upload lands between the release and its commit hook
+        self.store(self.bob, self.alice)
+        for callback in callbacks:
+            callback()
+
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+    def test_multipart_upload_is_stored_once(self):
+        self.client.force_authenticate(self.alice)
+        for _ in range(2):
+            response = self.client.post('/API/upload-file/', {
+                'sender': 'alice', 'receiver': 'bob', 'room_name': 'aliceandbob', 'file_name': 'notes.bin',
+                'size': len(self.content), 'file': ContentFile(self.content, name='notes.bin'),
+            })
+            self.assertEqual(response.status_code, 201)
+
+        blob = Blob.objects.get()
+        self.assertEqual((blob.sha256, blob.ref_count), (self.sha256, 2))
+        self.assertEqual(os.listdir(blob_storage.path('uploaded_files/tmp')), [])
+
+    def upload(self, room_name='aliceandbob', **fields):
+        self.client.force_authenticate(self.alice)
+        return self.client.post('/API/upload-file/', {
+            'sender': 'alice', 'receiver': 'bob', 'room_name': room_name, 'file_name': 'notes.bin',
+            'size': len(self.content), 'file': ContentFile(self.content, name='notes.bin'), **fields,
+        })
+
+    def stored_files(self):
+        root = blob_storage.path('uploaded_files')
+        return [
+            os.path.join(path, name) for path, dirs, names in os.walk(root)
+            for name in names if os.path.relpath(path, root).split(os.sep)[0] != 'tmp'
+        ]
+
+    def test_upload_into_someone_elses_room_is_refused_before_storing(self):
+        response = self.upload(room_name='bobandcarol')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.stored_files(), [])
+        self.assertFalse(Blob.objects.exists())
+
+    def test_sender_field_is_ignored(self):
+        response = self.upload(sender='carol')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(UploadedFile.objects.get().sender, self.alice)
+
+    def test_failed_save_removes_the_adopted_file(self):
+        with mock.patch.object(UploadedFile, 'save', side_effect=IntegrityError("boom")), \
+                self.assertLogs('API.views', level='ERROR'):
+            response = self.upload()
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.stored_files(), [])
+        self.assertFalse(Blob.objects.exists())
+
+    def test_failed_save_keeps_a_file_already_referenced(self):
+        existing = self.store()
+        with mock.patch.object(UploadedFile, 'save', side_effect=IntegrityError("boom")), \
+                self.assertLogs('API.views', level='ERROR'):
+            self.upload()
+        self.assertEqual(self.stored_files(), [blob_storage.path(existing.file.name)])
+        self.assertEqual(Blob.objects.get().ref_count, 1)
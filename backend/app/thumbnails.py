@@ -0,0 +1,175 @@
+# thumbnails.py
+#
+# Small fixed-size variants of image uploads and profile photos, so chat
+# history and the contact list don't download full-size originals. Variants
+# are rendered in a process pool after the upload is committed and stored
+# next to the original as <name>.<variant>.<ext>.
+#
+# Whether they exist is recorded on the row, in <field>_variants_ready
+# (UploadedFile.file_variants_ready, UserProfile.profile_photo_variants_ready),
+# when the pool reports back, for every row pointing at the same file. URLs
+# are built from that flag alone, falling back to the original until it is
+# set, so serializing a page of messages never touches the disk.
+
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+VARIANTS = getattr(settings, 'THUMBNAIL_VARIANTS', {
+    'thumb': (160, 160),
+    'preview': (640, 640),
+})
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def thumbnail_format():
+    from PIL import features
+    fmt = getattr(settings, 'THUMBNAIL_FORMAT', None)
+    if fmt:
+        return fmt
+    return 'WEBP' if features.check('webp') else 'JPEG'
+
+
+def is_image(name, content_type=None):
+    if content_type:
+        return content_type.startswith('image/')
+    return os.path.splitext(name or '')[1].lower() in IMAGE_EXTENSIONS
+
+
+def variant_name(name, variant, fmt=None):
+    ext = 'webp' if (fmt or thumbnail_format()) == 'WEBP' else 'jpg'
+    return f"{name}.{variant}.{ext}"
+
+
+def render_variants(source_path, targets, fmt):
+    """
+    Runs in a pool worker: write each (path, (width, height)) variant of the
+    image at ``source_path``. Files are written to a temp name and renamed
+    so readers never see a partial image.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGBA')
+
+        for path, size in targets:
+            variant = image.copy()
+            variant.thumbnail(size)
+            tmp_path = f"{path}.tmp"
+            variant.save(tmp_path, fmt, quality=80)
+            os.replace(tmp_path, path)
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a process that runs an event loop and DB
+            # connections is asking for trouble
+            _pool = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'THUMBNAIL_WORKERS', 2),
+                mp_context=get_context('spawn'),
+            )
+    return _pool
+
+
+def ready_field(fieldfile):
+    return f"{fieldfile.field.name}_variants_ready"
+
+
+def mark_variants(model, field_name, name, ready):
+    """Set the readiness flag on every ``model`` row whose ``field_name`` is ``name``."""
+    from .sqlite import run_write
+    run_write(_mark_variants, model, field_name, name, ready)
+
+
+def _mark_variants(model, field_name, name, ready):
+    from .contacts import invalidate_contact_lists
+    from .models import ContactList, UserProfile
+
+    flag = f"{field_name}_variants_ready"
+    updated = model.objects.filter(**{field_name: name}).exclude(**{flag: ready}).update(**{flag: ready})
+    if updated and model is UserProfile:
+        # Cached contact lists hold the avatar URLs
+        invalidate_contact_lists(*ContactList.objects.filter(
+            contacts__userprofile__profile_photo=name
+        ).values_list('user_id', flat=True))
+
+
+def schedule_variants(fieldfile):
+    """Queue variant rendering for an image FieldFile; marks it ready when done already."""
+    if not fieldfile or not is_image(fieldfile.name):
+        return
+
+    storage, name = fieldfile.storage, fieldfile.name
+    model, field_name = type(fieldfile.instance), fieldfile.field.name
+    fmt = thumbnail_format()
+    targets = [
+        (storage.path(variant_name(name, variant, fmt)), size)
+        for variant, size in VARIANTS.items()
+        if not storage.exists(variant_name(name, variant, fmt))
+    ]
+    ready = getattr(fieldfile.instance, ready_field(fieldfile))
+    if not targets:
+        if not ready:
+            mark_variants(model, field_name, name, True)
+        return
+    if ready:
+        # Left over from a previous photo
+        mark_variants(model, field_name, name, False)
+
+    def report(future):
+        # Runs on the pool's result thread
+        try:
+            error = future.exception()
+            if error is not None:
+                logger.error(f"Failed to render variants for {name}: {str(error)}")
+                return
+            mark_variants(model, field_name, name, True)
+        except Exception as e:
+            logger.error(f"Could not record variants for {name}: {str(e)}")
+        finally:
+            connections.close_all()
+
+    try:
+        get_pool().submit(render_variants, storage.path(name), targets, fmt).add_done_callback(report)
+    except Exception as e:
+        logger.error(f"Could not queue variants for {name}: {str(e)}")
+
+
+def variant_urls(fieldfile):
+    """{variant: url} for an image FieldFile, using the original until ready."""
+    if not fieldfile or not is_image(fieldfile.name):
+        return None
+    storage, name = fieldfile.storage, fieldfile.name
+    ready = getattr(fieldfile.instance, ready_field(fieldfile), False)
+    fmt = thumbnail_format()
+    return {
+        variant: storage.url(variant_name(name, variant, fmt) if ready else name)
+        for variant in VARIANTS
+    }
+
+
+def delete_variants(storage, name):
+    fmt = thumbnail_format()
+    for variant in VARIANTS:
+        candidate = variant_name(name, variant, fmt)
+        if storage.exists(candidate):
+            storage.delete(candidate)
@@ -1,16 +1,22 @@
 import os
 from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
-from channels.auth import AuthMiddlewareStack
-import app.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
+# Set up Django before importing anything that touches models or settings
+django_asgi_app = get_asgi_application()
+
+import app.routing
+from app.lifespan import lifespan_app
+from app.middleware import JWTAuthMiddlewareStack
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "http": django_asgi_app,
+    "websocket": JWTAuthMiddlewareStack(
         URLRouter(
             app.routing.websocket_urlpatterns
         )
     ),
+    "lifespan": lifespan_app,
 })
@@ -41,12 +41,18 @@ INSTALLED_APPS = [
 
 # Middleware
 MIDDLEWARE = [
+    # First, so the latency it records covers the rest of the stack
+    'app.metrics.MetricsMiddleware',
+    # Only active with QUERY_PROFILER['ENABLED']
+    'app.profiling.QueryProfilerMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Only active with DATABASE_REPLICAS
+    'app.routers.PrimaryPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -84,6 +90,34 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Chat messages are written behind the broadcast, in batches of BATCH_SIZE
+# or every FLUSH_INTERVAL_MS, whichever comes first. At MAX_PENDING unwritten
+# messages the sending socket waits for the database
+MESSAGE_WRITE_BUFFER = {
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL_MS': 50,
+    'MAX_PENDING': 10000,
+}
+
+# Cache (contact lists, room -> Conversation ids). Point CACHE_URL at Redis when running more than one
+# worker so invalidations reach every process.
+if os.environ.get('CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['CACHE_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+CONTACT_LIST_CACHE_TIMEOUT = 300
+CONVERSATION_CACHE_TIMEOUT = 3600
+
 # Database
 DATABASES = {
     'default': {
@@ -92,6 +126,42 @@ DATABASES = {
     }
 }
 
+# SQLite production mode (SQLITE_PRODUCTION=True). Every connection switches
+# to WAL (readers no longer wait for the writer), fsyncs only at
+# checkpoints, waits up to busy_timeout ms for a lock instead of failing
+# with "database is locked", and gets a 256 MB mmap and 64 MB page cache.
+# IMMEDIATE transactions take the write lock up front, so a transaction
+# that reads and then writes can't deadlock against another writer.
+# Request-path writes also go through one writer thread (app/sqlite.py).
+# That trades some write throughput under concurrent reads for no lock
+# errors; `manage.py bench_sqlite` compares both modes
+SQLITE_PRODUCTION = os.environ.get('SQLITE_PRODUCTION') == 'True'
+SQLITE_PRODUCTION_OPTIONS = {
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA busy_timeout=5000;'
+        'PRAGMA mmap_size=268435456;'
+        'PRAGMA cache_size=-65536;'
+        'PRAGMA temp_store=MEMORY'
+    ),
+    'transaction_mode': 'IMMEDIATE',
+}
+SQLITE_SERIALIZE_WRITES = SQLITE_PRODUCTION
+if SQLITE_PRODUCTION:
+    DATABASES['default']['OPTIONS'] = SQLITE_PRODUCTION_OPTIONS
+
+# Read replicas (app/routers.py): comma-separated SQLite files, added as
+# aliases replica_1, replica_2, ... For PostgreSQL, add the aliases to
+# DATABASES and list them in DATABASE_REPLICAS. A user who writes reads from
+# the primary for the next REPLICA_PIN_SECONDS
+DATABASE_REPLICAS = []
+for i, name in enumerate(filter(None, os.environ.get('REPLICA_DATABASE_NAMES', '').split(',')), 1):
+    DATABASES[f'replica_{i}'] = dict(DATABASES['default'], NAME=name, TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(f'replica_{i}')
+DATABASE_ROUTERS = ['app.routers.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = 5
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -113,6 +183,104 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# Media is served by API/media.py. Behind nginx, set this to an internal
+# location aliased to MEDIA_ROOT to hand transfers off with X-Accel-Redirect.
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX')
+MEDIA_MAX_AGE = 60 * 60
+
+# Image variants rendered in the background (app/thumbnails.py)
+THUMBNAIL_VARIANTS = {
+    'thumb': (160, 160),
+    'preview': (640, 640),
+}
+THUMBNAIL_WORKERS = 2
+
+# Largest file accepted by the chunked upload endpoints (API/uploads.py)
+CHUNKED_UPLOAD_MAX_SIZE = 2 * 1024 ** 3
+# Largest single PUT. Under ASGI Django spools the whole body before the
+# view runs and a dropped connection loses it, so this bounds both the
+# spool and what a failed chunk costs to resend. Also cap the body size at
+# the proxy (nginx client_max_body_size).
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 8 * 1024 ** 2
+# Uploads untouched this long are gone; cleanup_chunked_uploads deletes their
+# rows and part files. One chunk may take up to LEASE seconds to send.
+CHUNKED_UPLOAD_EXPIRY_SECONDS = 24 * 3600
+CHUNKED_UPLOAD_LEASE_SECONDS = 600
+# Running hashes kept per process, so resuming doesn't re-read the part file
+CHUNKED_UPLOAD_HASHER_CACHE_SIZE = 1000
+
+# Presence and typing indicators (app/presence.py). Clients send a
+# heartbeat every HEARTBEAT_INTERVAL; changes are broadcast at most once per
+# BROADCAST_INTERVAL per room
+PRESENCE = {
+    'HEARTBEAT_INTERVAL_SECONDS': 25,
+    'HEARTBEAT_TIMEOUT_SECONDS': 60,
+    'TYPING_TIMEOUT_SECONDS': 4,
+    'BROADCAST_INTERVAL_MS': 250,
+}
+
+# Micro-batched outbound frames for sockets that connect with ?batch=1
+# (app/batching.py)
+WEBSOCKET_BATCH = {
+    'MAX_DELAY_MS': 5,
+    'MAX_EVENTS': 32,
+}
+
+# Rows fetched per database round trip by the conversation export
+# (API/export.py)
+EXPORT_CHUNK_SIZE = 2000
+
+# Prometheus scrape endpoint (/metrics, app/metrics.py). When set, the
+# scraper must send "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Per-request query profiler and N+1 detector (app/profiling.py). Off by
+# default; query templates repeated REPEAT_THRESHOLD or more times in one
+# request or WebSocket handler are logged as warnings
+QUERY_PROFILER = {
+    'ENABLED': os.environ.get('QUERY_PROFILER') == 'True',
+    'REPEAT_THRESHOLD': 5,
+}
+
+# Structured logging (app/logs.py): records are queued and written as JSON
+# lines by a background thread, so logging never blocks the event loop.
+# Per-frame events are sampled; PAYLOADS adds message bodies (debug only)
+LOG_EVENTS = {
+    'SAMPLE_RATES': {
+        'ws.frame': 0.01,
+        'ws.broadcast': 0.01,
+        'message.enqueued': 0.01,
+        'history.page': 0.1,
+    },
+    'DEFAULT_SAMPLE_RATE': 1.0,
+    'PAYLOADS': os.environ.get('LOG_PAYLOADS') == 'True',
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'app.logs.JSONFormatter'},
+    },
+    'handlers': {
+        'background': {'class': 'app.logs.BackgroundHandler', 'formatter': 'json'},
+    },
+    'root': {'handlers': ['background'], 'level': os.environ.get('LOG_LEVEL', 'INFO')},
+    'loggers': {
+        # Replaces Django's own console handler
+        'django': {'handlers': ['background'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Background mail sender (app/mail.py): messages per connection batch and
+# retry policy (delay doubles after each failed attempt)
+EMAIL_QUEUE = {
+    'BATCH_SIZE': 20,
+    'MAX_RETRIES': 5,
+    'BACKOFF_SECONDS': 1.0,
+    'IDLE_TIMEOUT_SECONDS': 30.0,
+}
+
 
 WHITENOISE_USE_FINDERS = True
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
@@ -128,8 +296,21 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'API.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'API.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
+# JSON backend for REST bodies and WebSocket frames (app/codec.py):
+# 'auto' uses orjson when installed, else the stdlib
+JSON_CODEC = os.environ.get('JSON_CODEC', 'auto')
+
 # SimpleJWT config
 from datetime import timedelta
 
@@ -142,6 +323,9 @@ SIMPLE_JWT = {
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
 }
 
+# Verified WebSocket access tokens kept in memory (see app/middleware.py)
+WEBSOCKET_JWT_CACHE_SIZE = 10000
+
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
 
@@ -156,6 +340,18 @@ CORS_ALLOW_HEADERS = list(default_headers) + [
     'Content-Type',
 ]
 
+# Let the browser read the history pagination cursors
+CORS_EXPOSE_HEADERS = [
+    'X-Before-Cursor',
+    'X-After-Cursor',
+    'X-Has-More',
+    'ETag',
+]
+
+# Message history pagination
+MESSAGE_PAGE_SIZE = 50
+MESSAGE_PAGE_SIZE_MAX = 200
+
 
 
 # Email settings
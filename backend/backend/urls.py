@@ -1,11 +1,16 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from API.media import MediaView
+from app.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('API/', include('API.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    re_path(rf"^{settings.MEDIA_URL.lstrip('/')}(?P<path>.+)$", MediaView.as_view(), name='media'),
 
 
     #add swagger
@@ -13,6 +18,5 @@ urlpatterns = [
  ]
 
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
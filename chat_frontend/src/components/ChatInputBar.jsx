@@ -1,3 +1,4 @@
+import { useRef } from 'react';
 import { Box, TextField, IconButton, useMediaQuery, Tooltip } from '@mui/material';
 import { useTheme } from '@mui/material/styles';
 import SendIcon from '@mui/icons-material/Send';
@@ -16,6 +17,17 @@ const ChatInputBar = ({
 }) => {
   const theme = useTheme();
   const isMobile = useMediaQuery(theme.breakpoints.down('sm'));
+  const lastTypingSent = useRef(0);
+
+  // The server debounces typing, so once every couple of seconds is enough
+  const notifyTyping = () => {
+    const socket = socketRef?.current;
+    const now = Date.now();
+    if (socket && socket.readyState === WebSocket.OPEN && now - lastTypingSent.current > 2000) {
+      lastTypingSent.current = now;
+      socket.send(JSON.stringify({ type: 'typing' }));
+    }
+  };
 
   function getRoomName(sender, receiver) {
     const sorted = [sender, receiver].sort();
@@ -43,7 +55,10 @@ const ChatInputBar = ({
       <TextField
         placeholder="Type a message"
         value={message}
-        onChange={(e) => setMessage(e.target.value)}
+        onChange={(e) => {
+          setMessage(e.target.value);
+          notifyTyping();
+        }}
         disabled={!selectedContact}
         size="small"
         fullWidth
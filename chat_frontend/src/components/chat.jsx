@@ -20,11 +20,21 @@ import { Chip } from '@mui/material';
 
 const BACKEND_BASE_URL = process.env.REACT_APP_BACKEND_BASE_URL;
 const BACKEND_HOST = process.env.REACT_APP_BACKEND_HOST
+// Must stay under PRESENCE HEARTBEAT_TIMEOUT_SECONDS on the server
+const HEARTBEAT_INTERVAL_MS = 25000;
 
 
 console.log("checking !!!!!!!" , BACKEND_BASE_URL , BACKEND_HOST)
 
 
+// Media is served only to logged-in room members; <img>/<video> can't send
+// an Authorization header, so the access token goes in the query string
+function withToken(url) {
+  const token = localStorage.getItem('accessToken');
+  if (!url || !token) return url;
+  return `${url}${url.includes('?') ? '&' : '?'}token=${encodeURIComponent(token)}`;
+}
+
 // Avatar fallback
 function getInitials(name) {
   if (!name) return '';
@@ -44,12 +54,22 @@ export default function ChatApp() {
   const [sending, setSending] = useState(false);
   const [loadingContacts, setLoadingContacts] = useState(true);
   const [loadingMessages, setLoadingMessages] = useState(false);
+  // History comes a page at a time: X-Before-Cursor of the oldest page
+  // loaded, or null once X-Has-More says there is nothing older
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const [error, setError] = useState('');
   const [addDialogOpen, setAddDialogOpen] = useState(false);
   const [user, setUser] = useState(null);
   const [uploadDialogOpen, setUploadDialogOpen] = useState(false);
+  const [peerPresence, setPeerPresence] = useState(null);
+  const [peerTyping, setPeerTyping] = useState(false);
   const { enqueueSnackbar } = useSnackbar();
   const messagesEndRef = useRef(null);
+  // Set while prepending older messages, so the view stays where it is
+  const keepScrollRef = useRef(false);
+  // The chat currently open, for requests that finish after a switch
+  const openChatRef = useRef(null);
   const wsRef = useRef(null);
   const reconnectTimeout = useRef(null);
 
@@ -147,12 +167,18 @@ export default function ChatApp() {
 
   // Refetch messages when selected contact changes
   useEffect(() => {
+    setOlderCursor(null);
+    openChatRef.current = selectedContact?.name ?? null;
     if (selectedContact && user) fetchMessages(selectedContact.name);
     else setMessages([]);
   }, [selectedContact, user]);
 
-  // Scroll to bottom whenever messages change
+  // Scroll to bottom whenever messages change, unless older ones were loaded
   useEffect(() => {
+    if (keepScrollRef.current) {
+      keepScrollRef.current = false;
+      return;
+    }
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   }, [messages]);
 
@@ -168,11 +194,19 @@ export default function ChatApp() {
     let socket;
     let reconnectAttempts = 0;
     let closedByUser = false;
+    let heartbeat;
+
+    setPeerPresence(null);
+    setPeerTyping(false);
 
     function connectWS() {
       const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
       const wsUrl = `${protocol}://${BACKEND_HOST}/ws/chat/${getRoomName(selectedContact.name, user.username)}/`;
-      socket = new window.WebSocket(wsUrl);
+      // Authenticate the socket with the same JWT the REST API uses
+      const accessToken = localStorage.getItem('accessToken');
+      socket = accessToken
+        ? new window.WebSocket(wsUrl, ['bearer', accessToken])
+        : new window.WebSocket(wsUrl);
       wsRef.current = socket;
 
       console.log('[WebSocket] Connecting to:', wsUrl);
@@ -181,47 +215,67 @@ export default function ChatApp() {
         reconnectAttempts = 0;
         setError('');
         console.log('[WebSocket] Connected');
+        // Keeps us "online" while the tab is idle
+        clearInterval(heartbeat);
+        heartbeat = setInterval(() => {
+          if (socket.readyState === WebSocket.OPEN) socket.send(JSON.stringify({ type: 'heartbeat' }));
+        }, HEARTBEAT_INTERVAL_MS);
+      };
+
+      const handleFrame = (data) => {
+        console.log('[WebSocket] Message received:', data);
+
+        // Presence and typing indicators for the open chat
+        if (data.type === 'presence' || data.type === 'typing') {
+          if (data.user === selectedContact.name) {
+            if (data.type === 'presence') setPeerPresence(data);
+            else setPeerTyping(data.typing);
+          }
+          return;
+        }
+
+        // Handle file messages
+        if (data.type === "file") {
+
+          console.log("handling file messages",data);
+          setMessages(prev => [
+            ...prev,
+            {
+              from: data.sender === user.username ? 'me' : data.sender,
+              type: 'file',
+              file: data.file_url,
+              fileType: data.file_type,
+              fileName: data.file_name, // or use a separate field if you have it
+              timestamp: data.timestamp || new Date().toISOString(),
+              text: data.message, // fallback for display
+              size: data.size
+
+            }
+          ]);
+        }
+        // Handle text messages
+        else if (data.message && data.sender !== user.username) {
+
+          console.log("Handling text messages");
+          setPeerTyping(false);
+
+          setMessages(prev => [
+            ...prev,
+            {
+              from: data.sender === user.username ? 'me' : data.sender,
+              type : 'text',
+              text: data.message,
+              timestamp: data.timestamp || new Date().toISOString(),
+            }
+          ]);
+        }
       };
 
       socket.onmessage = (event) => {
         try {
-          const data = JSON.parse(event.data);
-          console.log('[WebSocket] Message received:', data);
-
-          // Handle file messages
-          if (data.type === "file") {
-
-            console.log("handling file messages",data);
-            setMessages(prev => [
-              ...prev,
-              {
-                from: data.sender === user.username ? 'me' : data.sender,
-                type: 'file',
-                file: data.file_url,
-                fileType: data.file_type,
-                fileName: data.file_name, // or use a separate field if you have it
-                timestamp: data.timestamp || new Date().toISOString(),
-                text: data.message, // fallback for display
-                size: data.size
-
-              }
-            ]);
-          }
-          // Handle text messages
-          else if (data.message && data.sender !== user.username) {
-
-            console.log("Handling text messages");
-
-            setMessages(prev => [
-              ...prev,
-              {
-                from: data.sender === user.username ? 'me' : data.sender,
-                type : 'text',
-                text: data.message,
-                timestamp: data.timestamp || new Date().toISOString(),
-              }
-            ]);
-          }
+          // Sockets opened with ?batch=1 receive arrays of events
+          const payload = JSON.parse(event.data);
+          (Array.isArray(payload) ? payload : [payload]).forEach(handleFrame);
         } catch (err) {
           console.error('[WebSocket] Failed to parse message:', event.data, err);
         }
@@ -229,6 +283,7 @@ export default function ChatApp() {
 
       socket.onclose = (event) => {
         wsRef.current = null;
+        clearInterval(heartbeat);
         console.warn('[WebSocket] Closed', event);
         if (!closedByUser && reconnectAttempts < 5) {
           reconnectAttempts += 1;
@@ -252,6 +307,7 @@ export default function ChatApp() {
 
     return () => {
       closedByUser = true;
+      clearInterval(heartbeat);
       if (reconnectTimeout.current) clearTimeout(reconnectTimeout.current);
       if (socket && (socket.readyState === WebSocket.OPEN || socket.readyState === WebSocket.CONNECTING)) {
         socket.close();
@@ -262,7 +318,48 @@ export default function ChatApp() {
 
  
 
-  // Fetch messages for a contact
+  // Page cursor for older history, or null when this is the oldest page
+  const olderCursorFrom = (res) =>
+    res.headers['x-has-more'] === 'true' ? res.headers['x-before-cursor'] || null : null;
+
+  // Turn a page from messages/<room> into chat bubbles, oldest first
+  const formatMessages = (data) => {
+    if (!Array.isArray(data)) throw new Error('Invalid messages format');
+    let arr = data;
+    if (arr.length && arr[0].timestamp) arr.sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
+    else if (arr.length && arr[0].index) arr.sort((a, b) => a.index - b.index);
+    return arr.map(msg => {
+      // Determine sender name (number or string)
+      let senderName = typeof msg.sender === 'string'
+        ? msg.sender
+        : (contacts.find(c => c.id === msg.sender)?.name || msg.sender);
+
+      // Compare senderName to user.id to set 'from'
+      const isMe = senderName === user.id;
+
+      if (msg.file) {
+        return {
+          from: isMe ? 'me' : senderName,
+          type: 'file',
+          file: `${BACKEND_BASE_URL}${msg.file}`,
+          fileType: msg.file_type || '',
+          fileName: msg.file_name || 'File',
+          timestamp: msg.timestamps || msg.timestamp || new Date().toISOString(),
+          text: msg.message ,
+          size : msg.size
+        };
+      } else {
+        return {
+          from: isMe ? 'me' : senderName,
+          type: 'text',
+          text: msg.message,
+          timestamp: msg.timestamps || msg.timestamp || new Date().toISOString(),
+        };
+      }
+    });
+  };
+
+  // Fetch the newest page of messages for a contact
   const fetchMessages = async (contactName) => {
     setLoadingMessages(true);
     setError('');
@@ -271,43 +368,12 @@ export default function ChatApp() {
       const res = await api.get(`messages/${getRoomName(contactName, user.username)}`);
 
       console.log('Fetched messages:', res.data);
-      if (!Array.isArray(res.data)) throw new Error('Invalid messages format');
-      let arr = res.data;
-      if (arr.length && arr[0].timestamp) arr.sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
-      else if (arr.length && arr[0].index) arr.sort((a, b) => a.index - b.index);
-      const formatted = arr.map(msg => {
-        // Determine sender name (number or string)
-        let senderName = typeof msg.sender === 'string'
-          ? msg.sender
-          : (contacts.find(c => c.id === msg.sender)?.name || msg.sender);
-
-        // Compare senderName to user.id to set 'from'
-        const isMe = senderName === user.id;
-
-        if (msg.file) {
-          return {
-            from: isMe ? 'me' : senderName,
-            type: 'file',
-            file: `${BACKEND_BASE_URL}${msg.file}`,
-            fileType: msg.file_type || '',
-            fileName: msg.file_name || 'File',
-            timestamp: msg.timestamps || msg.timestamp || new Date().toISOString(),
-            text: msg.message ,
-            size : msg.size
-          };
-        } else {
-          return {
-            from: isMe ? 'me' : senderName,
-            type: 'text',
-            text: msg.message,
-            timestamp: msg.timestamps || msg.timestamp || new Date().toISOString(),
-          };
-        }
-      });
-      
+      const formatted = formatMessages(res.data);
+
         console.log('Formatted messages:', formatted);
         console.log('logged in user', user , "selected contact", selectedContact);
       setMessages(formatted);
+      setOlderCursor(olderCursorFrom(res));
     } catch {
       setError('Failed to load messages');
     } finally {
@@ -315,6 +381,28 @@ export default function ChatApp() {
     }
   };
 
+  // Prepend the page before the oldest message shown
+  const loadOlderMessages = async () => {
+    if (!selectedContact || !olderCursor || loadingOlder) return;
+    const contactName = selectedContact.name;
+    setLoadingOlder(true);
+    try {
+      const res = await api.get(`messages/${getRoomName(contactName, user.username)}`, {
+        params: { before: olderCursor },
+      });
+      // The user may have opened another chat meanwhile
+      if (openChatRef.current !== contactName) return;
+      const older = formatMessages(res.data);
+      keepScrollRef.current = true;
+      setMessages(prev => [...older, ...prev]);
+      setOlderCursor(olderCursorFrom(res));
+    } catch {
+      enqueueSnackbar('Failed to load older messages', { variant: 'error' });
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   // Send message function (via WS or fallback API)
   const handleSendMessage = async () => {
     if (!message.trim() || sending || !selectedContact) return;
@@ -428,7 +516,7 @@ export default function ChatApp() {
                 >
                   <ListItemAvatar>
                     {contact.avatar ? (
-                      <Avatar src={`${BACKEND_BASE_URL}/${contact.avatar}`} alt={contact.name[0]} />
+                      <Avatar src={withToken(`${BACKEND_BASE_URL}/${contact.avatar}`)} alt={contact.name[0]} />
                     ) : (
                       <Avatar>{getInitials(contact.name)}</Avatar>
                     )}
@@ -462,7 +550,7 @@ export default function ChatApp() {
         <Stack direction="row" spacing={2} alignItems="center">
           <Avatar
             alt={user?.username}
-            src={`${BACKEND_BASE_URL}/${user?.avatar}`}
+            src={withToken(`${BACKEND_BASE_URL}/${user?.avatar}`)}
             sx={{ width: 40, height: 40 }}
           />
           <Typography
@@ -546,9 +634,29 @@ export default function ChatApp() {
                   <MenuIcon />
                 </IconButton>
               )}
-              <Typography variant="h6" sx={{ flexGrow: 1 }}>
-                {selectedContact ? selectedContact.name : 'Select a contact'}
-              </Typography>
+              <Box sx={{ flexGrow: 1 }}>
+                <Typography variant="h6">
+                  {selectedContact ? selectedContact.name : 'Select a contact'}
+                </Typography>
+                {selectedContact && (peerTyping || peerPresence) && (
+                  <Typography variant="caption" sx={{ color: '#bbb' }}>
+                    {peerTyping
+                      ? 'typing…'
+                      : peerPresence.online
+                        ? 'online'
+                        : peerPresence.last_seen
+                          ? `last seen ${new Date(peerPresence.last_seen).toLocaleString('en-IN', {
+                              timeZone: 'Asia/Kolkata',
+                              day: '2-digit',
+                              month: '2-digit',
+                              hour: 'numeric',
+                              minute: '2-digit',
+                              hour12: true,
+                            })}`
+                          : ''}
+                  </Typography>
+                )}
+              </Box>
             </Toolbar>
           </AppBar>
 
@@ -576,6 +684,13 @@ export default function ChatApp() {
               </Typography>
     ) : (
       <>
+        {olderCursor && (
+          <Box sx={{ textAlign: 'center', my: 1 }}>
+            <Button size="small" onClick={loadOlderMessages} disabled={loadingOlder}>
+              {loadingOlder ? <CircularProgress size={18} /> : 'Load older messages'}
+            </Button>
+          </Box>
+        )}
         {messages.map((msg, i) => {
           const isMine = msg.from === 'me';
           const alignment = isMine ? 'flex-end' : 'flex-start';
@@ -615,18 +730,18 @@ export default function ChatApp() {
     {msg.fileType?.startsWith('audio/') ? (
       <>
         <Typography variant="body2" sx={{ fontWeight: 500 }}>{msg.fileName }</Typography>
-        <audio controls src={msg.file} style={{ width: '100%' }} />
+        <audio controls src={withToken(msg.file)} style={{ width: '100%' }} />
       </>
     ) : msg.fileType == 'video/mp4' || msg.fileType == 'video/webm' ? (
       <>
         <Typography variant="body2" sx={{ fontWeight: 500 }}>{msg.fileName || 'Unnamed File'}</Typography>
-        <video controls src={msg.file} style={{ width: '100%' }} />
+        <video controls src={withToken(msg.file)} style={{ width: '100%' }} />
       </>
     ) : (
       <Typography
         variant="body2"
         component="a"
-        href={msg.file}
+        href={withToken(msg.file)}
         target="_blank"
         rel="noopener noreferrer"
         sx={{ color: isMine ? '#fff' : '#1976d2', textDecoration: 'underline', wordBreak: 'break-word', fontWeight: 500 }}